@@ -0,0 +1,210 @@
+import math
+
+
+class EwmaStats(object):
+    """Exponentially weighted mean and variance of a stream of values,
+    the first 1 / alpha values are weighted equally (as by Welford's
+    algorithm) so early estimates are not biased by the first values.
+    Slots keep the state of thousands of keys small"""
+    __slots__ = ('count', 'mean', 'variance')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.variance = 0.0
+
+    def update(self, value, alpha):
+        self.count += 1
+        weight = max(alpha, 1.0 / self.count)
+        diff = value - self.mean
+        increment = weight * diff
+        self.mean += increment
+        self.variance = (1 - weight) * (self.variance + diff * increment)
+
+    def update_zeros(self, count, alpha):
+        """Same as count updates with the value 0 in O(1)"""
+        # values are weighted equally while there are at most 1 / alpha
+        equal = min(count, max(0, int(1.0 / alpha) - self.count))
+        if equal:
+            total = self.count + equal
+            self.variance = (self.variance * self.count +
+                             self.mean ** 2 * self.count * equal / float(total)) / total
+            self.mean = self.mean * self.count / float(total)
+            self.count = total
+        rest = count - equal
+        if rest:
+            decay = (1 - alpha) ** rest
+            self.variance = decay * (self.variance + self.mean ** 2 * (1 - decay))
+            self.mean *= decay
+            self.count += rest
+
+
+def seconds_per_hour(start, end):
+    """Number of seconds from start up to end in each hour of the day"""
+    hour_2_seconds = {}
+    second = start
+    while second < end:
+        hour_end = min(end, second - second % 3600 + 3600)
+        hour = (second // 3600) % 24
+        hour_2_seconds[hour] = hour_2_seconds.get(hour, 0) + hour_end - second
+        second = hour_end
+    return hour_2_seconds
+
+
+class KeyState(object):
+    """Baseline of the hits per second of a key (and of each hour of
+    the day if seasonal), level is a short term average of its hits
+    per second. The state is up to date as of second last"""
+    __slots__ = ('baseline', 'hourly', 'level', 'raised', 'last')
+
+    def __init__(self, seasonal, last):
+        self.baseline = EwmaStats()
+        self.hourly = [EwmaStats() for _ in range(24)] if seasonal else None
+        self.level = 0.0
+        self.raised = False
+        self.last = last
+
+
+class AnomalyDetector(object):
+    """Detects anomalously high hits per second of keys (None for all
+    hits, or sections) relative to a baseline learned from the hits
+    per second of each key: an exponentially weighted mean and
+    variance with a half life of HALF_LIFE seconds, kept for each
+    hour of the day if seasonal. The level of a key is an
+    exponentially weighted average of its hits per second over about
+    hits_interval seconds, an alert is raised when the level is more
+    than sigmas standard deviations (of such an average) above the
+    baseline mean and cleared once it is at most clear_sigmas above.
+    Keys are not alerted on until their baseline has min_samples
+    seconds. State is O(1) per key, at most MAX_KEYS keys are tracked.
+    Only keys with hits or raised alerts are evaluated each second,
+    the seconds without hits of other keys are applied in O(1) when
+    they next have hits or every SWEEP_INTERVAL seconds, when keys
+    without traffic are forgotten"""
+    HALF_LIFE = 3600
+    MAX_KEYS = 10000
+    # at most MAX_CATCH_UP seconds are evaluated when advancing
+    MAX_CATCH_UP = 3600
+    SWEEP_INTERVAL = 60
+    # keys whose baseline and level fall below FORGET_LEVEL are forgotten
+    FORGET_LEVEL = 0.001
+
+    def __init__(self, hits_interval, sigmas=3.0, clear_sigmas=None, seasonal=False,
+                 by_section=False, min_samples=None):
+        super(AnomalyDetector, self).__init__()
+        self.hits_interval = hits_interval
+        self.sigmas = sigmas
+        self.clear_sigmas = sigmas / 2.0 if clear_sigmas is None else clear_sigmas
+        self.seasonal = seasonal
+        self.by_section = by_section
+        self.min_samples = 2 * hits_interval if min_samples is None else min_samples
+        self.alpha = 1 - 0.5 ** (1.0 / self.HALF_LIFE)
+        self.level_alpha = 2.0 / (hits_interval + 1)
+        # standard deviation of the level relative to that of the hits
+        # per second (if the hits of seconds are independent)
+        self.level_scale = math.sqrt(self.level_alpha / (2 - self.level_alpha))
+        # key -> KeyState
+        self.keys = {}
+        self._raised_keys = set()
+        # second -> key -> hits of seconds not yet evaluated
+        self._second_2_counts = {}
+        # latest second evaluated
+        self.closed = None
+        self.dropped_keys = 0
+
+    def insert(self, key, second, hits):
+        """Inserts hits of key at epoch second, hits of seconds
+        already evaluated are counted in the next second"""
+        if self.closed is not None and second <= self.closed:
+            second = self.closed + 1
+        counts = self._second_2_counts.get(second)
+        if counts is None:
+            counts = self._second_2_counts[second] = {}
+        counts[key] = counts.get(key, 0) + hits
+
+    def advance(self, second):
+        """Evaluates the seconds before second, returns (key, raised,
+        level, mean, std) of the keys raised or cleared where level,
+        mean and std are per second"""
+        end = second - 1
+        if self.closed is None:
+            self.closed = min([end] + list(self._second_2_counts)) - 1
+        start = max(self.closed + 1, end - self.MAX_CATCH_UP + 1)
+        events = []
+        for evaluated in range(start, end + 1):
+            counts = self._second_2_counts.pop(evaluated, None)
+            events.extend(self.evaluate_second(evaluated, counts or {}))
+        for skipped in [skipped for skipped in self._second_2_counts if skipped < start]:
+            del self._second_2_counts[skipped]
+        self.closed = max(self.closed, end)
+        return events
+
+    def expected(self, state, hour):
+        """Baseline of a key at an hour of the day, the baseline of all
+        hours is used until that of the hour has min_samples seconds"""
+        if self.seasonal and state.hourly[hour].count >= self.min_samples:
+            return state.hourly[hour]
+        return state.baseline
+
+    def catch_up(self, state, second):
+        """Applies the seconds without hits of a key before second"""
+        idle = second - state.last - 1
+        if idle <= 0:
+            return
+        state.level *= (1 - self.level_alpha) ** idle
+        state.baseline.update_zeros(idle, self.alpha)
+        if self.seasonal:
+            for hour, seconds in seconds_per_hour(state.last + 1, second).items():
+                state.hourly[hour].update_zeros(seconds, self.alpha)
+        state.last = second - 1
+
+    def evaluate_second(self, second, counts):
+        keys = self.keys
+        for key in counts:
+            if key not in keys:
+                if len(keys) >= self.MAX_KEYS:
+                    self.dropped_keys += 1
+                    continue
+                keys[key] = KeyState(self.seasonal, second - 1)
+        # logged times are local times
+        hour = (second // 3600) % 24
+        alpha = self.alpha
+        events = []
+        # the level of keys without hits only decreases
+        for key in self._raised_keys.union(counts):
+            state = keys.get(key)
+            if state is None:
+                continue
+            self.catch_up(state, second)
+            hits = counts.get(key, 0)
+            state.level += self.level_alpha * (hits - state.level)
+            stats = self.expected(state, hour)
+            if stats.count >= self.min_samples:
+                # the variance is at least that of poisson arrivals
+                std = math.sqrt(max(stats.variance, stats.mean, 1.0))
+                score = (state.level - stats.mean) / (std * self.level_scale)
+                if not state.raised and score > self.sigmas:
+                    state.raised = True
+                    self._raised_keys.add(key)
+                    events.append((key, True, state.level, stats.mean, std))
+                elif state.raised and score <= self.clear_sigmas:
+                    state.raised = False
+                    self._raised_keys.discard(key)
+                    events.append((key, False, state.level, stats.mean, std))
+            state.baseline.update(hits, alpha)
+            if self.seasonal:
+                state.hourly[hour].update(hits, alpha)
+            state.last = second
+        if second % self.SWEEP_INTERVAL == 0:
+            self.sweep(second)
+        return events
+
+    def sweep(self, second):
+        """Brings all keys up to date as of second and
+        forgets the keys without traffic"""
+        for key, state in self.keys.items():
+            self.catch_up(state, second + 1)
+            if (not state.raised and state.level < self.FORGET_LEVEL and
+                state.baseline.count >= self.min_samples and
+                state.baseline.mean < self.FORGET_LEVEL):
+                del self.keys[key]
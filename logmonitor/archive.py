@@ -0,0 +1,126 @@
+import os
+import re
+import zlib
+try:
+    import zstandard
+except ImportError:
+    # zstd archives are not supported
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    # lz4 archives are not supported
+    lz4 = None
+
+# number of (compressed) bytes read from an archive at a time
+READ_SIZE = 4 * 1024 * 1024
+# maximum number of decompressed bytes yielded at a time
+BLOCK_SIZE = 4 * 1024 * 1024
+# zstd decompressors have no output limit, zstd archives are read
+# block_size // ZSTD_RATIO bytes at a time so that blocks are about
+# block_size bytes for the compression ratios of logs
+ZSTD_RATIO = 16
+
+
+def gzip_decompressor():
+    # 16 + MAX_WBITS expects a gzip header and trailer
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def zstd_decompressor():
+    if zstandard is None:
+        raise IOError("zstandard is not installed, cannot read zstd archives")
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def lz4_decompressor():
+    if lz4 is None:
+        raise IOError("lz4 is not installed, cannot read lz4 archives")
+    return lz4.frame.LZ4FrameDecompressor()
+
+
+# file extension -> function returning a streaming decompressor
+EXTENSION_2_DECOMPRESSOR = {'.gz': gzip_decompressor,
+                            '.zst': zstd_decompressor,
+                            '.lz4': lz4_decompressor}
+
+
+def is_compressed(filepath):
+    return os.path.splitext(filepath)[1] in EXTENSION_2_DECOMPRESSOR
+
+
+def decompress_blocks(decompressor, data, block_size):
+    """Generator yielding the data decompressed from data in blocks
+    of at most block_size bytes (about block_size bytes for zstd),
+    data after the end of a member is left in unused_data"""
+    if hasattr(decompressor, 'unconsumed_tail'):
+        # zlib keeps the input not decompressed yet, which is
+        # also in unused_data once the member has ended
+        while data and not decompressor.unused_data:
+            block = decompressor.decompress(data, block_size)
+            if block:
+                yield block
+            data = decompressor.unconsumed_tail
+    elif hasattr(decompressor, 'needs_input'):
+        # lz4 buffers the input and needs more input once
+        # all the data it can produce has been returned
+        block = decompressor.decompress(data, block_size)
+        while True:
+            if block:
+                yield block
+            if decompressor.needs_input or decompressor.eof:
+                break
+            block = decompressor.decompress('', block_size)
+    else:
+        # zstd, see ZSTD_RATIO
+        block = decompressor.decompress(data)
+        if block:
+            yield block
+
+
+def decompressed_blocks(filepath, read_size=READ_SIZE, block_size=BLOCK_SIZE):
+    """Generator yielding blocks of the decompressed data of a file
+    compressed with gzip, zstd or lz4 (by extension), the data of
+    other files is yielded as is. Files made of several compressed
+    members (e.g. concatenated gzip files) are read to the end"""
+    new_decompressor = EXTENSION_2_DECOMPRESSOR.get(os.path.splitext(filepath)[1])
+    with open(filepath, 'rb') as archive:
+        if new_decompressor is None:
+            while True:
+                block = archive.read(read_size)
+                if not block:
+                    return
+                yield block
+        decompressor = new_decompressor()
+        if new_decompressor is zstd_decompressor:
+            read_size = min(read_size, max(1, block_size // ZSTD_RATIO))
+        while True:
+            data = archive.read(read_size)
+            if not data:
+                break
+            while data:
+                for block in decompress_blocks(decompressor, data, block_size):
+                    yield block
+                # data after the end of a member starts the next member
+                data = getattr(decompressor, 'unused_data', '')
+                if data:
+                    decompressor = new_decompressor()
+        flush = getattr(decompressor, 'flush', None)
+        if flush is not None:
+            block = flush()
+            if block:
+                yield block
+
+
+def rotated_filepaths(filepath):
+    """Returns the rotated archives of a log file (e.g. access.log.1,
+    access.log.2.gz) ordered from oldest to newest, a higher number
+    is older"""
+    dirpath, filename = os.path.split(filepath)
+    pattern = re.compile(re.escape(filename) + r'\.(\d+)(\.gz|\.zst|\.lz4)?$')
+    number_2_filepath = {}
+    for candidate in os.listdir(dirpath or os.curdir):
+        match = pattern.match(candidate)
+        if match:
+            number_2_filepath[int(match.group(1))] = os.path.join(dirpath, candidate)
+    return [number_2_filepath[number] for number in sorted(number_2_filepath, reverse=True)]
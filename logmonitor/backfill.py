@@ -0,0 +1,161 @@
+import os
+import multiprocessing
+from .logparser import create_logparser
+from .notifier import SummaryData, SummaryNotifier, AlertNotifier
+from .utils import datetime_to_seconds, seconds_to_datetime
+from .archive import is_compressed, rotated_filepaths
+from .columnar import ColumnarAggregate
+
+# smallest byte range a log file is split into
+MIN_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class ChunkAggregate(object):
+    """Mergeable stats of the lines in a range of a log file,
+    if summary_interval is None all lines are summarized in
+    a single interval 0"""
+    def __init__(self, summary_interval, top_k):
+        super(ChunkAggregate, self).__init__()
+        self.summary_interval = summary_interval
+        self.top_k = top_k
+        # summary interval index -> SummaryData
+        self.interval_2_summary = {}
+        self.second_2_hits = {}
+
+    def insert_data(self, linedata, filepath=None):
+        second = datetime_to_seconds(linedata.datetime)
+        self.second_2_hits[second] = self.second_2_hits.get(second, 0) + 1
+        interval = 0
+        if self.summary_interval is not None:
+            interval = second // self.summary_interval
+        summary_data = self.interval_2_summary.get(interval)
+        if summary_data is None:
+            summary_data = self.interval_2_summary[interval] = SummaryData(self.top_k)
+        summary_data.insert_data(linedata, filepath)
+
+    def insert_lines(self, linedatas, filepath=None):
+        """Inserts a batch of LineData"""
+        for linedata in linedatas:
+            self.insert_data(linedata, filepath)
+
+    def flush(self):
+        """Called once all lines have been inserted"""
+        for summary_data in self.interval_2_summary.values():
+            summary_data.flush()
+
+    def merge(self, other):
+        for interval, summary_data in other.interval_2_summary.items():
+            if interval in self.interval_2_summary:
+                self.interval_2_summary[interval].merge(summary_data)
+            else:
+                self.interval_2_summary[interval] = summary_data
+        for second, hits in other.second_2_hits.items():
+            self.second_2_hits[second] = self.second_2_hits.get(second, 0) + hits
+
+
+def chunk_ranges(filepath, num_chunks):
+    """Splits a file into at most num_chunks (start, end) byte
+    ranges aligned on the start of lines"""
+    size = os.path.getsize(filepath)
+    num_chunks = max(1, min(num_chunks, size // MIN_CHUNK_SIZE))
+    boundaries = [0]
+    with open(filepath, 'rb') as logfile:
+        for i in range(1, num_chunks):
+            logfile.seek(max(size * i // num_chunks, boundaries[-1]))
+            # move to the start of the next line
+            logfile.readline()
+            boundaries.append(logfile.tell())
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:])
+            if start < end]
+
+
+def parse_chunk(task):
+    """Parses lines in a byte range of a log file returning
+    a ChunkAggregate, run by worker processes. The whole file
+    is parsed if end is None (e.g. compressed archives). Lines are
+    aggregated by the numpy columnar engine if columnar is True"""
+    logtype, filepath, start, end, summary_interval, top_k, perfile, columnar = task
+    logparser = create_logparser(logtype, filepath)
+    if columnar:
+        aggregate = ColumnarAggregate(summary_interval, top_k)
+    else:
+        aggregate = ChunkAggregate(summary_interval, top_k)
+    source = filepath if perfile else None
+    if end is None:
+        for lines in logparser.read_archive(filepath):
+            aggregate.insert_lines(logparser.parse_lines(lines), source)
+    else:
+        logparser.logfile = logparser.open_logfile()
+        with logparser.logfile:
+            if logtype == 'w3c':
+                # field directive in effect at the start of the range
+                logparser.fieldnames = logparser.find_last_field_directive(start) or []
+            for lines in logparser.read_range(start, end):
+                aggregate.insert_lines(logparser.parse_lines(lines), source)
+    aggregate.flush()
+    return aggregate
+
+
+def alert_messages(second_2_hits, hits_interval, hits_threshold):
+    """Yields (second, Message) for alerts and recoveries as an 
+    event time AlertNotifier displays them"""
+    alert_notifier = AlertNotifier(None, 1, hits_interval, hits_threshold, event_time=True)
+    if not second_2_hits:
+        return
+    for second in sorted(second_2_hits):
+        for message in alert_notifier.insert_event(second, second_2_hits[second]):
+            yield message.data['time'], message
+    # evaluate until the last hits fall out of the window
+    for message in alert_notifier.advance_watermark(second + hits_interval + 1):
+        yield message.data['time'], message
+
+
+def backfill(args, display):
+    """Parses whole log files in a pool of processes and displays
+    the summaries and alerts in the order of the logged times"""
+    processes = args['processes'] or multiprocessing.cpu_count()
+    summary_interval = args['summaryinterval']
+    top_k = args['topsections']
+    tasks = []
+
+    def add_task(filepath, start, end):
+        tasks.append((args['logtype'], filepath, start, end,
+                      summary_interval, top_k, args['perfile'], args['columnar']))
+
+    for filepath in args['logfilepaths']:
+        if args['rotated']:
+            for archive in rotated_filepaths(filepath):
+                add_task(archive, 0, None)
+        if is_compressed(filepath):
+            # compressed files cannot be split
+            add_task(filepath, 0, None)
+            continue
+        for start, end in chunk_ranges(filepath, processes * 4):
+            add_task(filepath, start, end)
+
+    aggregate = ChunkAggregate(summary_interval, top_k)
+    pool = multiprocessing.Pool(processes)
+    try:
+        for chunk_aggregate in pool.imap_unordered(parse_chunk, tasks):
+            aggregate.merge(chunk_aggregate)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    # a summary is displayed at the end of its interval
+    summary_notifier = SummaryNotifier(None, summary_interval, top_k)
+    timed_messages = []
+    for interval, summary_data in aggregate.interval_2_summary.items():
+        start = interval * summary_interval
+        message = summary_notifier.summary_message(summary_data, seconds_to_datetime(start))
+        timed_messages.append((start + summary_interval, message))
+    timed_messages.extend(alert_messages(aggregate.second_2_hits,
+                                         args['hitsinterval'],
+                                         args['hitsthreshold']))
+    timed_messages.sort(key=lambda timed_message: timed_message[0])
+    for _, message in timed_messages:
+        display.show(message)
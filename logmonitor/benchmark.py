@@ -0,0 +1,487 @@
+"""Benchmarks of logmonitor on synthetic logs:
+
+    python -m logmonitor.benchmark [options]
+
+prints the results as JSON, results of runs with the same options
+can be compared (or given as a baseline)"""
+import sys
+import os
+import json
+import time
+import datetime
+import random
+import bisect
+import shutil
+import tempfile
+import platform
+import argparse
+from threading import Thread, Event
+try:
+    import resource
+except ImportError:
+    # peak memory is not measured
+    resource = None
+from .logparser import create_logparser
+from .notifier import SummaryNotifier, AlertNotifier, MESSAGE_TYPES
+from .multifollow import MultiLogFollower
+from .stats import Stats
+from .utils import seconds_to_datetime
+from . import __version__
+
+
+class ZipfSampler(object):
+    """Samples integers in [0, n) with probability proportional
+    to 1 / (k + 1) ** skew, 0 being the most frequent"""
+    def __init__(self, n, skew, rand):
+        super(ZipfSampler, self).__init__()
+        self.rand = rand
+        self.cumulative_weights = []
+        total = 0.0
+        for k in range(n):
+            total += 1.0 / (k + 1) ** skew
+            self.cumulative_weights.append(total)
+
+    def sample(self):
+        value = self.rand.random() * self.cumulative_weights[-1]
+        return min(bisect.bisect_right(self.cumulative_weights, value),
+                   len(self.cumulative_weights) - 1)
+
+
+class LogGenerator(object):
+    """Deterministic generator of synthetic log lines, the same
+    options always generate the same lines. rate lines are logged
+    per second, multiplied by burst_factor during the first
+    burst_duration seconds of every burst_interval seconds (if not 0).
+    Sections of lines are drawn from a Zipf distribution over
+    sections sections, error_ratio of lines have a 4xx or 5xx status.
+    W3C logs change the order of their fields with a new field
+    directive every directive_interval lines (if not 0)"""
+    # fields of the W3C field directives used in turn
+    W3C_FIELDS = [['date', 'time', 'c-ip', 'cs-host', 'cs-method', 'cs-uri-stem',
+                   'sc-status', 'sc-bytes', 'time-taken'],
+                  ['date', 'time', 'cs-host', 'cs-uri-stem', 'sc-status', 'sc-bytes'],
+                  ['time-taken', 'sc-bytes', 'sc-status', 'cs-uri-stem', 'cs-method',
+                   'cs-host', 'c-ip', 'time', 'date']]
+    ERROR_STATUSES = [400, 403, 404, 500, 503]
+    OK_STATUSES = [200, 200, 200, 200, 204, 301, 304]
+    # pages per section
+    PAGES = 100
+    # 2000-01-01 00:00:00
+    START = 946684800
+
+    def __init__(self, logtype='common', rate=100, sections=100, skew=1.1,
+                 error_ratio=0.05, hosts=50, directive_interval=0,
+                 burst_interval=0, burst_factor=10, burst_duration=5, seed=0):
+        super(LogGenerator, self).__init__()
+        self.logtype = logtype
+        self.rate = rate
+        self.sections = sections
+        self.skew = skew
+        self.error_ratio = error_ratio
+        self.hosts = hosts
+        self.directive_interval = directive_interval
+        self.burst_interval = burst_interval
+        self.burst_factor = burst_factor
+        self.burst_duration = burst_duration
+        self.seed = seed
+        self.rand = random.Random(seed)
+        self.section_sampler = ZipfSampler(sections, skew, self.rand)
+        self._fields_index = 0
+        # datetime -> formatted time strings
+        self._time_strs = {}
+
+    def config(self):
+        """Options of the generator"""
+        return dict((name, getattr(self, name))
+                    for name in ['logtype', 'rate', 'sections', 'skew', 'error_ratio',
+                                 'hosts', 'directive_interval', 'burst_interval',
+                                 'burst_factor', 'burst_duration', 'seed'])
+
+    def rate_at(self, second):
+        """Lines logged in the second-th second"""
+        if self.burst_interval and second % self.burst_interval < self.burst_duration:
+            return self.rate * self.burst_factor
+        return self.rate
+
+    def header(self):
+        """Directive lines starting a log file"""
+        if self.logtype != 'w3c':
+            return []
+        return ["#Version: 1.0", self.field_directive()]
+
+    def field_directive(self):
+        return "#Fields: " + " ".join(self.W3C_FIELDS[self._fields_index])
+
+    def lines(self, count):
+        """Generator yielding the header and count lines (and any
+        field directives) logged from START onwards"""
+        for line in self.header():
+            yield line
+        second = 0
+        generated = 0
+        while generated < count:
+            datetime_val = seconds_to_datetime(self.START + second)
+            for _ in range(min(self.rate_at(second), count - generated)):
+                if (self.logtype == 'w3c' and self.directive_interval and
+                    generated > 0 and generated % self.directive_interval == 0):
+                    self._fields_index = (self._fields_index + 1) % len(self.W3C_FIELDS)
+                    yield self.field_directive()
+                yield self.line(datetime_val)
+                generated += 1
+            second += 1
+
+    def line(self, datetime_val):
+        """A line logged at datetime_val"""
+        rand = self.rand
+        host_index = rand.randrange(self.hosts)
+        uri = "/section%d/page%d.html" % (self.section_sampler.sample(),
+                                          rand.randrange(self.PAGES))
+        if rand.random() < self.error_ratio:
+            status = rand.choice(self.ERROR_STATUSES)
+        else:
+            status = rand.choice(self.OK_STATUSES)
+        bytes = int(rand.lognormvariate(8, 1.5))
+        # microseconds
+        latency = int(rand.lognormvariate(10, 1))
+        time_strs = self._time_strs.get(datetime_val)
+        if time_strs is None:
+            if len(self._time_strs) > 1024:
+                self._time_strs.clear()
+            time_strs = self._time_strs[datetime_val] = (
+                datetime_val.strftime("%d/%b/%Y:%H:%M:%S"),
+                datetime_val.strftime("%Y-%m-%d"),
+                datetime_val.strftime("%H:%M:%S"))
+        if self.logtype != 'w3c':
+            return '10.0.%d.%d - - [%s +0000] "GET %s HTTP/1.1" %d %d %d' % (
+                host_index // 256, host_index % 256, time_strs[0], uri, status, bytes, latency)
+        values = {'date': time_strs[1],
+                  'time': time_strs[2],
+                  'c-ip': '10.0.0.1',
+                  'cs-host': 'www%d.example.com' % host_index,
+                  'cs-method': 'GET',
+                  'cs-uri-stem': uri,
+                  'sc-status': str(status),
+                  'sc-bytes': str(bytes),
+                  # milliseconds
+                  'time-taken': str(latency // 1000)}
+        return " ".join(values[field] for field in self.W3C_FIELDS[self._fields_index])
+
+
+class TimingDisplay(object):
+    """Records the time messages are shown at and
+    the time the latest high traffic alert was shown"""
+    def __init__(self):
+        super(TimingDisplay, self).__init__()
+        # (time, message)
+        self.shown = []
+        self.alert_time = None
+        self.alert_shown = Event()
+
+    def show(self, message):
+        now = time.time()
+        self.shown.append((now, message))
+        if message.type == MESSAGE_TYPES.alert and message.lines and message.data['alert']:
+            self.alert_time = now
+            self.alert_shown.set()
+
+
+def percentile(values, q):
+    """q-th quantile of values (nearest rank), None if empty"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def current_rss():
+    """Resident memory of the process in bytes, None if unknown"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def peak_rss():
+    """Peak resident memory of the process in bytes, None if unknown"""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes except on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def write_log(dirpath, lines):
+    filepath = os.path.join(dirpath, 'access-log')
+    with open(filepath, 'wb') as logfile:
+        for line in lines:
+            logfile.write(line + '\n')
+    return filepath
+
+
+def measure_ingest(generator, count, top_k=10, repeat=3):
+    """Throughput (lines per second, best of repeat runs) of reading
+    and parsing a log file of count lines and of inserting the lines
+    into the summary and alert notifiers. Memory per distinct section
+    is the resident memory grown by the first run divided by the
+    number of distinct sections"""
+    dirpath = tempfile.mkdtemp()
+    try:
+        filepath = write_log(dirpath, generator.lines(count))
+        best = {'parse': 0.0, 'summary': 0.0, 'alert': 0.0, 'ingest': 0.0}
+        result = {}
+        for run in range(repeat):
+            rss_before = current_rss()
+            logparser = create_logparser(generator.logtype, filepath)
+            logparser.stats = Stats()
+            # notifiers are not started so only inserts are measured
+            summary_notifier = SummaryNotifier(None, 1, top_k)
+            alert_notifier = AlertNotifier(None, 1, 120, sys.maxint)
+            sections = set()
+            parse_time = summary_time = alert_time = 0.0
+            batches = logparser.read_archive(filepath)
+            while True:
+                start = time.time()
+                lines = next(batches, None)
+                if lines is None:
+                    break
+                linedatas = logparser.parse_lines(lines)
+                parsed = time.time()
+                for linedata in linedatas:
+                    summary_notifier.insert_data(linedata)
+                summarized = time.time()
+                for linedata in linedatas:
+                    alert_notifier.insert_data(linedata)
+                alerted = time.time()
+                parse_time += parsed - start
+                summary_time += summarized - parsed
+                alert_time += alerted - summarized
+                if run == 0:
+                    sections.update(linedata.section for linedata in linedatas)
+            counters = logparser.stats.snapshot()['counters']
+            parsed_lines = counters.get('lines_parsed', 0)
+            for name, seconds in [('parse', parse_time), ('summary', summary_time),
+                                  ('alert', alert_time),
+                                  ('ingest', parse_time + summary_time + alert_time)]:
+                if seconds > 0:
+                    best[name] = max(best[name], parsed_lines / seconds)
+            if run == 0:
+                rss_after = current_rss()
+                rss_growth = None
+                if rss_before is not None and rss_after is not None:
+                    rss_growth = rss_after - rss_before
+                result.update({'lines': parsed_lines,
+                               'parse_errors': counters.get('parse_errors', 0),
+                               'bytes': counters.get('bytes_read', 0),
+                               'distinct_sections': len(sections),
+                               'rss_growth_bytes': rss_growth,
+                               'bytes_per_section': (None if rss_growth is None or not sections
+                                                     else rss_growth / float(len(sections)))})
+        for name, lines_per_sec in best.items():
+            result[name + '_lines_per_sec'] = lines_per_sec
+        return result
+    finally:
+        shutil.rmtree(dirpath)
+
+
+def measure_alert_latency(generator, trials=3, hits_interval=2, hits_threshold=100,
+                          timeout=5.0):
+    """Seconds between hits_threshold + 1 lines (logged at the current
+    time) being written to a followed log file and the high traffic
+    alert being shown, for trials bursts. Each burst is written once
+    the alert of the previous burst has recovered"""
+    dirpath = tempfile.mkdtemp()
+    try:
+        filepath = write_log(dirpath, generator.header())
+        logparser = create_logparser(generator.logtype, filepath)
+        display = TimingDisplay()
+        alert_notifier = AlertNotifier(display, 1, hits_interval, hits_threshold)
+        alert_notifier.start()
+        follower = MultiLogFollower([logparser])
+        stopping = Event()
+
+        def follow():
+            for _, linedata in follower.parsedlines():
+                if stopping.isSet():
+                    break
+                alert_notifier.insert_data(linedata)
+
+        follower_thread = Thread(target=follow)
+        follower_thread.setDaemon(True)
+        follower_thread.start()
+        # wait for the log file to be followed from its end
+        while logparser.logfile is None:
+            time.sleep(0.01)
+        time.sleep(0.1)
+
+        latencies = []
+        timeouts = 0
+        with open(filepath, 'ab') as logfile:
+            for _ in range(trials):
+                # wait for the previous alert to recover
+                deadline = time.time() + hits_interval + timeout
+                while alert_notifier.is_alert_displayed and time.time() < deadline:
+                    time.sleep(0.05)
+                display.alert_shown.clear()
+                now = datetime.datetime.now().replace(microsecond=0)
+                burst = "".join(generator.line(now) + '\n'
+                                for _ in range(hits_threshold + 1))
+                start = time.time()
+                logfile.write(burst)
+                logfile.flush()
+                if display.alert_shown.wait(timeout):
+                    latencies.append(display.alert_time - start)
+                else:
+                    timeouts += 1
+            stopping.set()
+            logfile.write(generator.line(datetime.datetime.now()) + '\n')
+            logfile.flush()
+        follower_thread.join(timeout)
+        alert_notifier.stop()
+        alert_notifier.repeater_thread.join()
+        latencies_ms = [latency * 1000 for latency in latencies]
+        return {'trials': trials,
+                'timeouts': timeouts,
+                'watcher': follower.watcher.__class__.__name__,
+                'latency_ms_p50': percentile(latencies_ms, 0.5),
+                'latency_ms_max': max(latencies_ms) if latencies_ms else None}
+    finally:
+        shutil.rmtree(dirpath)
+
+
+def measure_tick_jitter(generator, count, duration=3.0, interval=0.1, top_k=10):
+    """Deviation of the intervals between summaries from interval
+    while lines are inserted into the summary notifier as fast as
+    possible for duration seconds"""
+    logparser = create_logparser(generator.logtype, '')
+    logparser.reset_fields()
+    linedatas = logparser.parse_lines(list(generator.lines(count)))
+    display = TimingDisplay()
+    stats = Stats()
+    summary_notifier = SummaryNotifier(display, interval, top_k, stats)
+    summary_notifier.start()
+    inserted = 0
+    end = time.time() + duration
+    while time.time() < end:
+        for linedata in linedatas:
+            summary_notifier.insert_data(linedata)
+        inserted += len(linedatas)
+    summary_notifier.stop()
+    summary_notifier.repeater_thread.join()
+    tick_times = [shown_time for shown_time, message in display.shown
+                  if message.type == MESSAGE_TYPES.summary]
+    jitters_ms = [abs(later - earlier - interval) * 1000
+                  for earlier, later in zip(tick_times, tick_times[1:])]
+    counters = stats.snapshot()['counters']
+    return {'interval_ms': interval * 1000,
+            'ticks': len(tick_times),
+            'missed_ticks': counters.get('missed_ticks', 0),
+            'lines_inserted': inserted,
+            'jitter_ms_p50': percentile(jitters_ms, 0.5),
+            'jitter_ms_p99': percentile(jitters_ms, 0.99),
+            'jitter_ms_max': max(jitters_ms) if jitters_ms else None}
+
+
+def compare(results, baseline):
+    """Ratios of the numeric results to those of a baseline,
+    keyed by dotted result names"""
+    ratios = {}
+    for name, value in results.items():
+        baseline_value = baseline.get(name)
+        if isinstance(value, dict) and isinstance(baseline_value, dict):
+            for subname, ratio in compare(value, baseline_value).items():
+                ratios[name + '.' + subname] = ratio
+        elif (isinstance(value, (int, long, float)) and not isinstance(value, bool) and
+              isinstance(baseline_value, (int, long, float)) and baseline_value):
+            ratios[name] = value / float(baseline_value)
+    return ratios
+
+
+def run(args):
+    """Runs the benchmarks, returns the results as a dictionary"""
+    def generator():
+        return LogGenerator(args['logtype'], args['rate'], args['sections'], args['skew'],
+                            args['errors'], args['hosts'], args['directives'],
+                            args['bursts'], args['burstfactor'], args['burstduration'],
+                            args['seed'])
+
+    config = generator().config()
+    config.update({'lines': args['lines'], 'repeat': args['repeat'],
+                   'trials': args['trials'], 'duration': args['duration']})
+    results = {'ingest': measure_ingest(generator(), args['lines'], repeat=args['repeat'])}
+    if args['trials']:
+        results['alert'] = measure_alert_latency(generator(), args['trials'])
+    if args['duration']:
+        results['ticks'] = measure_tick_jitter(generator(), min(args['lines'], 10000),
+                                               args['duration'])
+    results['peak_rss_bytes'] = peak_rss()
+    return {'config': config,
+            'environment': {'logmonitor': __version__,
+                            'python': platform.python_version(),
+                            'platform': sys.platform},
+            'results': results}
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+            description="""benchmarks logmonitor on a synthetic log: parse and
+                           insert throughput, memory per distinct section,
+                           latency from writing lines to alerting and jitter
+                           of summary ticks, results are printed as JSON""",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-l', '--logtype', help='type of log file',
+            default = 'common', choices=['w3c', 'common'])
+    parser.add_argument('-n', '--lines', help='number of lines parsed',
+            default = 200000, type = int)
+    parser.add_argument('--rate', help='lines logged per second',
+            default = 100, type = int)
+    parser.add_argument('--sections', help='number of distinct sections',
+            default = 100, type = int)
+    parser.add_argument('--skew', help='zipf skew of the popularity of sections',
+            default = 1.1, type = float)
+    parser.add_argument('--hosts', help='number of distinct hosts',
+            default = 50, type = int)
+    parser.add_argument('--errors', help='ratio of lines with a 4xx or 5xx status',
+            default = 0.05, type = float)
+    parser.add_argument('--directives',
+            help='lines between w3c field directive changes (0 for none)',
+            default = 0, type = int)
+    parser.add_argument('--bursts', help='seconds between bursts (0 for none)',
+            default = 0, type = int)
+    parser.add_argument('--burstfactor', help='rate multiplier during bursts',
+            default = 10, type = int)
+    parser.add_argument('--burstduration', help='seconds bursts last',
+            default = 5, type = int)
+    parser.add_argument('--seed', help='seed of the log generator',
+            default = 0, type = int)
+    parser.add_argument('--repeat', help='runs throughput is the best of',
+            default = 3, type = int)
+    parser.add_argument('--trials', help='alert latency trials (0 to skip)',
+            default = 3, type = int)
+    parser.add_argument('--duration', help='seconds tick jitter is measured for (0 to skip)',
+            default = 3.0, type = float)
+    parser.add_argument('-o', '--output', help='file results are written to',
+            default = None)
+    parser.add_argument('--baseline',
+            help='results of a previous run the results are compared to',
+            default = None)
+    return parser
+
+
+def main():
+    args = vars(get_parser().parse_args())
+    report = run(args)
+    if args['baseline']:
+        with open(args['baseline']) as baselinefile:
+            baseline = json.load(baselinefile)
+        report['baseline_ratios'] = compare(report['results'], baseline['results'])
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args['output']:
+        with open(args['output'], 'w') as outputfile:
+            outputfile.write(output + '\n')
+    else:
+        print output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import os
+import time
+import json
+
+# checkpoints are saved as JSON, strings read from log files (sections,
+# file paths) are bytes that may not be UTF-8 so they are stored as
+# latin-1, which maps each byte to one character
+ENCODING = 'latin-1'
+
+
+def to_bytes(value):
+    """Converts the unicode strings of loaded JSON values back to bytes"""
+    if isinstance(value, unicode):
+        return value.encode(ENCODING)
+    if isinstance(value, list):
+        return [to_bytes(item) for item in value]
+    if isinstance(value, dict):
+        return dict((to_bytes(key), to_bytes(item)) for key, item in value.items())
+    return value
+
+
+class Checkpoint(object):
+    """Periodically saves the position of log parsers in their log
+    files along with the state of the summary and alert notifiers,
+    so that after a restart lines written while the monitor was
+    down are read and the alert window is not empty. The state is
+    saved as a JSON document of plain values (offsets, inodes,
+    counters and sketch buckets) tagged with VERSION, checkpoints
+    of other versions are ignored and monitoring starts afresh.
+    Saves must be made by the thread inserting data between
+    batches of lines"""
+    # seconds between saves
+    INTERVAL = 5.0
+    # version of the saved state, changed when its format changes
+    VERSION = 1
+
+    def __init__(self, path, logparsers, summary_notifier, alert_notifier):
+        super(Checkpoint, self).__init__()
+        self.path = path
+        self.logparsers = logparsers
+        self.summary_notifier = summary_notifier
+        self.alert_notifier = alert_notifier
+        self._last_save = time.time()
+
+    def load(self):
+        """Returns the saved state, None if there is none
+        or it was saved by another version"""
+        try:
+            with open(self.path, 'rb') as checkpointfile:
+                state = json.load(checkpointfile, encoding=ENCODING)
+        except (IOError, ValueError):
+            return None
+        if not isinstance(state, dict) or state.get('version') != self.VERSION:
+            return None
+        return to_bytes(state)
+
+    def restore(self):
+        """Opens the log files at their saved positions and restores
+        the notifiers. Returns False if there was no saved state"""
+        state = self.load()
+        if state is None:
+            return False
+        try:
+            filepath_2_state = state['logfiles']
+            second_2_hits = dict(state['alert'])
+            # nothing is restored if the summary state is malformed
+            self.summary_notifier.restore_state(state['summary'])
+        except (KeyError, TypeError, ValueError):
+            return False
+        self.alert_notifier.restore_state(second_2_hits)
+        for logparser in self.logparsers:
+            logfile_state = filepath_2_state.get(logparser.filepath)
+            if logfile_state is not None:
+                logparser.restore_state(logfile_state)
+        return True
+
+    def save(self):
+        state = {'version': self.VERSION,
+                 'logfiles': dict((logparser.filepath, logparser.state())
+                                  for logparser in self.logparsers
+                                  if logparser.logfile is not None),
+                 'summary': self.summary_notifier.state(),
+                 # (second, hits) pairs, JSON keys are strings
+                 'alert': sorted(self.alert_notifier.state().items())}
+        temppath = self.path + '.tmp'
+        with open(temppath, 'wb') as checkpointfile:
+            json.dump(state, checkpointfile, encoding=ENCODING)
+        os.rename(temppath, self.path)
+        self._last_save = time.time()
+
+    def maybe_save(self):
+        """Saves if INTERVAL seconds have passed since the last save"""
+        if time.time() - self._last_save >= self.INTERVAL:
+            self.save()
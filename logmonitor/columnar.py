@@ -0,0 +1,166 @@
+try:
+    import numpy
+except ImportError:
+    # the columnar engine is not available
+    numpy = None
+from .notifier import SummaryData
+from .sketch import QuantileSketch
+from .utils import datetime_to_seconds
+from .sections import SectionTable, SECTION_TABLE
+
+
+def value_counts(values):
+    """Returns (value, count) of the distinct values of an array"""
+    unique_values, counts = numpy.unique(values, return_counts=True)
+    return zip(unique_values.tolist(), counts.tolist())
+
+
+class ColumnarAggregate(object):
+    """Mergeable stats of batches of lines like ChunkAggregate but
+    computed with vectorized numpy operations. Lines are appended to
+    columns (epoch seconds, status, bytes, latency, section id) which
+    are aggregated once FLUSH_SIZE lines have been inserted or when
+    flushed. Stats are the same as if the lines had been inserted one
+    at a time while there are at most SummaryData.SECTIONS_FACTOR *
+    top_k sections in a summary interval. With more sections, the
+    lines of an interval are counted as a single batch rather than in
+    batches of SummaryData.FLUSH_SIZE lines: hits of popular sections
+    are estimates within the same error bounds but may differ, and
+    sketches of sections have all their hits of the lines aggregated"""
+    # number of lines aggregated at a time
+    FLUSH_SIZE = 1024 * 1024
+
+    def __init__(self, summary_interval, top_k):
+        super(ColumnarAggregate, self).__init__()
+        if numpy is None:
+            raise ImportError("numpy is required by the columnar engine")
+        self.summary_interval = summary_interval
+        self.top_k = top_k
+        # summary interval index -> SummaryData
+        self.interval_2_summary = {}
+        self.second_2_hits = {}
+        # section and log file path interning, section ids of the
+        # columns are local so they can be stored in numpy arrays
+        self._section_table = SectionTable(max_sections=None)
+        self._filepaths = [None]
+        self._clear_columns()
+
+    def _clear_columns(self):
+        self._seconds = []
+        self._statuses = []
+        self._bytes = []
+        self._latencies = []
+        self._section_ids = []
+        self._filepath_ids = []
+
+    def insert_lines(self, linedatas, filepath=None):
+        """Appends a batch of LineData to the columns"""
+        if filepath in self._filepaths:
+            filepath_id = self._filepaths.index(filepath)
+        else:
+            filepath_id = len(self._filepaths)
+            self._filepaths.append(filepath)
+        # lines nearly always share datetimes with the previous line
+        last_datetime = last_second = None
+        section_id = self._section_table.section_id
+        nan = float('nan')
+        count = 0
+        for linedata in linedatas:
+            datetime_val = linedata.datetime
+            if datetime_val != last_datetime:
+                last_datetime = datetime_val
+                last_second = datetime_to_seconds(datetime_val)
+            self._seconds.append(last_second)
+            self._statuses.append(linedata.status)
+            self._bytes.append(linedata.bytes)
+            latency = linedata.latency
+            self._latencies.append(nan if latency is None else latency)
+            self._section_ids.append(section_id(linedata.section))
+            count += 1
+        self._filepath_ids.extend([filepath_id] * count)
+        if len(self._seconds) >= self.FLUSH_SIZE:
+            self.flush()
+
+    def insert_data(self, linedata, filepath=None):
+        self.insert_lines([linedata], filepath)
+
+    def flush(self):
+        """Aggregates the lines in the columns"""
+        if not self._seconds:
+            return
+        seconds = numpy.array(self._seconds, dtype=numpy.int64)
+        statuses = numpy.array(self._statuses, dtype=numpy.int16)
+        bytes = numpy.array(self._bytes, dtype=numpy.int64)
+        latencies = numpy.array(self._latencies, dtype=numpy.float64)
+        section_ids = numpy.array(self._section_ids, dtype=numpy.int64)
+        filepath_ids = numpy.array(self._filepath_ids, dtype=numpy.int64)
+        self._clear_columns()
+
+        for second, hits in value_counts(seconds):
+            self.second_2_hits[second] = self.second_2_hits.get(second, 0) + hits
+
+        # group lines by interval, the stable sort keeps
+        # the order of the lines in each interval
+        if self.summary_interval is None:
+            intervals = numpy.zeros(len(seconds), dtype=numpy.int64)
+        else:
+            intervals = seconds // self.summary_interval
+        order = numpy.argsort(intervals, kind='mergesort')
+        intervals = intervals[order]
+        unique_intervals = numpy.unique(intervals)
+        starts = numpy.searchsorted(intervals, unique_intervals, side='left')
+        ends = numpy.searchsorted(intervals, unique_intervals, side='right')
+        for interval, start, end in zip(unique_intervals.tolist(), starts, ends):
+            rows = order[start:end]
+            summary_data = self.summary_data(statuses[rows], bytes[rows], latencies[rows],
+                                             section_ids[rows], filepath_ids[rows])
+            if interval in self.interval_2_summary:
+                self.interval_2_summary[interval].merge(summary_data)
+            else:
+                self.interval_2_summary[interval] = summary_data
+
+    def summary_data(self, statuses, bytes, latencies, section_ids, filepath_ids):
+        """SummaryData of the lines of an interval"""
+        summary_data = SummaryData(self.top_k)
+        summary_data.bytes = int(bytes.sum())
+        # 400 and above status codes are errors
+        summary_data.error_code_count = int(numpy.count_nonzero(statuses >= 400))
+        for filepath_id, hits in value_counts(filepath_ids):
+            filepath = self._filepaths[filepath_id]
+            if filepath is not None:
+                summary_data.filepath_2_hits[filepath] = hits
+        has_latency = ~numpy.isnan(latencies)
+        for value, count in value_counts(latencies[has_latency]):
+            summary_data.latency.insert(value, count)
+        for value, count in value_counts(bytes):
+            summary_data.response_bytes.insert(value, count)
+
+        # SummaryData counts sections by their keys in SECTION_TABLE,
+        # lines are sorted by section once so that the lines of each
+        # section are a slice of the sorted columns
+        order = numpy.argsort(section_ids)
+        sorted_ids = section_ids[order]
+        starts = numpy.flatnonzero(numpy.concatenate(([True], sorted_ids[1:] != sorted_ids[:-1])))
+        ends = numpy.append(starts[1:], len(sorted_ids))
+        unique_ids = sorted_ids[starts].tolist()
+        key_2_index = {}
+        section_2_hits = {}
+        for index, (section_id, hits) in enumerate(zip(unique_ids, (ends - starts).tolist())):
+            key = SECTION_TABLE.key(self._section_table.name(section_id))
+            key_2_index[key] = index
+            section_2_hits[key] = hits
+        summary_data.insert_section_hits(section_2_hits)
+        section_latencies = latencies[order]
+        section_bytes = bytes[order]
+        for key, _, _ in summary_data.section_hits.top():
+            index = key_2_index[key]
+            rows = slice(starts[index], ends[index])
+            values = section_latencies[rows]
+            latency, response_bytes = QuantileSketch(), QuantileSketch()
+            for value, count in value_counts(values[~numpy.isnan(values)]):
+                latency.insert(value, count)
+            for value, count in value_counts(section_bytes[rows]):
+                response_bytes.insert(value, count)
+            summary_data.section_2_sketches[key] = (latency, response_bytes)
+            summary_data.section_names[key] = self._section_table.name(unique_ids[index])
+        return summary_data
@@ -0,0 +1,50 @@
+import os
+import json
+
+# default file the directive cache is persisted to
+DEFAULT_DIRECTIVE_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.logmonitor_directives')
+
+
+class DirectiveCache(object):
+    """Persists the offset and fields of the last field directive 
+    found in W3C log files, keyed by device and inode, so that a 
+    log file does not need to be scanned again on restart. The
+    offset up to which the file was scanned is also kept"""
+    def __init__(self, path=DEFAULT_DIRECTIVE_CACHE_PATH):
+        super(DirectiveCache, self).__init__()
+        self.path = path
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as cachefile:
+                return json.load(cachefile)
+        except (IOError, ValueError):
+            return {}
+
+    def _save(self):
+        temppath = self.path + '.tmp'
+        try:
+            with open(temppath, 'w') as cachefile:
+                json.dump(self._entries, cachefile)
+            os.rename(temppath, self.path)
+        except (IOError, OSError):
+            # the cache is an optimization, 
+            # failing to persist it is not an error
+            pass
+
+    def _key(self, file_stat):
+        return "%d:%d" % (file_stat.st_dev, file_stat.st_ino)
+
+    def get(self, file_stat):
+        """Returns (offset, fieldnames, scanned_to) or None"""
+        entry = self._entries.get(self._key(file_stat))
+        if entry is None:
+            return None
+        return entry['offset'], entry['fieldnames'], entry['scanned_to']
+
+    def put(self, file_stat, offset, fieldnames, scanned_to):
+        self._entries[self._key(file_stat)] = {'offset': offset,
+                                               'fieldnames': fieldnames,
+                                               'scanned_to': scanned_to}
+        self._save()
@@ -1,7 +1,10 @@
 
-from threading import Lock 
+from threading import Lock, Condition, Thread
+from collections import deque
+import traceback
 from clint.textui import puts, colored
-from .notifier import MESSAGE_TYPES
+from .notifier import MESSAGE_TYPES, Message
+from .repeatfunctionthread import RepeatFunctionThread, RepeatFunctionThreadError
 import curses
 
 class BaseDisplay(object):
@@ -29,79 +32,219 @@ class StdDisplay(BaseDisplay):
             elif message.type == MESSAGE_TYPES.alert:
                 for line in message.lines:
                     puts(colored.red(line))
+            elif message.type == MESSAGE_TYPES.stats:
+                for line in message.lines:
+                    puts(colored.cyan(line))
+
+
+class AsyncDisplay(BaseDisplay):
+    """Shows messages on another display from a dedicated writer 
+    thread so that callers never wait for terminal output. Messages 
+    are put in a queue of at most max_size messages, when the queue
+    is full the overflow policy either drops the oldest message 
+    ('drop-oldest') or coalesces queued messages of the same type 
+    ('coalesce'): only the latest summary and stats are kept and 
+    alert lines are joined (keeping the last max_size lines)"""
+    OVERFLOW_POLICIES = ['coalesce', 'drop-oldest']
+
+    def __init__(self, display, max_size=100, overflow_policy='coalesce'):
+        BaseDisplay.__init__(self)
+        if overflow_policy not in self.OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy: %s" % overflow_policy)
+        self.display = display
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        # number of messages dropped or coalesced
+        self.overflow_count = 0
+        self._messages = deque()
+        self._condition = Condition()
+        self._error = None
+        self.writer_thread = Thread(target=self._write)
+        self.writer_thread.setDaemon(True)
+        self.writer_thread.start()
+
+    def show(self, message):
+        if self._error is not None:
+            raise self._error
+        with self._condition:
+            self._messages.append(message)
+            if len(self._messages) > self.max_size:
+                self.overflow_count += 1
+                if self.overflow_policy == 'coalesce':
+                    self._coalesce()
+                while len(self._messages) > self.max_size:
+                    self._messages.popleft()
+            self._condition.notify()
+
+    def _coalesce(self):
+        """Replaces queued messages with a single message per type"""
+        summary = None
+        stats = None
+        alert = None
+        alert_lines = []
+        others = []
+        for message in self._messages:
+            if message.type == MESSAGE_TYPES.summary:
+                summary = message
+            elif message.type == MESSAGE_TYPES.stats:
+                stats = message
+            elif message.type == MESSAGE_TYPES.alert:
+                alert = message
+                alert_lines.extend(message.lines)
+            else:
+                others.append(message)
+        self._messages.clear()
+        if alert is not None:
+            # the data of the latest alert is current
+            self._messages.append(Message(alert_lines[-self.max_size:], 
+                                          MESSAGE_TYPES.alert, alert.data))
+        if summary is not None:
+            self._messages.append(summary)
+        if stats is not None:
+            self._messages.append(stats)
+        self._messages.extend(others)
+
+    def _write(self):
+        while True:
+            with self._condition:
+                while not self._messages:
+                    self._condition.wait()
+                message = self._messages.popleft()
+            try:
+                self.display.show(message)
+            except Exception:
+                # raised by the next call to show
+                self._error = RepeatFunctionThreadError(traceback.format_exc())
+                return
+
+
+class TeeDisplay(BaseDisplay):
+    """Shows messages on each of several displays"""
+    def __init__(self, displays):
+        BaseDisplay.__init__(self)
+        self.displays = displays
+
+    def show(self, message):
+        for display in self.displays:
+            display.show(message)
+
+
+class ScreenBuffer(object):
+    """Virtual screen of the rows inside the border of a curses 
+    subwindow, keeps track of the rows last drawn so that only 
+    changed rows are drawn"""
+    def __init__(self, subwindow):
+        super(ScreenBuffer, self).__init__()
+        self.subwindow = subwindow
+        height, width = subwindow.getmaxyx()
+        # rows exclude the border
+        self.width = width - 2
+        self.rows = [''] * (height - 2)
+        # number of rows filled by append_lines
+        self.used_rows = 0
+        self._drawn_rows = list(self.rows)
+
+    def wrap_line(self, line):
+        """Splits a text line into rows that fit in the 
+        subwindow, continuation rows start with '> '"""
+        width = self.width
+        if len(line) <= width:
+            return [line]
+        rest = width - len("> ")
+        return [line[0:width]] + ["> " + line[i:i + rest]
+                                  for i in range(width, len(line), rest)]
+
+    def set_lines(self, lines):
+        """Replaces the rows with lines, lines that do not fit are dropped"""
+        rows = []
+        for line in lines:
+            rows.extend(self.wrap_line(line))
+        rows = rows[:len(self.rows)]
+        self.rows = rows + [''] * (len(self.rows) - len(rows))
+
+    def append_lines(self, lines):
+        """Appends lines after the rows previously appended, 
+        scrolling up when the rows are full"""
+        rows = self.rows[:self.used_rows]
+        for line in lines:
+            rows.extend(self.wrap_line(line))
+        rows = rows[-len(self.rows):]
+        self.used_rows = len(rows)
+        self.rows = rows + [''] * (len(self.rows) - len(rows))
+
+    def changed_rows(self):
+        """Returns (index, row) of rows that changed since last drawn
+        and marks them as drawn"""
+        changed = [(index, row) for index, (row, drawn_row) 
+                   in enumerate(zip(self.rows, self._drawn_rows))
+                   if row != drawn_row]
+        self._drawn_rows = list(self.rows)
+        return changed
 
 
 class WindowDisplay(BaseDisplay):
-    """Displays text in windows using curses"""
-    def __init__(self, window):
+    """Displays text in windows using curses. Messages update virtual
+    screens of the subwindows, a render thread draws the rows that 
+    changed at most max_fps times a second so bursts of messages are
+    drawn as a single frame. Stats are shown below the summary if 
+    stats_panel is True"""
+    def __init__(self, window, max_fps=10, stats_panel=False):
         BaseDisplay.__init__(self)
         self._window = window
+        self.stats_panel = stats_panel
         self._setup_gui()
         self.lock = Lock()
+        self.render_thread = RepeatFunctionThread(1.0 / max_fps, self.render)
+        self.render_thread.setDaemon(True)
+        self.render_thread.start()
 
     def show(self, message):
+        # raise any exceptions raised while rendering
+        self.render_thread.raise_any_exceptions()
         with self.lock:
             if message.type == MESSAGE_TYPES.summary:
-                # clear subwindow
-                self.left_subwindow.erase()
-                for line in message.lines:
-                    self.write_line(line+'\n', self.left_subwindow, scroll=False)
-                self.left_subwindow.border()
-                self.left_subwindow.refresh()
+                self.left_screen.set_lines(message.lines)
             elif message.type == MESSAGE_TYPES.alert:
-                for line in message.lines:
-                    self.write_line(line+'\n', self.right_subwindow)
-                self.right_subwindow.border()
-                self.right_subwindow.refresh()
+                self.right_screen.append_lines(message.lines)
+            elif message.type == MESSAGE_TYPES.stats and self.stats_panel:
+                self.stats_screen.set_lines(message.lines)
+
+    def render(self):
+        """Draws the rows of the subwindows that changed"""
+        with self.lock:
+            screen_2_changed = [(screen, screen.changed_rows()) 
+                                for screen in self.screens]
+        updated = False
+        for screen, changed_rows in screen_2_changed:
+            for index, row in changed_rows:
+                # pad rows to overwrite what was drawn before
+                screen.subwindow.addstr(index + 1, 1, row.ljust(screen.width))
+            if changed_rows:
+                screen.subwindow.noutrefresh()
+                updated = True
+        if updated:
+            curses.doupdate()
 
     def _setup_gui(self):
-        """Setup left and right curses windows"""
+        """Setup left and right curses windows, the left 
+        window is split with a stats window if stats_panel"""
         curses.curs_set(0)
         height, width = self._window.getmaxyx()
-        self.left_subwindow = curses.newwin(height, width/3, 0, 0)
+        left_height = height
+        if self.stats_panel:
+            left_height = 2*height/3
+        self.left_subwindow = curses.newwin(left_height, width/3, 0, 0)
         self.right_subwindow = curses.newwin(height, 2*width/3, 0, width/3)
-        self.left_subwindow.border()
-        self.left_subwindow.refresh()
-        self.right_subwindow.border()
-        self.right_subwindow.refresh()
-    
-    def line_2_sublines(self, line, window_width):
-        """Splits a text line into pieces that fit 
-        in the width of a window"""
-        sublines = [line]
-        if len(line) > window_width:
-            first = line[0:window_width - 1] + "\n"
-            rest = window_width - (len("> ") + 1)
-            remaining = ["> " + line[i:i + rest] + "\n"
-                         for i in range(window_width - 1, len(line), rest)]
-            remaining[-1] = remaining[-1][0:-1]
-            sublines = [first] + remaining
-        return sublines
-
-    
-    def write_line(self, line, subwindow, scroll=True):
-        """Write line to subwindow, splitting line into sublines
-        that fit in the subwindow if necessary"""
-        height, width = subwindow.getmaxyx()
-        window_width = width - 2
-        y,x = subwindow.getyx()
-        if y == 0 and x == 0:
-            subwindow.move(1,0)
-        for subline in self.line_2_sublines(line, window_width):
-            y, x = subwindow.getyx()
-            # stop if scrolling is disabled and window is full
-            if y >= height - 1 and not scroll:
-                return
-            if y >= height - 1:
-                # scroll up when window is full
-                subwindow.move(1, 1)
-                subwindow.deleteln()
-                subwindow.move(y - 1, 1)
-                subwindow.deleteln()
-                subwindow.addstr(subline)
-            else:
-                subwindow.move(y, x + 1)
-                subwindow.addstr(subline)
-
-
-
+        subwindows = [self.left_subwindow, self.right_subwindow]
+        if self.stats_panel:
+            self.stats_subwindow = curses.newwin(height - left_height, width/3, left_height, 0)
+            subwindows.append(self.stats_subwindow)
+        for subwindow in subwindows:
+            subwindow.border()
+            subwindow.refresh()
+        self.left_screen = ScreenBuffer(self.left_subwindow)
+        self.right_screen = ScreenBuffer(self.right_subwindow)
+        self.screens = [self.left_screen, self.right_screen]
+        if self.stats_panel:
+            self.stats_screen = ScreenBuffer(self.stats_subwindow)
+            self.screens.append(self.stats_screen)
@@ -0,0 +1,39 @@
+import time
+
+
+class DoubleBuffer(object):
+    """Double buffer shared by a single writer thread and a single
+    reader thread without taking a lock. The writer fills the active
+    buffer, the reader swaps in a new buffer and reads the filled one.
+    The writer announces the buffer it is writing to and checks that
+    it is still active, the reader waits for the writer to finish 
+    with a buffer after swapping it out"""
+    # seconds the reader sleeps while waiting for the writer
+    SWAP_WAIT = 0.0001
+
+    def __init__(self, factory):
+        super(DoubleBuffer, self).__init__()
+        self._factory = factory
+        self._active = factory()
+        self._writing = None
+
+    def acquire(self):
+        """Returns the active buffer for writing, 
+        release must be called when done writing"""
+        while True:
+            buffer = self._active
+            self._writing = buffer
+            if buffer is self._active:
+                return buffer
+
+    def release(self):
+        self._writing = None
+
+    def swap(self):
+        """Replaces the active buffer with a new buffer and returns 
+        the previous buffer once the writer has finished with it"""
+        buffer = self._active
+        self._active = self._factory()
+        while self._writing is buffer:
+            time.sleep(self.SWAP_WAIT)
+        return buffer
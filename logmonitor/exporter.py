@@ -0,0 +1,193 @@
+import re
+import socket
+from threading import Lock, Thread
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from .display import BaseDisplay
+from .notifier import MESSAGE_TYPES
+
+
+def parse_address(address, default_host):
+    """Splits "host:port" or "port" into (host, port)"""
+    host, _, port = address.rpartition(':')
+    return host or default_host, int(port)
+
+
+class MetricsDisplay(BaseDisplay):
+    """Accumulates the data of messages into counters and gauges
+    that are exported rather than displayed. Counters are updated
+    once per message so the cost of exporting is independent of
+    the number of log lines. At most MAX_SECTIONS sections are
+    counted, hits of other sections are counted as OTHER_SECTION"""
+    MAX_SECTIONS = 1000
+    OTHER_SECTION = 'other'
+
+    def __init__(self):
+        BaseDisplay.__init__(self)
+        self.lock = Lock()
+        self.hits = 0
+        self.bytes = 0
+        self.errors = 0
+        self.section_2_hits = {}
+        self.window_hits = 0
+        self.alert = False
+        # self-metrics snapshot of the latest stats message
+        self.stats = None
+
+    def show(self, message):
+        data = message.data
+        if data is None:
+            return
+        with self.lock:
+            if message.type == MESSAGE_TYPES.summary:
+                self.hits += data['hits']
+                self.bytes += data['bytes']
+                self.errors += data['errors']
+                section_2_hits = self.section_2_hits
+                for section, hits in data['section_hits']:
+                    if (section not in section_2_hits and
+                        len(section_2_hits) >= self.MAX_SECTIONS):
+                        section = self.OTHER_SECTION
+                    section_2_hits[section] = section_2_hits.get(section, 0) + hits
+            elif message.type == MESSAGE_TYPES.alert:
+                self.window_hits = data['hits']
+                self.alert = data['alert']
+            elif message.type == MESSAGE_TYPES.stats:
+                self.stats = data
+
+    def snapshot(self):
+        """Returns a consistent copy of the metrics"""
+        with self.lock:
+            return {'hits': self.hits,
+                    'bytes': self.bytes,
+                    'errors': self.errors,
+                    'section_hits': sorted(self.section_2_hits.items()),
+                    'window_hits': self.window_hits,
+                    'alert': self.alert,
+                    'stats': self.stats}
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(snapshot, prefix='logmonitor'):
+    """Renders a MetricsDisplay snapshot in the Prometheus text format"""
+    lines = []
+
+    def metric(name, type, help, samples):
+        name = prefix + '_' + name
+        lines.append("# HELP %s %s" % (name, help))
+        lines.append("# TYPE %s %s" % (name, type))
+        for labels, value in samples:
+            lines.append("%s%s %s" % (name, labels, value))
+
+    metric('hits_total', 'counter', 'Hits in the log files', [('', snapshot['hits'])])
+    metric('bytes_total', 'counter', 'Bytes transferred', [('', snapshot['bytes'])])
+    metric('http_errors_total', 'counter', 'Hits with a 400 or above status',
+           [('', snapshot['errors'])])
+    metric('section_hits_total', 'counter', 'Hits of popular sections (lower bound)',
+           [('{section="%s"}' % escape_label(section), hits)
+            for section, hits in snapshot['section_hits']])
+    metric('window_hits', 'gauge', 'Hits in the alert window',
+           [('', snapshot['window_hits'])])
+    metric('alert', 'gauge', '1 if the high traffic alert is raised',
+           [('', int(snapshot['alert']))])
+    stats = snapshot['stats']
+    if stats is not None:
+        for name, value in sorted(stats['counters'].items()):
+            metric('self_%s_total' % name, 'counter', 'Self-metric ' + name, [('', value)])
+        for name, value in sorted(stats['gauges'].items()):
+            metric('self_' + name, 'gauge', 'Self-metric ' + name, [('', value)])
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusDisplay(MetricsDisplay):
+    """Serves the metrics at http://host:port/metrics in the
+    Prometheus text format, metrics are snapshot when scraped"""
+    def __init__(self, host='localhost', port=9100):
+        MetricsDisplay.__init__(self)
+        display = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = prometheus_text(display.snapshot())
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # requests are not logged to the terminal
+                pass
+
+        self.server = HTTPServer((host, port), MetricsHandler)
+        self.server_thread = Thread(target=self.server.serve_forever)
+        self.server_thread.setDaemon(True)
+        self.server_thread.start()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StatsdDisplay(BaseDisplay):
+    """Sends the data of messages to a StatsD server over UDP,
+    metrics of a message are batched into packets of at most
+    MAX_PACKET_SIZE bytes"""
+    MAX_PACKET_SIZE = 512
+
+    def __init__(self, host='localhost', port=8125, prefix='logmonitor'):
+        BaseDisplay.__init__(self)
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def metric_name(self, name):
+        """StatsD names may not contain ':', '|' or '@', '.'
+        separates name components"""
+        return re.sub(r'[^\w\-.]', '_', name)
+
+    def show(self, message):
+        data = message.data
+        if data is None:
+            return
+        prefix = self.prefix
+        metrics = []
+        if message.type == MESSAGE_TYPES.summary:
+            metrics.append("%s.hits:%d|c" % (prefix, data['hits']))
+            metrics.append("%s.bytes:%d|c" % (prefix, data['bytes']))
+            metrics.append("%s.http_errors:%d|c" % (prefix, data['errors']))
+            for section, hits in data['section_hits']:
+                name = self.metric_name(section.replace('.', '_'))
+                metrics.append("%s.section.%s.hits:%d|c" % (prefix, name, hits))
+        elif message.type == MESSAGE_TYPES.alert:
+            metrics.append("%s.window_hits:%d|g" % (prefix, data['hits']))
+            metrics.append("%s.alert:%d|g" % (prefix, int(data['alert'])))
+        self.send(metrics)
+
+    def packets(self, metrics):
+        """Joins metrics into newline separated packets"""
+        packet = ''
+        for metric in metrics:
+            if packet and len(packet) + 1 + len(metric) > self.MAX_PACKET_SIZE:
+                yield packet
+                packet = ''
+            packet = packet + '\n' + metric if packet else metric
+        if packet:
+            yield packet
+
+    def send(self, metrics):
+        for packet in self.packets(metrics):
+            try:
+                self.socket.sendto(packet, self.address)
+            except socket.error:
+                # metrics are dropped if the server is unavailable
+                pass
@@ -1,18 +1,29 @@
 #!/usr/bin/env python
 
 import sys
-import os
 import argparse
 import curses
-from .display import StdDisplay, WindowDisplay
+import glob
+from .display import StdDisplay, WindowDisplay, AsyncDisplay, TeeDisplay
 from .repeatfunctionthread import RepeatFunctionThreadError
-from .notifier import SummaryNotifier, AlertNotifier
-from .logparser import CommonLogParser, W3CLogParser 
+from .notifier import SummaryNotifier, AlertNotifier, StatsNotifier
+from .logparser import create_logparser
+from .multifollow import MultiLogFollower
+from .backfill import backfill
+from .directivecache import DirectiveCache, DEFAULT_DIRECTIVE_CACHE_PATH
+from .stats import Stats
+from .timeseries import TimeSeries
+from .rules import RuleEngine, parse_rule, load_rules
+from .anomaly import AnomalyDetector
+from .checkpoint import Checkpoint
+from .archive import is_compressed
+from .columnar import ColumnarAggregate, numpy
+from .exporter import PrometheusDisplay, StatsdDisplay, parse_address
 from . import __version__
 
 def get_parser():
     parser = argparse.ArgumentParser(
-            description="""logmonitor monitors a http log file:
+            description="""logmonitor monitors http log files:
                            a summary of website traffic is displayed
                            every summaryinterval seconds
                            and alerts are displayed if total website hits
@@ -20,8 +31,8 @@ def get_parser():
                            hitsinterval seconds""",
             formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('logfilepath', 
-            help='log file path',
-            nargs='?')
+            help='log file paths or glob patterns',
+            nargs='*')
     parser.add_argument('-s', '--summaryinterval', 
             help='interval in seconds to display summary',
             default = 10, type = int)
@@ -39,43 +50,263 @@ def get_parser():
             help='type of display',
             default = 'window',
             choices = ['window', 'standard'])
+    parser.add_argument('-o', '--overflow',
+            help="""what to do when messages are displayed slower than they
+                    are produced: coalesce queued messages of the same type
+                    or drop the oldest message""",
+            default = 'coalesce',
+            choices = AsyncDisplay.OVERFLOW_POLICIES)
+    parser.add_argument('-k', '--topsections',
+            help='number of popular sections displayed in summaries',
+            default = 10, type = int)
+    parser.add_argument('-p', '--perfile',
+            help='break down hits per log file in summaries',
+            action='store_true')
+    parser.add_argument('-b', '--backfill',
+            help="""parse the log files from the start in parallel,
+                    display summaries and alerts by logged time and exit
+                    (always uses the standard display)""",
+            action='store_true')
+    parser.add_argument('-n', '--processes',
+            help='number of processes used to backfill (default: number of cpus)',
+            default = None, type = int)
+    parser.add_argument('--stats',
+            help="""display self-metrics of the monitor (lines read and 
+                    parsed, parse errors, lag, notify durations) every
+                    summaryinterval seconds""",
+            action='store_true')
+    parser.add_argument('--statsfile',
+            help="""file the self-metrics are written to as JSON every
+                    summaryinterval seconds""",
+            default = None)
+    parser.add_argument('--prometheus',
+            help="""serve metrics in the Prometheus text format at
+                    http://[HOST:]PORT/metrics (HOST defaults to localhost)""",
+            metavar='[HOST:]PORT', default = None)
+    parser.add_argument('--statsd',
+            help="""send metrics to a StatsD server at [HOST:]PORT over UDP
+                    (HOST defaults to localhost)""",
+            metavar='[HOST:]PORT', default = None)
+    parser.add_argument('-e', '--eventtime',
+            help="""alert using the logged times rather than the current
+                    time: the hits window ends at the latest logged time
+                    less the lateness, alerts are stamped with logged times""",
+            action='store_true')
+    parser.add_argument('--lateness',
+            help="""seconds a log line may be logged out of order in event
+                    time mode, the alert window lags the latest logged
+                    time by lateness seconds""",
+            default = 0, type = int)
+    parser.add_argument('-a', '--adaptive',
+            help="""alert when hits in the last hitsinterval seconds are
+                    anomalously high compared to a baseline learned from
+                    the hits per second (rather than above hitsthreshold)""",
+            action='store_true')
+    parser.add_argument('--sigmas',
+            help="""standard deviations above the baseline hits must be
+                    for an adaptive alert, alerts are cleared once hits
+                    are less than half as many above""",
+            default = 3.0, type = float)
+    parser.add_argument('--seasonal',
+            help='learn a baseline for each hour of the day in adaptive mode',
+            action='store_true')
+    parser.add_argument('--bysection',
+            help='also alert on anomalous hits of each section in adaptive mode',
+            action='store_true')
+    parser.add_argument('-r', '--rotated',
+            help="""first read the rotated archives of each log file
+                    (e.g. access-log.1, access-log.2.gz) from oldest to
+                    newest and the log file from its start""",
+            action='store_true')
+    parser.add_argument('--columnar',
+            help="""aggregate batches of lines with numpy when backfilling
+                    or reading rotated and compressed log files""",
+            action='store_true')
+    parser.add_argument('-R', '--rule',
+            help="""alert rule (may be repeated): [NAME:] METRIC[/s|/hits]
+                    [by section|host|status] > THRESHOLD in SECONDS [clear
+                    THRESHOLD] where METRIC is one of hits, bytes, errors,
+                    4xx or 5xx, /s is a rate per second and /hits a ratio
+                    to hits, an alert is cleared once the value is not
+                    greater than the clear threshold (defaults to 0.9
+                    times the threshold)""",
+            metavar='RULE', action='append', default = [])
+    parser.add_argument('--rulesfile',
+            help='file of alert rules, one per line',
+            default = None)
+    parser.add_argument('-T', '--trends',
+            help="""keep a history of hits, bytes, errors and popular
+                    sections per second, minute and hour and display
+                    sparklines of hits in summaries""",
+            action='store_true')
+    parser.add_argument('-c', '--checkpoint',
+            help="""file the positions in the log files and the summary and
+                    alert state are saved to every few seconds, monitoring
+                    resumes from the saved state on restart""",
+            default = None)
+    parser.add_argument('--directivecache',
+            help="""file the offsets of the last Fields directives of w3c
+                    log files are cached in, so that log files are not
+                    scanned for them again on restart""",
+            metavar='PATH', default = DEFAULT_DIRECTIVE_CACHE_PATH)
+    parser.add_argument('--nodirectivecache',
+            help='do not cache the Fields directives of w3c log files',
+            action='store_true')
     parser.add_argument('-v', '--version',
             help='displays the current version of logmonitor',
             action='store_true')
     return parser
 
 
+def export_displays(args):
+    """Displays exporting metrics rather than showing text"""
+    displays = []
+    if args['prometheus']:
+        host, port = parse_address(args['prometheus'], 'localhost')
+        displays.append(PrometheusDisplay(host, port))
+    if args['statsd']:
+        host, port = parse_address(args['statsd'], 'localhost')
+        displays.append(StatsdDisplay(host, port))
+    return displays
+
+
 def logmonitor(args, display):
+    # self-metrics are only collected if displayed or written
+    stats = None
+    if args['stats'] or args['statsfile']:
+        stats = Stats()
+
+    # notifiers also show messages on any exporting displays
+    exporters = export_displays(args)
+    text_display = display
+    if exporters:
+        display = TeeDisplay([text_display] + exporters)
+
+    # history of traffic at several resolutions for trends
+    timeseries = None
+    if args['trends']:
+        timeseries = TimeSeries(args['topsections'])
+
     # setup summary notifier
     # repeatedly call notify method of summary_notifier every summary_interval seconds
-    summary_notifier = SummaryNotifier(display, args['summaryinterval'])
+    summary_notifier = SummaryNotifier(display, args['summaryinterval'], 
+                                       args['topsections'], stats, timeseries)
     summary_notifier.start()
 
     # setup alert notifier
     # repeatedly call notify method of alert_notifier every second
-    alert_notifier = AlertNotifier(display, 1, args['hitsinterval'], args['hitsthreshold'])
+    # (in event time mode alerts are displayed as lines are inserted,
+    # and every second once traffic stops)
+    anomaly_detector = None
+    if args['adaptive']:
+        anomaly_detector = AnomalyDetector(args['hitsinterval'], args['sigmas'],
+                                           seasonal=args['seasonal'],
+                                           by_section=args['bysection'])
+    alert_notifier = AlertNotifier(display, 1, args['hitsinterval'], 
+                                   args['hitsthreshold'], stats,
+                                   args['eventtime'], args['lateness'],
+                                   anomaly_detector)
     alert_notifier.start()
 
-    
-    logfilepath = args['logfilepath']
-    logparser = None
-    if args['logtype'] == 'common':
-        logparser = CommonLogParser(logfilepath)
-    else: # 'w3c'
-        logparser = W3CLogParser(logfilepath)
-
-    for linedata in logparser.parsedlines():
-        summary_notifier.insert_data(linedata)
+    # all alert rules are evaluated by a single engine every second
+    rule_engine = None
+    if args['rules']:
+        rule_engine = RuleEngine(display, 1, args['rules'], stats)
+        rule_engine.start()
+
+    # only w3c log files have directives
+    directive_cache = None
+    if args['logtype'] == 'w3c' and not args['nodirectivecache']:
+        directive_cache = DirectiveCache(args['directivecache'])
+    logparsers = [create_logparser(args['logtype'], logfilepath, 
+                                   directive_cache=directive_cache)
+                  for logfilepath in args['logfilepaths']
+                  if not is_compressed(logfilepath)]
+    # compressed log files are read once rather than followed
+    archive_logparsers = [create_logparser(args['logtype'], logfilepath)
+                          for logfilepath in args['logfilepaths']
+                          if is_compressed(logfilepath)]
+
+    if stats is not None:
+        for logparser in logparsers + archive_logparsers:
+            logparser.stats = stats
+        stats.gauge('offset_lag_bytes', 
+                    lambda: sum(logparser.offset_lag for logparser in logparsers))
+        stats.gauge('window_hits', lambda: alert_notifier.hits)
+        if isinstance(text_display, AsyncDisplay):
+            stats.gauge('display_overflows', lambda: text_display.overflow_count)
+        # stats are only exported if not displayed
+        stats_display = None
+        if args['stats']:
+            stats_display = display
+        elif exporters:
+            stats_display = TeeDisplay(exporters)
+        stats_notifier = StatsNotifier(stats_display, args['summaryinterval'], 
+                                       stats, args['statsfile'])
+        stats_notifier.start()
+
+    # resume from the checkpoint, lines written since are 
+    # read at full speed before following the log files
+    save_checkpoint = None
+    if args['checkpoint']:
+        checkpoint = Checkpoint(args['checkpoint'], logparsers, 
+                                summary_notifier, alert_notifier)
+        checkpoint.restore()
+        save_checkpoint = checkpoint.maybe_save
+
+    perfile = args['perfile']
+    def insert_data(logparser, linedata):
+        if perfile:
+            summary_notifier.insert_data(linedata, logparser.filepath)
+        else:
+            summary_notifier.insert_data(linedata)
         alert_notifier.insert_data(linedata)
+        if rule_engine is not None:
+            rule_engine.insert_data(linedata)
+
+    def insert_lines(logparser, lines):
+        linedatas = logparser.parse_lines(lines)
+        if not args['columnar']:
+            for linedata in linedatas:
+                insert_data(logparser, linedata)
+            return
+        # the batch is summarized as a single interval
+        aggregate = ColumnarAggregate(None, args['topsections'])
+        aggregate.insert_lines(linedatas, logparser.filepath if perfile else None)
+        aggregate.flush()
+        for summary_data in aggregate.interval_2_summary.values():
+            summary_notifier.insert_summary(summary_data)
+        alert_notifier.insert_second_hits(aggregate.second_2_hits)
+        if rule_engine is not None:
+            rule_engine.insert_lines(linedatas)
+        if timeseries is not None:
+            timeseries.insert_second_hits(aggregate.second_2_hits)
+
+    # read compressed log files and the rotated archives of log 
+    # files that were not resumed from the checkpoint
+    for logparser in archive_logparsers:
+        for lines in logparser.read_archive(logparser.filepath):
+            insert_lines(logparser, lines)
+    if args['rotated']:
+        for logparser in logparsers:
+            if logparser.logfile is None:
+                for lines in logparser.read_rotated():
+                    insert_lines(logparser, lines)
+
+    # all log files are followed by a single loop
+    follower = MultiLogFollower(logparsers, checkpoint=save_checkpoint)
+    for logparser, linedata in follower.parsedlines():
+        insert_data(logparser, linedata)
 
 
 def run_with_windowdisplay(win, args):
-    display = WindowDisplay(win)
+    display = AsyncDisplay(WindowDisplay(win, stats_panel=args['stats']), 
+                           overflow_policy=args['overflow'])
     logmonitor(args, display)
 
 
 def run_with_stddisplay(args):
-    display = StdDisplay()
+    display = AsyncDisplay(StdDisplay(), overflow_policy=args['overflow'])
     logmonitor(args, display)
     
 
@@ -91,8 +322,42 @@ def main():
         parser.print_help()
         return
 
-    if not os.path.exists(args['logfilepath']):
-        print "Invalid File Path:", args['logfilepath']
+    # expand glob patterns
+    logfilepaths = []
+    for pattern in args['logfilepath']:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            print "Invalid File Path:", pattern
+            return
+        for logfilepath in matches:
+            if logfilepath not in logfilepaths:
+                logfilepaths.append(logfilepath)
+    args['logfilepaths'] = logfilepaths
+
+    try:
+        rules = [parse_rule(rule) for rule in args['rule']]
+        if args['rulesfile']:
+            rules.extend(load_rules(args['rulesfile']))
+        if len(set(rule.name for rule in rules)) < len(rules):
+            raise ValueError("Rule names must be unique")
+    except (ValueError, IOError) as e:
+        print e
+        return
+    args['rules'] = rules
+
+    if args['adaptive'] and args['eventtime']:
+        print "--adaptive is not supported with --eventtime"
+        return
+
+    if args['columnar'] and numpy is None:
+        print "numpy is required by --columnar"
+        return
+
+    if args['backfill']:
+        try:
+            backfill(args, StdDisplay())
+        except(KeyboardInterrupt, SystemExit):
+            sys.exit(0)
         return
 
     display_type = args['displaytype']
@@ -1,12 +1,60 @@
 
 import re
+import gc
 import datetime
-import time
 import os
+import io
+import mmap
+from itertools import repeat
+from operator import itemgetter, truediv
 from .utils import enum
+from .watcher import get_watcher
+from .archive import decompressed_blocks, rotated_filepaths
+from .sections import SECTION_TABLE, uri_section
 
 # Fields of a line used for metrics and stats
-LINE_DATA_FIELDS = enum('section', 'bytes', 'datetime', 'status')
+LINE_DATA_FIELDS = enum('section', 'bytes', 'datetime', 'status', 'latency')
+
+class LineData(tuple):
+    """Fields of a parsed log line used for metrics and stats.
+    A tuple of the fields in LINE_DATA_FIELDS order followed by
+    section_id, so fields may also be indexed by LINE_DATA_FIELDS
+    and batches of lines are built without calling __init__.
+    latency is the response time in milliseconds, None if not
+    logged. section_id is the id of section in SECTION_TABLE,
+    None if the section was not interned by the parser"""
+    __slots__ = ()
+
+    def __new__(cls, section, bytes, datetime, status, latency=None, section_id=None):
+        return tuple.__new__(cls, (section, bytes, datetime, status, latency, section_id))
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    section = property(itemgetter(0))
+    bytes = property(itemgetter(1))
+    datetime = property(itemgetter(2))
+    status = property(itemgetter(3))
+    latency = property(itemgetter(4))
+    section_id = property(itemgetter(5))
+
+    def __eq__(self, other):
+        if not isinstance(other, LineData):
+            return NotImplemented
+        # the section id is derived from the section
+        return self[:-1] == other[:-1]
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(self[:-1])
+
+    def __repr__(self):
+        return "LineData(%r, %r, %r, %r, %r)" % self[:-1]
 
 class LogParseError(Exception):
     """Exception raised for parse errors"""
@@ -20,97 +68,474 @@ class LogParseError(Exception):
             result = result + ", on line: %s" % self.line
         return result
 
+
+def split_lines(data):
+    """Splits data on '\\n', '\\r\\n' or '\\r' (universal newlines),
+    returns the complete lines and the incomplete trailing line"""
+    lines = data.splitlines()
+    if not data or data.endswith('\n'):
+        return lines, ''
+    partial = lines.pop()
+    if data.endswith('\r'):
+        # carried over as it may be followed by '\\n'
+        partial += '\r'
+    return lines, partial
+
+
 class BaseLogParser(object):
     """Base class for following and parsing a text file"""
-    # TODO add support for rotated log files
-    def __init__(self, filepath):
+    # number of bytes read from the log file at a time
+    BLOCK_SIZE = 1024 * 1024
+    # seconds to wait for the watcher to report a change
+    # before checking the log file again
+    WAIT_TIMEOUT = 1.0
+
+    def __init__(self, filepath, watcher=None):
         super(BaseLogParser, self).__init__()
         self.filepath = filepath
         self.logfile = None
+        self.watcher = watcher
+        # incomplete line at the end of the last block read
+        self._partial = ''
+        # interns sections, shared by the parsers of all log files
+        self.section_table = SECTION_TABLE
+        # optional Stats the lines and bytes read are counted in
+        self.stats = None
+        # bytes between the position read up to and the end
+        # of the log file, updated when stats are collected
+        self.offset_lag = 0
+
+    def open_logfile(self):
+        """opens the log file in binary mode, lines are split
+        on '\\n', '\\r\\n' or '\\r' by split_lines"""
+        return io.open(self.filepath, "rb")
+
+    def reopen_if_rotated(self):
+        """Reopens the log file if it has been replaced by a new 
+        file (rotated) or seeks to the start of the log file if 
+        it has been truncated. Returns True if either happened"""
+        try:
+            path_stat = os.stat(self.filepath)
+        except OSError:
+            # file moved away and not yet recreated
+            return False
+        file_stat = os.fstat(self.logfile.fileno())
+        if (path_stat.st_dev, path_stat.st_ino) != (file_stat.st_dev, file_stat.st_ino):
+            self.logfile.close()
+            self.logfile = self.open_logfile()
+            return True
+        if path_stat.st_size < self.logfile.tell():
+            self.logfile.seek(0)
+            return True
+        return False
+
+    def state(self):
+        """Returns the device, inode and offset of the next 
+        line to be read of the log file as a dictionary"""
+        file_stat = os.fstat(self.logfile.fileno())
+        return {'dev': file_stat.st_dev,
+                'ino': file_stat.st_ino,
+                'offset': self.logfile.tell() - len(self._partial)}
 
-    def follow(self, logfile):
-        """Generator that yields lines in a file starting at the end"""
-        logfile.seek(0,2)
+    def restore_state(self, state):
+        """Opens the log file at the offset of a state returned by
+        state, lines are read from the start of the log file if it 
+        has been rotated or truncated since. Returns True if the
+        log file was opened at the offset"""
+        self.logfile = self.open_logfile()
+        self._partial = ''
+        file_stat = os.fstat(self.logfile.fileno())
+        if ((file_stat.st_dev, file_stat.st_ino) != (state['dev'], state['ino']) or
+            file_stat.st_size < state['offset']):
+            return False
+        self.logfile.seek(state['offset'])
+        return True
+
+    def read_lines(self):
+        """Reads a block of BLOCK_SIZE bytes from the current position 
+        of the log file and returns the complete lines in it, an 
+        incomplete trailing line is carried over to the next read.
+        Rotated or truncated files are handled once the current file 
+        has been read to the end. Returns None if no data is available"""
+        block = self.logfile.read(self.BLOCK_SIZE)
+        if not block:
+            if not self.reopen_if_rotated():
+                self.offset_lag = 0
+                return None
+            # an incomplete line at the end of the old
+            # file will not be completed 
+            self._partial = ''
+            block = self.logfile.read(self.BLOCK_SIZE)
+            if not block:
+                self.offset_lag = 0
+                return None
+        lines, self._partial = split_lines(self._partial + block)
+        if self.stats is not None:
+            self.stats.incr('bytes_read', len(block))
+            self.stats.incr('lines_read', len(lines))
+            self.offset_lag = (os.fstat(self.logfile.fileno()).st_size - 
+                               self.logfile.tell())
+        return lines
+
+    def follow(self):
+        """Generator that yields batches (lists) of complete lines
+        in the log file starting at the current position. When no 
+        data is available the watcher is used to wait for changes"""
+        if self.watcher is None:
+            self.watcher = get_watcher()
+        self.watcher.add(self.filepath)
         while True:
-            line = logfile.readline()
-            if not line:
-                time.sleep(0.1)
-                continue
-            yield line
+            lines = self.read_lines()
+            if lines is None:
+                self.watcher.wait(self.WAIT_TIMEOUT)
+            elif lines:
+                yield lines
+
+    def read_range(self, start, end):
+        """Generator that yields batches (lists) of complete lines 
+        in the log file between byte offsets start and end, start 
+        and end are expected to be at the start of a line (or the 
+        end of the file)"""
+        return self.lines_of_blocks(self.range_blocks(start, end))
+
+    def range_blocks(self, start, end):
+        """Generator that yields blocks of the log file
+        between byte offsets start and end"""
+        self.logfile.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = self.logfile.read(min(self.BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+    def lines_of_blocks(self, blocks):
+        """Generator that yields batches (lists) of complete 
+        lines in blocks of data read from the start of a file"""
+        partial = ''
+        for block in blocks:
+            lines, partial = split_lines(partial + block)
+            if self.stats is not None:
+                self.stats.incr('bytes_read', len(block))
+                self.stats.incr('lines_read', len(lines))
+            if lines:
+                yield lines
+        # last line of the file may not end with a newline
+        if partial:
+            yield partial.splitlines()
+
+    def read_archive(self, filepath):
+        """Generator that yields batches (lists) of complete lines of 
+        a whole (rotated) log file, which is decompressed as it is 
+        read if compressed with gzip, zstd or lz4"""
+        self.reset_fields()
+        return self.lines_of_blocks(decompressed_blocks(filepath))
+
+    def read_rotated(self):
+        """Generator that yields batches (lists) of complete lines of 
+        the rotated archives of the log file from oldest to newest. 
+        The log file is then opened at its start to be followed"""
+        for filepath in rotated_filepaths(self.filepath):
+            for lines in self.read_archive(filepath):
+                yield lines
+        self.reset_fields()
+        self.logfile = self.open_logfile()
+
+    def reset_fields(self):
+        """Called before lines are read from the start of a file,
+        overriden by parsers of formats declaring their fields"""
+        pass
 
     def parsedlines(self):
-        """Tails common log format file and yields dictionaries 
+        """Tails log file and yields LineData
         corresponding to log lines"""
         if self.logfile is None:
-            # open file in universal newline mode
-            self.logfile = open(self.filepath, "rU")
-                
-        with self.logfile:
-            loglines = self.follow(self.logfile)
-            for line in loglines:
-                linedata = self.parse_line(line)
-                if linedata is not None: 
+            self.logfile = self.open_logfile()
+            self.logfile.seek(0, 2)
+        try:
+            for lines in self.follow():
+                for linedata in self.parse_lines(lines):
                     yield linedata
+        finally:
+            self.logfile.close()
+
+    def parse_lines(self, lines):
+        """Returns the LineData of a batch of lines, lines that 
+        cannot be parsed are skipped and counted as parse errors"""
+        result = []
+        errors = 0
+        parse_line = self.parse_line
+        for line in lines:
+            try:
+                linedata = parse_line(line)
+            except LogParseError:
+                errors += 1
+                continue
+            if linedata is not None: 
+                result.append(linedata)
+        if self.stats is not None:
+            self.stats.incr('lines_parsed', len(result))
+            self.stats.incr('parse_errors', errors)
+        return result
 
     def parse_line(self, line):
         """parse line is responsible returning a 
-        dictionary containing a subset of the data 
+        LineData containing a subset of the data 
         fields in the line formatted for convenience
         of computing monitoring metrics and stats"""
         raise NotImplementedError(self.__class__.__name__ + '.parseline')
 
 
 class CommonLogParser(BaseLogParser):
-    """Follows and Parses Common Log Format files"""
-    def __init__(self, filepath):
-        BaseLogParser.__init__(self, filepath)
+    """Follows and Parses Common Log Format files. An integer
+    field ending a line after the bytes field is taken to be the 
+    response time in microseconds (%D)"""
+    # maximum number of distinct parsed time strings cached
+    DATETIME_CACHE_SIZE = 1024
+
+    def __init__(self, filepath, watcher=None):
+        BaseLogParser.__init__(self, filepath, watcher)
         self.fieldnames = ['host', 'referrer', 
                            'user', 'datetime',
                            'request', 'status', 
-                           'bytes']
-        self.line_pattern = re.compile('([^ ]*) ([^ ]*) ([^ ]*) \[([^]]*)\] "([^"]*)" ([^ ]*) ([^ ]*)')
+                           'bytes', 'latency']
+        self.line_pattern = re.compile('([^ ]*) ([^ ]*) ([^ ]*) \[([^]]*)\] "([^"]*)" ([^ ]*) ([^ ]*)(?:.* (\d+)$)?')
+        # stricter pattern of well formed lines ending with a newline,
+        # capturing only the host, time (without zone), section (the
+        # first part of the uri path, so the uri itself is never
+        # copied), status, bytes and latency. The pattern matches
+        # within a single line so a whole batch of lines is matched
+        # in one pass over the lines joined by newlines. Whitespace
+        # is spelled out (as in \s), sets of literal characters are
+        # matched faster than sets including \s
+        self.fast_line_pattern = re.compile(
+            r'^([^%(ws)s]+) [^ \n]* [^ \n]* \[([^]%(ws)s]+) [^]%(ws)s]+\] '
+            r'"[^%(ws)s"]+ (?=[^%(ws)s"])[^%(ws)s"/]*(?:/([^%(ws)s"/]*)/)?[^%(ws)s"]* [^%(ws)s"]+" '
+            r'(\d+|-) (\d+|-)(?= |[%(hs)s]*\n)'
+            r'(?:[^\n]* (\d+)[%(hs)s]*(?=\n))?[^\n]*\n' % {'ws': r' \t\n\r\f\v',
+                                                          'hs': r' \t\r\f\v'},
+            re.MULTILINE)
+        # time string -> datetime, consecutive lines
+        # nearly always share the same time string
+        self._datetime_cache = {}
+
+    def parse_lines(self, lines):
+        """Matches the well formed lines of a batch with a single
+        pass of the fast line pattern, the lines in between are
+        parsed one at a time by parse_line_slow"""
+        text = '\n'.join(lines) + '\n'
+        # a batch allocates several tuples per line, which would
+        # otherwise trigger dozens of garbage collections (that
+        # cannot free any of them) per batch
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            result, errors = self.match_lines(text, len(lines))
+        finally:
+            if gc_enabled:
+                gc.enable()
+        if self.stats is not None:
+            self.stats.incr('lines_parsed', len(result))
+            self.stats.incr('parse_errors', errors)
+        return result
+
+    def match_lines(self, text, num_lines):
+        """Returns the LineData of the num_lines newline terminated
+        lines of text and the number of errors"""
+        # each match is a whole line, so either every line matched
+        # or the unmatched lines are found with finditer
+        groups = self.fast_line_pattern.findall(text)
+        if len(groups) == num_lines:
+            return self.fast_linedatas(groups)
+        result = []
+        errors = 0
+        position = 0
+        # consecutive matched lines are converted together
+        run = []
+        for match in self.fast_line_pattern.finditer(text):
+            start = match.start()
+            if start != position:
+                run_result, run_errors = self.fast_linedatas(run)
+                slow_result, slow_errors = self.parse_lines_slow(text[position:start])
+                result.extend(run_result)
+                result.extend(slow_result)
+                errors += run_errors + slow_errors
+                run = []
+            position = match.end()
+            # as in findall, unmatched groups are ''
+            run.append(match.groups(''))
+        run_result, run_errors = self.fast_linedatas(run)
+        result.extend(run_result)
+        errors += run_errors
+        if position != len(text):
+            slow_result, slow_errors = self.parse_lines_slow(text[position:])
+            result.extend(slow_result)
+            errors += slow_errors
+        return result, errors
+
+    def fast_linedatas(self, groups):
+        """Returns the LineData of a list of the groups of the fast
+        line pattern and the number of errors. Fields are converted a
+        column at a time by builtins rather than a line at a time"""
+        if not groups:
+            return [], 0
+        errors = 0
+        time_strs = set(group[1] for group in groups)
+        time_2_datetime = {}
+        for time_str in time_strs:
+            datetime_val = self._datetime_cache.get(time_str)
+            if datetime_val is None:
+                try:
+                    datetime_val = self.parse_datetime(time_str)
+                except LogParseError:
+                    continue
+            time_2_datetime[time_str] = datetime_val
+        if len(time_2_datetime) != len(time_strs):
+            # lines with invalid times are errors
+            valid_groups = [group for group in groups if group[1] in time_2_datetime]
+            errors = len(groups) - len(valid_groups)
+            groups = valid_groups
+            if not groups:
+                return [], errors
+        hosts, time_strs, sections, statuses, bytes, latencies = zip(*groups)
+        datetimes = map(time_2_datetime.__getitem__, time_strs)
+        # there are only a few distinct statuses
+        status_2_value = dict((status, 0 if status == '-' else int(status))
+                              for status in set(statuses))
+        statuses = map(status_2_value.__getitem__, statuses)
+        bytes = map(int, bytes) if '-' not in bytes else \
+                [0 if bytes_val == '-' else int(bytes_val) for bytes_val in bytes]
+        # microseconds to milliseconds
+        latencies = map(truediv, map(float, latencies), repeat(1000.0, len(groups))) if '' not in latencies else \
+                    [None if latency == '' else int(latency) / 1000.0 for latency in latencies]
+        pairs = zip(hosts, sections)
+        section_entries = map(self.section_table.host_sections.get, pairs)
+        if None in section_entries:
+            host_section = self.section_table.host_section
+            section_entries = [host_section(*pair) if section_entry is None else section_entry
+                               for pair, section_entry in zip(pairs, section_entries)]
+        sections, section_ids = zip(*section_entries)
+        return map(tuple.__new__, repeat(LineData, len(groups)),
+                   zip(sections, bytes, datetimes, statuses, latencies, section_ids)), errors
+
+    def parse_lines_slow(self, text):
+        """Returns the LineData of the newline terminated lines of text
+        not matched by the fast line pattern and the number of errors"""
+        result = []
+        errors = 0
+        for line in text.split('\n')[:-1]:
+            try:
+                result.append(self.parse_line_slow(line))
+            except LogParseError:
+                errors += 1
+        return result, errors
 
     def parse_line(self, line):
+        match = self.fast_line_pattern.match(line + '\n')
+        if match is None:
+            return self.parse_line_slow(line)
+        try:
+            return self.fast_linedata(*match.groups())
+        except LogParseError as error:
+            raise LogParseError(error.msg, line)
+
+    def fast_linedata(self, host, time_str, section, status, bytes, latency):
+        """LineData of the groups of the fast line pattern"""
+        datetime_val = self._datetime_cache.get(time_str)
+        if datetime_val is None:
+            datetime_val = self.parse_datetime(time_str)
+        section, section_id = self.section_table.host_section(host, section or '')
+        return LineData(section,
+                        0 if bytes == '-' else int(bytes),
+                        datetime_val,
+                        0 if status == '-' else int(status),
+                        None if latency is None else int(latency) / 1000.0,
+                        section_id)
+
+    def parse_line_slow(self, line):
+        """parses lines not matched by the fast line pattern"""
         line = line.strip()
-        match = self.line_pattern.match(line.strip())
+        match = self.line_pattern.match(line)
         if not match:
             raise LogParseError("Unexpected line format", line)
         datadict = dict(zip(self.fieldnames, match.groups()))
-        return self.linedata(datadict)
+        try:
+            return self.linedata(datadict)
+        except LogParseError as error:
+            raise LogParseError(error.msg, line)
+        except ValueError:
+            raise LogParseError("Unexpected field format", line)
+
+    def parse_datetime(self, time_str):
+        """parses and caches a time string, raises
+        LogParseError if the time string is invalid"""
+        if len(self._datetime_cache) >= self.DATETIME_CACHE_SIZE:
+            self._datetime_cache.clear()
+        try:
+            datetime_val = datetime.datetime.strptime(time_str, "%d/%b/%Y:%H:%M:%S")
+        except (ValueError, TypeError):
+            # TypeError is raised for time strings with null bytes
+            raise LogParseError("Unexpected time format: %s" % time_str)
+        self._datetime_cache[time_str] = datetime_val
+        return datetime_val
 
     def parse_int(self, str_val):
         result = 0
         if str_val != '-':
-            result = int(str_val)
+            try:
+                result = int(str_val)
+            except ValueError:
+                raise LogParseError("Unexpected integer format: %s" % str_val)
         return result
 
     def linedata(self, datadict):
-        """returns a dictionary with relevant values
+        """returns a LineData with relevant values
         given a dictionary of fields corresponding to
         a log line"""
-        linedata = {}
         # NOTE ignoring time zone
         time, zone = datadict['datetime'].split()
-        linedata[LINE_DATA_FIELDS.datetime] = datetime.datetime.strptime(time, "%d/%b/%Y:%H:%M:%S") 
+        datetime_val = self.parse_datetime(time)
         # parse section 
         host = datadict['host']
         _, uri, _ = datadict['request'].split()
-        uri_parts = uri.split('/')
-        section = ''
-        if len(uri_parts) > 2:
-            section = uri_parts[1]
-        section = host + '/' + section
-        linedata[LINE_DATA_FIELDS.section] = section
-        linedata[LINE_DATA_FIELDS.status] = self.parse_int(datadict['status'])
-        linedata[LINE_DATA_FIELDS.bytes] = self.parse_int(datadict['bytes'])
-        return linedata
+        section, section_id = self.section_table.host_section(host, uri_section(uri))
+        status_val = self.parse_int(datadict['status'])
+        bytes_val = self.parse_int(datadict['bytes'])
+        latency_val = None
+        if datadict['latency'] is not None:
+            # microseconds to milliseconds
+            latency_val = int(datadict['latency']) / 1000.0
+        return LineData(section, bytes_val, datetime_val, status_val, latency_val, section_id)
 
         
 class W3CLogParser(BaseLogParser):
     """Follows and Parses W3C Extended Log Format files"""
-    def __init__(self, filepath):
-        BaseLogParser.__init__(self, filepath)
+    FIELD_DIRECTIVE = "#Fields:"
+
+    def __init__(self, filepath, watcher=None, directive_cache=None):
+        BaseLogParser.__init__(self, filepath, watcher)
         self.fieldnames = None
+        # optional DirectiveCache used to avoid scanning
+        # the log file for the last field directive
+        self.directive_cache = directive_cache
+
+    def reset_fields(self):
+        # fields are declared by a field directive
+        # at the start of the file
+        self.fieldnames = []
+
+    def state(self):
+        """Also includes the fields of the field directive in effect"""
+        state = BaseLogParser.state(self)
+        state['fieldnames'] = self.fieldnames
+        return state
+
+    def restore_state(self, state):
+        restored = BaseLogParser.restore_state(self, state)
+        if restored:
+            self.fieldnames = state['fieldnames']
+        return restored
 
     def parse_line(self, line):
         line = line.strip()
@@ -120,7 +545,7 @@ class W3CLogParser(BaseLogParser):
         words = line.strip().split()
         if len(words) > 0:
             # Field directive lines
-            if words[0] == "#Fields:":
+            if words[0] == self.FIELD_DIRECTIVE:
                 self.fieldnames = words[1:]
             # convert entity lines to dictionaries
             elif words[0][0] != '#':
@@ -129,12 +554,23 @@ class W3CLogParser(BaseLogParser):
         if datadict is None:
             return None
 
-        return self.linedata(datadict)
+        try:
+            return self.linedata(datadict)
+        except LogParseError as error:
+            raise LogParseError(error.msg, line)
+        except KeyError as error:
+            raise LogParseError("Missing field %s" % error, line)
+        except ValueError:
+            raise LogParseError("Unexpected field format", line)
     
     def parse_int(self, str_val):
+        """0 if the field is not logged ('-' or missing)"""
         result = 0
-        if str_val != '-':
-            result = int(str_val)
+        if str_val is not None and str_val != '-':
+            try:
+                result = int(str_val)
+            except ValueError:
+                raise LogParseError("Unexpected integer format: %s" % str_val)
         return result
 
     def parse_date(self, date_str):
@@ -142,7 +578,10 @@ class W3CLogParser(BaseLogParser):
         # <date>  = 4<digit> "-" 2<digit> "-" 2<digit>
         date_val = None
         date_pattern = "%Y-%m-%d"
-        date_val = datetime.datetime.strptime(date_str, date_pattern)
+        try:
+            date_val = datetime.datetime.strptime(date_str, date_pattern)
+        except (ValueError, TypeError):
+            raise LogParseError("Unexpected date format: %s" % date_str)
         return date_val
 
     def parse_time(self, time_str):
@@ -156,66 +595,113 @@ class W3CLogParser(BaseLogParser):
                                   (\.(?P<microsecond>\d+))?$ # optional multidigit microsecond
                                   """, re.VERBOSE)
         match = re.match(time_pattern, time_str)
-        if match:
-            time_dict = {k:int(v) for k,v in match.groupdict().items() if v is not None}
-            # NOTE ignoring microsecond
-            if time_dict['second'] is None:
-                time_val = datetime.time(time_dict['hour'], time_dict['minute'])
-            else:
-                time_val = datetime.time(time_dict['hour'], time_dict['minute'], time_dict['second'])
+        if not match:
+            raise LogParseError("Unexpected time format: %s" % time_str)
+        time_dict = {k:int(v) for k,v in match.groupdict().items() if v is not None}
+        # NOTE ignoring microsecond
+        if time_dict.get('second') is None:
+            time_val = datetime.time(time_dict['hour'], time_dict['minute'])
+        else:
+            time_val = datetime.time(time_dict['hour'], time_dict['minute'], time_dict['second'])
         return time_val
 
 
     def linedata(self, datadict):
-        linedata = {}
         # parse section
         host = datadict.get('cs-host', datadict.get('s-ip', '')) 
         uri = datadict.get('cs-uri-path', datadict.get('cs-uri', datadict.get('cs-uri-stem', '')))
-        uri_parts = uri.split('/')
-        section = ''
-        if len(uri_parts) > 2:
-            section = uri_parts[1]
-        section = host + '/' + section
-        linedata[LINE_DATA_FIELDS.section] = section
+        section, section_id = self.section_table.host_section(host, uri_section(uri))
         # TODO check whether lines may have only one of date and time
         date_val = self.parse_date(datadict['date'])
         time_val = self.parse_time(datadict['time'])
         status_val = self.parse_int(datadict.get('sc-status', datadict.get('status')))
         bytes_val = self.parse_int(datadict.get('sc-bytes', datadict.get('bytes')))
         datetime_val = datetime.datetime.combine(date_val, time_val)
-        linedata[LINE_DATA_FIELDS.datetime] = datetime_val
-        linedata[LINE_DATA_FIELDS.status] = status_val
-        linedata[LINE_DATA_FIELDS.bytes] = bytes_val
-        return linedata
-
-    def find_last_field_directive(self):
-        """Traverses the file in reverse finding last Field directive"""
-        fieldnames = None
-        # save current position
-        position = self.logfile.tell()
-        for line in self.readlines_reverse():
-            words = line.strip().split()
-            if len(words) > 0 and words[0] == "#Fields:":
-                fieldnames = words[1:]
-                break
-        # go back to saved position
-        self.logfile.seek(position)
-        return fieldnames
-    
-    def readlines_reverse(self):
-        """Generator that yields lines from a file in reverse"""
-        # TODO read in larger blocks
-        # TODO verify logfile is valid file object
-        self.logfile.seek(0, os.SEEK_END)
-        position = self.logfile.tell()
-        line = ''
-        while position >= 0:
-            self.logfile.seek(position)
-            next_char = self.logfile.read(1)
-            if next_char == os.linesep: 
-                yield line[::-1]
-                line = ''
+        latency_val = self.parse_time_taken(datadict.get('time-taken'))
+        return LineData(section, bytes_val, datetime_val, status_val, latency_val, section_id)
+
+    def parse_time_taken(self, str_val):
+        """returns time-taken in milliseconds, None if not logged. 
+        Integer values are milliseconds (as logged by IIS), decimal 
+        values are seconds (as in the W3C specification)"""
+        if str_val is None or str_val == '-':
+            return None
+        if '.' in str_val:
+            return float(str_val) * 1000
+        return float(str_val)
+
+    def find_last_field_directive(self, end=None):
+        """Finds the fields of the last Field directive before 
+        offset end (defaults to the end of the file)"""
+        file_stat = os.fstat(self.logfile.fileno())
+        if end is None or end > file_stat.st_size:
+            end = file_stat.st_size
+        if end == 0:
+            return None
+        mapped = mmap.mmap(self.logfile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            cached = None
+            if self.directive_cache is not None:
+                cached = self.directive_cache.get(file_stat)
+                # the cached directive must still be found in the file
+                if (cached is not None and (cached[0] >= file_stat.st_size or
+                        self.field_directive_at(mapped, cached[0]) != cached[1])):
+                    cached = None
+            # the cached directive is used if it is before end
+            if cached is not None and cached[0] < end:
+                offset, fieldnames, scanned_to = cached
+                if end <= scanned_to:
+                    return fieldnames
+                # only scan the part of the file not scanned before
+                start = max(offset + 1, scanned_to - len(self.FIELD_DIRECTIVE))
+                found_offset, found_fieldnames = self.rfind_field_directive(mapped, start, end)
+                if found_offset is not None:
+                    offset, fieldnames = found_offset, found_fieldnames
             else:
-                line += next_char
-            position -= 1
-        yield line[::-1]
+                offset, fieldnames = self.rfind_field_directive(mapped, 0, end)
+                # the cached directive after end is kept as the
+                # file was scanned further
+                scanned_to = cached[2] if cached is not None else 0
+            if (self.directive_cache is not None and 
+                offset is not None and end > scanned_to):
+                self.directive_cache.put(file_stat, offset, fieldnames, end)
+            return fieldnames
+        finally:
+            mapped.close()
+
+    def rfind_field_directive(self, mapped, start, end):
+        """Returns the offset and fields of the last Field directive 
+        starting between offsets start and end of the memory mapped 
+        log file, (None, None) if there is none"""
+        while True:
+            offset = mapped.rfind(self.FIELD_DIRECTIVE, start, end)
+            if offset == -1:
+                return None, None
+            fieldnames = self.field_directive_at(mapped, offset)
+            if fieldnames is not None:
+                return offset, fieldnames
+            end = offset
+
+    def field_directive_at(self, mapped, offset):
+        """Returns the fields of the Field directive at offset
+        of the memory mapped log file, None if there is none"""
+        line_start = mapped.rfind('\n', 0, offset) + 1
+        line_end = mapped.find('\n', offset)
+        if line_end == -1:
+            line_end = len(mapped)
+        words = mapped[line_start:line_end].split()
+        if len(words) == 0 or words[0] != self.FIELD_DIRECTIVE:
+            return None
+        # the directive must start the line
+        if mapped[line_start:offset].strip():
+            return None
+        return words[1:]
+
+
+def create_logparser(logtype, filepath, watcher=None, directive_cache=None):
+    """Returns a log parser for logtype ('common' or 'w3c'),
+    directive_cache is only used by w3c log parsers"""
+    if logtype == 'common':
+        return CommonLogParser(filepath, watcher)
+    else: # 'w3c'
+        return W3CLogParser(filepath, watcher, directive_cache)
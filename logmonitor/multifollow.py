@@ -0,0 +1,58 @@
+from .watcher import get_watcher
+
+
+class MultiLogFollower(object):
+    """Follows several log files from a single loop, a single
+    watcher is used to wait for changes to any of the files.
+    checkpoint is an optional function called between batches
+    of lines once all lines yielded have been consumed"""
+    # seconds to wait for the watcher to report a change
+    # before checking all log files again
+    WAIT_TIMEOUT = 1.0
+
+    def __init__(self, logparsers, watcher=None, checkpoint=None):
+        super(MultiLogFollower, self).__init__()
+        self.logparsers = logparsers
+        self.watcher = watcher
+        self.checkpoint = checkpoint
+
+    def parsedlines(self):
+        """Tails log files and yields (log parser, LineData) 
+        pairs corresponding to log lines"""
+        if self.watcher is None:
+            self.watcher = get_watcher()
+        filepath_2_logparser = {}
+        for logparser in self.logparsers:
+            if logparser.logfile is None:
+                logparser.logfile = logparser.open_logfile()
+                logparser.logfile.seek(0, 2)
+            self.watcher.add(logparser.filepath)
+            filepath_2_logparser[logparser.filepath] = logparser
+        # log parsers that may have data available
+        ready = list(self.logparsers)
+        try:
+            while True:
+                # read a block from each ready log file in turn
+                # until none has data available
+                for logparser in ready[:]:
+                    lines = logparser.read_lines()
+                    if lines is None:
+                        ready.remove(logparser)
+                        continue
+                    for linedata in logparser.parse_lines(lines):
+                        yield logparser, linedata
+                    if self.checkpoint is not None:
+                        self.checkpoint()
+                if not ready:
+                    changed = self.watcher.wait(self.WAIT_TIMEOUT)
+                    if changed:
+                        ready = [filepath_2_logparser[filepath] for filepath in changed
+                                 if filepath in filepath_2_logparser]
+                    else:
+                        # check all log files in case a change was missed
+                        ready = list(self.logparsers)
+                    if self.checkpoint is not None:
+                        self.checkpoint()
+        finally:
+            for logparser in self.logparsers:
+                logparser.logfile.close()
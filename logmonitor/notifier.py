@@ -1,28 +1,46 @@
 
 import datetime
-from .logparser import LINE_DATA_FIELDS
-from .utils import enum
+import time
+import heapq
+from threading import Lock
+from .utils import enum, datetime_to_seconds, seconds_to_datetime
+from .slidingwindow import SlidingWindowCounter
 from .repeatfunctionthread import RepeatFunctionThread 
+from .doublebuffer import DoubleBuffer
+from .topk import SpaceSaving
+from .sketch import QuantileSketch
+from .sections import SECTION_TABLE
 
 
-MESSAGE_TYPES = enum('summary', 'alert')
+MESSAGE_TYPES = enum('summary', 'alert', 'stats')
 
 class Message(object):
-    """Messages sent to Displays by Notifiers"""
-    def __init__(self, lines, type):
+    """Messages sent to Displays by Notifiers. data is an optional
+    dictionary of the values shown in lines for displays that
+    export metrics rather than text"""
+    def __init__(self, lines, type, data=None):
         super(Message, self).__init__()
         self.lines = lines
         self.type = type
+        self.data = data
 
 
 class BaseNotifier(object):
     """Base class for notifiers calls notify method every
-    interval seconds"""
-    def __init__(self, display, notify_interval):
+    interval seconds. If stats are given the duration of
+    notifies is observed as name + '_notify_ms'"""
+    name = 'base'
+
+    def __init__(self, display, notify_interval, stats=None):
         super(BaseNotifier, self).__init__()
         self.display = display
+        self.stats = stats
+        # notify may be called by the repeater thread and
+        # the thread inserting data
+        self._notify_lock = Lock()
         self.repeater_thread = RepeatFunctionThread(notify_interval, self.notify)
         self.repeater_thread.setDaemon(True)
+        self.repeater_thread.stats = stats
 
     def start(self):
         self.repeater_thread.start()
@@ -39,90 +57,560 @@ class BaseNotifier(object):
         raise NotImplementedError(self.__class__.__name__ + '.message')
 
     def notify(self): 
-        message = self.message()
-        if self.display is not None:
-            self.display.show(message)
+        with self._notify_lock:
+            start = time.time()
+            message = self.message()
+            if self.display is not None and (message.lines or message.data is not None):
+                self.display.show(message)
+            if self.stats is not None:
+                self.stats.observe(self.name + '_notify_ms', (time.time() - start) * 1000)
 
 
-class SummaryNotifier(BaseNotifier):
-    """Responsible for collecting information about popular
-    website sections and summary stats"""
-    def __init__(self, display, notify_interval):
-        BaseNotifier.__init__(self, display, notify_interval)
-        self.section_2_hits = {}
+class SummaryData(object):
+    """Summary stats collected during a notify interval, hits
+    are counted for (approximately) the SECTIONS_FACTOR * top_k
+    most popular sections so that the top_k sections shown are
+    the truly popular ones even when there are many sections.
+    Quantiles of latency and response size are estimated overall
+    and for the sections counted. Lines are counted in batches of
+    FLUSH_SIZE lines, flush must be called before reading stats.
+    Sections are counted by their keys in SECTION_TABLE (section ids),
+    the sections of the keys counted are kept as the table may forget
+    them. Pickled copies have sections as keys so they can be read by
+    other processes"""
+    SECTIONS_FACTOR = 4
+    FLUSH_SIZE = 4096
+
+    def __init__(self, top_k):
+        super(SummaryData, self).__init__()
+        self.top_k = top_k
+        self.section_hits = SpaceSaving(self.SECTIONS_FACTOR * top_k)
+        self.filepath_2_hits = {}
         self.bytes = 0
         self.error_code_count = 0
+        self.latency = QuantileSketch()
+        self.response_bytes = QuantileSketch()
+        # section key -> (latency, response bytes) QuantileSketches
+        # of the hits of sections since they were last counted
+        self.section_2_sketches = {}
+        # section key -> section of the sections counted
+        self.section_names = {}
+        # lines not yet counted
+        self._pending = []
 
-    def insert_data(self, linedata):
+    def insert_data(self, linedata, filepath=None):
+        self._pending.append(linedata)
+        if filepath is not None:
+            self.filepath_2_hits[filepath] = self.filepath_2_hits.get(filepath, 0) + 1
+        if len(self._pending) >= self.FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Counts the lines inserted since the last flush"""
+        pending = self._pending
+        if not pending:
+            return
+        self._pending = []
+        keys = [linedata.section_id for linedata in pending]
+        if None in keys:
+            # lines of sections not interned by a parser
+            keys = [SECTION_TABLE.key(linedata.section) if key is None else key
+                    for key, linedata in zip(keys, pending)]
+        section_2_hits = {}
+        for key in keys:
+            section_2_hits[key] = section_2_hits.get(key, 0) + 1
+        self.insert_section_hits(section_2_hits)
+        section_hits = self.section_hits
+        section_2_sketches = self.section_2_sketches
+        # values of the sections still counted
+        section_2_values = dict((key, ([], [])) for key in section_2_hits
+                                if key in section_hits)
+        latencies = []
+        response_bytes = []
+        errors = 0
+        for key, linedata in zip(keys, pending):
+            values = section_2_values.get(key)
+            if linedata.latency is not None:
+                latencies.append(linedata.latency)
+                if values is not None:
+                    values[0].append(linedata.latency)
+            response_bytes.append(linedata.bytes)
+            if values is not None:
+                values[1].append(linedata.bytes)
+            # 400 and above status codes are errors
+            if linedata.status >= 400:
+                errors += 1
+        self.latency.insert_values(latencies)
+        self.response_bytes.insert_values(response_bytes)
+        self.bytes += sum(response_bytes)
+        self.error_code_count += errors
+        # sections newly counted are named from their lines as their
+        # ids may already be forgotten by SECTION_TABLE
+        new_keys = set(section_2_values).difference(section_2_sketches)
+        if new_keys:
+            for key, linedata in zip(keys, pending):
+                if key in new_keys:
+                    self.section_names[key] = linedata.section
+        for key, (section_latencies, section_response_bytes) in section_2_values.items():
+            sketches = section_2_sketches.get(key)
+            if sketches is None:
+                sketches = section_2_sketches[key] = (QuantileSketch(), QuantileSketch())
+            sketches[0].insert_values(section_latencies)
+            sketches[1].insert_values(section_response_bytes)
+
+    def insert_section_hits(self, section_2_hits):
+        """Counts the hits of the section keys of a batch of lines, the
+        sketches of the sections no longer counted are discarded"""
+        # the exact counts of the most popular sections of the
+        # batch are merged (inserting every section of the batch
+        # would replace popular sections with the last ones)
+        section_hits = self.section_hits
+        batch_hits = SpaceSaving(section_hits.k)
+        for section, hits in heapq.nlargest(section_hits.k, section_2_hits.items(),
+                                            key=lambda section_hits: section_hits[1]):
+            batch_hits.insert(section, hits)
+        batch_hits.total = sum(section_2_hits.values())
+        section_hits.merge(batch_hits)
+        section_2_sketches = self.section_2_sketches
+        for key in [key for key in section_2_sketches if key not in section_hits]:
+            del section_2_sketches[key]
+            del self.section_names[key]
+
+    def __getstate__(self):
+        """Pending lines are counted and section keys are replaced
+        by sections, section ids are only valid in this process"""
+        self.flush()
+        name = self.section_names.__getitem__
+        state = self.__dict__.copy()
+        state['section_hits'] = self.section_hits.map_items(name)
+        state['section_2_sketches'] = dict((name(key), sketches) for key, sketches
+                                           in self.section_2_sketches.items())
+        del state['section_names']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.section_hits = self.section_hits.map_items(SECTION_TABLE.key)
+        self.section_2_sketches = dict((SECTION_TABLE.key(section), sketches) for section, sketches
+                                       in self.section_2_sketches.items())
+        self.section_names = dict((SECTION_TABLE.key(section), section)
+                                  for section in state['section_2_sketches'])
+
+    def state(self):
+        """Returns the stats as a dictionary of JSON types
+        with sections rather than section keys"""
+        self.flush()
+        name = self.section_names.__getitem__
+        return {'top_k': self.top_k,
+                'section_hits': self.section_hits.map_items(name).state(),
+                'filepath_2_hits': dict(self.filepath_2_hits),
+                'bytes': self.bytes,
+                'error_code_count': self.error_code_count,
+                'latency': self.latency.state(),
+                'response_bytes': self.response_bytes.state(),
+                'section_sketches': [[name(key), latency.state(), response_bytes.state()]
+                                     for key, (latency, response_bytes)
+                                     in self.section_2_sketches.items()]}
+
+    def restore_state(self, state):
+        """Restores the stats of a state returned by state"""
+        def sketch(sketch_state):
+            result = QuantileSketch(sketch_state['relative_accuracy'],
+                                    sketch_state['max_buckets'])
+            result.restore_state(sketch_state)
+            return result
+        section_hits = SpaceSaving(state['section_hits']['k'])
+        section_hits.restore_state(state['section_hits'])
+        self.section_hits = section_hits.map_items(SECTION_TABLE.key)
+        self.filepath_2_hits = dict(state['filepath_2_hits'])
+        self.bytes = state['bytes']
+        self.error_code_count = state['error_code_count']
+        self.latency = sketch(state['latency'])
+        self.response_bytes = sketch(state['response_bytes'])
+        self.section_2_sketches = dict((SECTION_TABLE.key(section),
+                                        (sketch(latency), sketch(response_bytes)))
+                                       for section, latency, response_bytes
+                                       in state['section_sketches'])
+        self.section_names = dict((SECTION_TABLE.key(section), section)
+                                  for section, _, _ in state['section_sketches'])
+
+    def merge(self, other):
+        """Adds the stats of another SummaryData"""
+        self.flush()
+        other.flush()
+        self.section_hits.merge(other.section_hits)
+        self.latency.merge(other.latency)
+        self.response_bytes.merge(other.response_bytes)
+        section_2_sketches = {}
+        section_names = {}
+        for key, _, _ in self.section_hits.top():
+            sketches = self.section_2_sketches.get(key)
+            other_sketches = other.section_2_sketches.get(key)
+            if sketches is None:
+                sketches = (QuantileSketch(), QuantileSketch())
+            if other_sketches is not None:
+                sketches[0].merge(other_sketches[0])
+                sketches[1].merge(other_sketches[1])
+            section_2_sketches[key] = sketches
+            section_names[key] = self.section_names.get(key) or other.section_names[key]
+        self.section_2_sketches = section_2_sketches
+        self.section_names = section_names
+        for filepath, hits in other.filepath_2_hits.items():
+            self.filepath_2_hits[filepath] = self.filepath_2_hits.get(filepath, 0) + hits
+        self.bytes += other.bytes
+        self.error_code_count += other.error_code_count
+
+
+# quantiles of sections are shown once estimated from MIN_QUANTILE_SAMPLES
+MIN_QUANTILE_SAMPLES = 20
+
+
+def quantiles_str(sketch):
+    """p50/p95/p99 of a QuantileSketch formatted for display"""
+    return "/".join("%.0f" % sketch.quantile(q) for q in (0.5, 0.95, 0.99))
+
+
+class SummaryNotifier(BaseNotifier):
+    """Responsible for collecting information about popular
+    website sections and summary stats. Lines are also counted
+    in an optional TimeSeries whose trends are shown in summaries"""
+    name = 'summary'
+
+    def __init__(self, display, notify_interval, top_k=10, stats=None, timeseries=None):
+        BaseNotifier.__init__(self, display, notify_interval, stats)
+        self.top_k = top_k
+        self.timeseries = timeseries
+        # data is inserted into the active SummaryData which
+        # is swapped for an empty one each notify interval
+        self._summary_data = DoubleBuffer(lambda: SummaryData(top_k))
+
+    def insert_data(self, linedata, filepath=None):
+        """filepath of the log file the line was read from 
+        is given to break down hits per log file"""
         super(SummaryNotifier, self).insert_data(linedata)
-        section = linedata[LINE_DATA_FIELDS.section]
-        self.section_2_hits[section] = self.section_2_hits.get(section, 0) + 1
-        self.bytes += linedata[LINE_DATA_FIELDS.bytes]
-        statuscode = linedata[LINE_DATA_FIELDS.status]
-        # 400 and above status codes are errors 
-        if statuscode >= 400:
-            self.error_code_count += 1
+        summary_data = self._summary_data.acquire()
+        summary_data.insert_data(linedata, filepath)
+        self._summary_data.release()
+        if self.timeseries is not None:
+            self.timeseries.insert_data(linedata)
 
     def purge_data(self):
-        self.section_2_hits = {}
-        self.error_code_count = 0
-        self.bytes = 0
+        """Returns data collected since the last purge"""
+        summary_data = self._summary_data.swap()
+        summary_data.flush()
+        return summary_data
 
     def message(self):
-        # copy data (to return) and purge 
-        section_2_hits = self.section_2_hits.copy()
-        error_code_count = self.error_code_count
-        bytes = self.bytes
-        self.purge_data()
+        message = self.summary_message(self.purge_data())
+        if self.timeseries is not None:
+            self.timeseries.merge_pending()
+            # trends end now unless later lines were logged
+            end = datetime_to_seconds(datetime.datetime.now())
+            if self.timeseries.end is not None:
+                end = max(end, self.timeseries.end)
+            message.lines[-1:-1] = [""] + self.timeseries.trend_lines(end=end)
+        return message
+
+    def state(self):
+        """Returns the state (see SummaryData.state) of the data collected
+        since the last purge, called by the thread inserting data"""
+        summary_data = self._summary_data.acquire()
+        state = summary_data.state()
+        self._summary_data.release()
+        return state
+
+    def restore_state(self, state):
+        """Adds the data of a state returned by state"""
+        summary_data = SummaryData(state['top_k'])
+        summary_data.restore_state(state)
+        self.insert_summary(summary_data)
+
+    def insert_summary(self, summary_data):
+        """Adds the data of a SummaryData (e.g. of a batch of lines)"""
+        active_summary_data = self._summary_data.acquire()
+        active_summary_data.merge(summary_data)
+        self._summary_data.release()
+
+    def summary_message(self, summary_data, start_time=None):
+        """Summary message of summary_data, start_time of the
+        interval the data was collected in is displayed if given"""
+        summary_data.flush()
+        section_hits = summary_data.section_hits
+        filepath_2_hits = summary_data.filepath_2_hits
+        error_code_count = summary_data.error_code_count
+        bytes = summary_data.bytes
         
         lines = ["-" * 25,
                  "*** SUMMARY ***",
-                 "",
-                 "Total Kilobytes Transferred: %d" % (bytes/1024),
-                 "HTTP Errors: %d" % error_code_count,
-                 ""
-                 ]
-        if section_2_hits:
-            lines.append("Popular Sections:")
-            for section, hits in section_2_hits.items():
-                lines.append("%s : %d hits" % (section, hits))
+                 ""]
+        if start_time is not None:
+            lines.extend(["Interval Start: %s" % start_time, ""])
+        lines += ["Total Kilobytes Transferred: %d" % (bytes/1024),
+                 "HTTP Errors: %d" % error_code_count]
+        if summary_data.latency.count > 0:
+            lines.append("Response Time p50/p95/p99: %s ms" % quantiles_str(summary_data.latency))
+        if summary_data.response_bytes.count > 0:
+            lines.append("Response Size p50/p95/p99: %s bytes" % quantiles_str(summary_data.response_bytes))
+        lines.append("")
+        top = section_hits.top(summary_data.top_k)
+        if top:
+            error_bound = max(error for _, _, error in top)
+            if error_bound > 0:
+                lines.append("Popular Sections (hits may be overestimated by up to %d):" % error_bound)
+            else:
+                lines.append("Popular Sections:")
+            for key, hits, _ in top:
+                lines.append("%s : %d hits" % (summary_data.section_names[key], hits))
+                # sketches only have the hits of sections
+                # since they were last counted
+                latency, response_bytes = summary_data.section_2_sketches[key]
+                if latency.count >= MIN_QUANTILE_SAMPLES:
+                    lines.append("  time p50/p95/p99: %s ms" % quantiles_str(latency))
+                if response_bytes.count >= MIN_QUANTILE_SAMPLES:
+                    lines.append("  size p50/p95/p99: %s bytes" % quantiles_str(response_bytes))
+        if filepath_2_hits:
+            lines.append("")
+            lines.append("Log Files:")
+            for filepath, hits in sorted(filepath_2_hits.items()):
+                lines.append("%s : %d hits" % (filepath, hits))
         lines.append("-" * 25)
-        message = Message(lines, MESSAGE_TYPES.summary)
+        # hits guaranteed (not overestimated) are exported
+        data = {'hits': section_hits.total,
+                'bytes': bytes,
+                'errors': error_code_count,
+                'section_hits': [(summary_data.section_names[key], hits - error)
+                                 for key, hits, error in top if hits > error]}
+        message = Message(lines, MESSAGE_TYPES.summary, data)
         return message
 
 
+class PendingHits(object):
+    """Hits per second inserted between notifies"""
+    def __init__(self):
+        super(PendingHits, self).__init__()
+        self.second_2_hits = {}
+        self.hits = 0
+        # (second, section key) -> hits, only counted for anomalies by section
+        self.section_hits = {}
+
+
 class AlertNotifier(BaseNotifier):
     """Responsible for determining when website hits cross
-    a specified threshold"""
-    def __init__(self, display, notify_interval, hits_interval, hits_threshold):
-        BaseNotifier.__init__(self, display, notify_interval)
+    a specified threshold. By default the window ends at the 
+    current time when notifying. In event time mode the window
+    ends at a watermark derived from the logged times instead: 
+    a second is evaluated once a hit more than lateness seconds
+    later has been inserted, alerts are stamped with the logged
+    time and are shown by the thread inserting data. When no hits
+    are inserted the logged time is assumed to follow the wall clock
+    so that alerts recover when traffic stops. In adaptive mode
+    (given an AnomalyDetector) alerts are raised when hits are 
+    anomalously high rather than above hits_threshold"""
+    name = 'alert'
+
+    def __init__(self, display, notify_interval, hits_interval, hits_threshold, stats=None,
+                 event_time=False, lateness=0, anomaly_detector=None):
+        BaseNotifier.__init__(self, display, notify_interval, stats)
+        if event_time and anomaly_detector is not None:
+            raise ValueError("Adaptive alerts are not supported in event time mode")
         self.hits_interval = datetime.timedelta(seconds=hits_interval)
         self.hits_threshold = hits_threshold
-        self._time_2_hits = {}
-        self.hits = 0
+        self.event_time = event_time
+        self.lateness = lateness
+        self.anomaly_detector = anomaly_detector
+        # hits per second in the last hits_interval seconds,
+        # only updated when notifying (or in event time mode
+        # when the watermark advances)
+        self._window = SlidingWindowCounter(hits_interval)
+        # hits inserted since the last notify
+        self._pending_hits = DoubleBuffer(PendingHits)
         self.is_alert_displayed = False
+        # event time mode: latest second inserted, wall clock time
+        # of the latest insert, latest second evaluated and hits
+        # later than the watermark
+        self._max_second = None
+        self._last_insert_time = None
+        self.watermark = None
+        self._event_hits = {}
+
+    @property
+    def hits(self):
+        return self._window.total
 
     def purge_old_data(self, event_time):
         # purge old data (determined by interval)
-        for time, hits in self._time_2_hits.items():
-            if time + self.hits_interval < event_time:
-                self.hits -= hits
-                del self._time_2_hits[time]
+        self._window.advance(datetime_to_seconds(event_time))
 
     def insert_data(self, linedata):
         super(AlertNotifier, self).insert_data(linedata)
+        if self.event_time:
+            self.insert_event(datetime_to_seconds(linedata.datetime))
+            return
+        if self.anomaly_detector is not None:
+            # anomalies are only evaluated when notifying
+            key = None
+            if self.anomaly_detector.by_section:
+                key = linedata.section_id
+                if key is None:
+                    key = SECTION_TABLE.key(linedata.section)
+            self.insert_hits(datetime_to_seconds(linedata.datetime), 1, key)
+            return
         # insert current event
-        event_time = linedata[LINE_DATA_FIELDS.datetime]
-        self._time_2_hits[event_time] = self._time_2_hits.get(event_time, 0) + 1
-        self.hits += 1
-        self.notify()
+        pending_hits = self.insert_hits(datetime_to_seconds(linedata.datetime), 1)
+        # notify only when the threshold may have been crossed
+        # (pending hits may already have been counted in the window)
+        if (not self.is_alert_displayed and 
+            self._window.total + pending_hits.hits > self.hits_threshold):
+            self.notify()
+
+    def insert_hits(self, second, hits, section_key=None):
+        """Inserts hits that occurred at epoch second, hits are 
+        counted in the window when notifying. Hits are also counted
+        by section if the section's key in SECTION_TABLE is given.
+        Returns the PendingHits the hits were inserted into"""
+        pending_hits = self._pending_hits.acquire()
+        pending_hits.second_2_hits[second] = pending_hits.second_2_hits.get(second, 0) + hits
+        pending_hits.hits += hits
+        if section_key is not None:
+            section_hits = pending_hits.section_hits
+            key = (second, section_key)
+            section_hits[key] = section_hits.get(key, 0) + hits
+        self._pending_hits.release()
+        return pending_hits
+
+    def insert_event(self, second, hits=1):
+        """Inserts hits that occurred at epoch second in event time 
+        mode, hits not later than the watermark are counted if they
+        still fall in the window. Returns the alert messages of the
+        seconds evaluated, which are also displayed"""
+        # the watermark is also advanced by the notifier thread
+        with self._notify_lock:
+            return self._insert_event(second, hits)
+
+    def _insert_event(self, second, hits):
+        if self._max_second is None:
+            self._max_second = second
+            self.watermark = second - self.lateness - 1
+        if second > self.watermark:
+            self._event_hits[second] = self._event_hits.get(second, 0) + hits
+        elif self._window.add(second, hits):
+            # late hits change later evaluations
+            if self.stats is not None:
+                self.stats.incr('late_hits', hits)
+        elif self.stats is not None:
+            self.stats.incr('dropped_hits', hits)
+        self._last_insert_time = time.time()
+        if second <= self._max_second:
+            return []
+        self._max_second = second
+        return self.advance_watermark(second - self.lateness - 1)
+
+    def advance_idle(self, now):
+        """Advances the watermark as if hits had kept being inserted
+        up to epoch time now since the last hit, at the wall clock
+        rate. Returns the alert messages, which are also displayed"""
+        if self._max_second is None:
+            return []
+        idle = int(now - self._last_insert_time)
+        return self.advance_watermark(self._max_second + idle - self.lateness - 1)
+
+    def advance_watermark(self, watermark):
+        """Evaluates the window ending at each second up to watermark, 
+        seconds after which neither hits are counted nor expire are 
+        skipped. Returns the alert messages, which are also displayed"""
+        messages = []
+        event_hits = self._event_hits
+        second = self.watermark + 1
+        while second <= watermark:
+            hits = event_hits.pop(second, 0)
+            if hits:
+                self._window.add(second, hits)
+            else:
+                self._window.advance(second)
+            message = self.evaluate_second(second)
+            if message.lines:
+                messages.append(message)
+                if self.display is not None:
+                    self.display.show(message)
+            second += 1
+            if self._window.total == 0 and not self.is_alert_displayed:
+                # nothing changes until the next second with hits
+                later = [later_second for later_second in event_hits if later_second >= second]
+                second = min(later) if later else watermark + 1
+        self.watermark = max(self.watermark, watermark)
+        return messages
+
+    def evaluate_second(self, second):
+        """Message for the hits in the window ending at second"""
+        lines = []
+        if self.hits > self.hits_threshold:
+            if not self.is_alert_displayed:
+                self.is_alert_displayed = True
+                lines.extend(self.high_traffic_message(self.hits, seconds_to_datetime(second)))
+        elif self.is_alert_displayed:
+            self.is_alert_displayed = False
+            lines.extend(self.recovered_message(seconds_to_datetime(second)))
+        data = {'hits': self.hits, 'alert': self.is_alert_displayed, 'time': second}
+        return Message(lines, MESSAGE_TYPES.alert, data)
+
+    def state(self):
+        """Returns a dictionary of second -> hits of the hits in the
+        window and the pending hits, called by the thread inserting data"""
+        with self._notify_lock:
+            second_2_hits = self._window.counts()
+            pending_hits = self._pending_hits.acquire()
+            for second, hits in pending_hits.second_2_hits.items():
+                second_2_hits[second] = second_2_hits.get(second, 0) + hits
+            self._pending_hits.release()
+            for second, hits in self._event_hits.items():
+                second_2_hits[second] = second_2_hits.get(second, 0) + hits
+        return second_2_hits
+
+    def restore_state(self, state):
+        """Inserts the hits of a state returned by state"""
+        self.insert_second_hits(state)
+
+    def insert_second_hits(self, second_2_hits):
+        """Inserts a dictionary of epoch second -> hits
+        (e.g. of a batch of lines)"""
+        for second, hits in sorted(second_2_hits.items()):
+            if self.event_time:
+                self.insert_event(second, hits)
+            else:
+                self.insert_hits(second, hits)
+
+    def merge_pending_hits(self):
+        pending_hits = self._pending_hits.swap()
+        for second, hits in pending_hits.second_2_hits.items():
+            self._window.add(second, hits)
+        if self.anomaly_detector is not None:
+            # all hits are tracked as the key None
+            for second, hits in pending_hits.second_2_hits.items():
+                self.anomaly_detector.insert(None, second, hits)
+            # sections are tracked by name as the ids of sections
+            # may be forgotten by SECTION_TABLE
+            for (second, section_key), hits in pending_hits.section_hits.items():
+                self.anomaly_detector.insert(SECTION_TABLE.name(section_key), second, hits)
 
     def message(self):    
         """Display a messages when hits threshold is crossed
         and when hits subsequently drops below threshold (recovers)."""
-        # purge old data
+        if self.event_time:
+            # alerts are displayed as the watermark advances,
+            # which only happens here once traffic stops
+            self.advance_idle(time.time())
+            return Message([], MESSAGE_TYPES.alert, 
+                           {'hits': self.hits, 'alert': self.is_alert_displayed})
         now = datetime.datetime.now().replace(microsecond=0)
+        return self.evaluate(now)
+
+    def evaluate(self, now):
+        """Message for the hits in the window ending at now"""
+        # purge old data
+        self.merge_pending_hits()
         self.purge_old_data(now)
+        if self.anomaly_detector is not None:
+            return self.evaluate_anomalies(now)
         # create message if necessary
         lines = []
         if self.hits > self.hits_threshold:
@@ -132,9 +620,39 @@ class AlertNotifier(BaseNotifier):
         elif self.is_alert_displayed:
             self.is_alert_displayed = False
             lines.extend(self.recovered_message(now))
-        message = Message(lines, MESSAGE_TYPES.alert)
+        data = {'hits': self.hits, 'alert': self.is_alert_displayed}
+        message = Message(lines, MESSAGE_TYPES.alert, data)
         return message
 
+    def evaluate_anomalies(self, now):
+        """Message for the anomalies raised or cleared up to now"""
+        detector = self.anomaly_detector
+        lines = []
+        for key, raised, level, mean, std in detector.advance(datetime_to_seconds(now)):
+            if key is None:
+                self.is_alert_displayed = raised
+                if raised:
+                    lines.extend(self.anomaly_message(self.hits, mean, std, now))
+                else:
+                    lines.extend(self.recovered_message(now))
+            elif raised:
+                lines.append("Section %s traffic anomaly generated an alert - hits/s = %.1f "
+                             "(expected %.1f), triggered at %s"
+                             % (key, level, mean, now))
+            else:
+                lines.append("Section %s alert recovered at %s" % (key, now))
+        if detector.dropped_keys and self.stats is not None:
+            self.stats.incr('anomaly_keys_dropped', detector.dropped_keys)
+        detector.dropped_keys = 0
+        data = {'hits': self.hits, 'alert': self.is_alert_displayed}
+        return Message(lines, MESSAGE_TYPES.alert, data)
+
+    def anomaly_message(self, hits, mean, std, time):
+        interval = self.hits_interval.total_seconds()
+        message_str = ("High traffic anomaly generated an alert - hits = %i (expected %.0f, "
+                       "std %.1f per second), triggered at %s" % (hits, mean * interval, std, time))
+        return [message_str]
+
     def high_traffic_message(self, hits, time):
         message_str = "High traffic generated an alert - hits = %i, triggered at %s" % (hits, time)
         return [message_str]
@@ -142,3 +660,55 @@ class AlertNotifier(BaseNotifier):
     def recovered_message(self, time):
         message_str = "alert recovered at %s" % (time)
         return [message_str]
+
+
+class StatsNotifier(BaseNotifier):
+    """Responsible for displaying the self-metrics of the monitor,
+    rates are computed over the interval since the last notify.
+    Each snapshot is also dumped as JSON to statsfile if given"""
+    name = 'stats'
+
+    def __init__(self, display, notify_interval, stats, statsfile=None):
+        BaseNotifier.__init__(self, display, notify_interval, stats)
+        self.statsfile = statsfile
+        self._last_snapshot = None
+        self._start_time = time.time()
+
+    def message(self):
+        snapshot = self.stats.snapshot()
+        if self.statsfile is not None:
+            self.stats.dump(self.statsfile)
+        message = self.stats_message(snapshot, self._last_snapshot)
+        self._last_snapshot = snapshot
+        return message
+
+    def stats_message(self, snapshot, last_snapshot=None):
+        counters = snapshot['counters']
+        if last_snapshot is None:
+            last_counters = {}
+            elapsed = snapshot['time'] - self._start_time
+        else:
+            last_counters = last_snapshot['counters']
+            elapsed = snapshot['time'] - last_snapshot['time']
+
+        def rate(name):
+            count = counters.get(name, 0) - last_counters.get(name, 0)
+            return count / elapsed if elapsed > 0 else 0.0
+
+        lines = ["-" * 25,
+                 "*** STATS ***",
+                 "",
+                 "Lines Read: %d (%.0f/s)" % (counters.get('lines_read', 0), rate('lines_read')),
+                 "Lines Parsed: %d (%.0f/s)" % (counters.get('lines_parsed', 0), rate('lines_parsed')),
+                 "Parse Errors: %d" % counters.get('parse_errors', 0),
+                 "Kilobytes Read: %d (%.0f/s)" % (counters.get('bytes_read', 0) / 1024,
+                                                  rate('bytes_read') / 1024),
+                 "Missed Ticks: %d" % counters.get('missed_ticks', 0)]
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines.append("%s: %s" % (name, value))
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            lines.append("%s p50/p99/max: %.1f/%.1f/%.1f" % (name, histogram['p50'],
+                                                             histogram['p99'],
+                                                             histogram['max']))
+        lines.append("-" * 25)
+        return Message(lines, MESSAGE_TYPES.stats, snapshot)
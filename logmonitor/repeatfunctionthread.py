@@ -24,6 +24,8 @@ class RepeatFunctionThread(Thread):
         self.args = args
         self.kwargs = kwargs
         self._terminate = Event()
+        # optional Stats missed calls are counted in
+        self.stats = None
 
     def stop(self):
         self._terminate.set()
@@ -38,11 +40,23 @@ class RepeatFunctionThread(Thread):
                 error = RepeatFunctionThreadError(traceback.format_exc())
                 self._exceptionqueue.put(error)
             next_call = next_call + self.interval;
-            self._terminate.wait(next_call - time.time())
+            now = time.time()
+            if now - next_call >= self.interval:
+                # function took longer than interval, skip the 
+                # calls missed rather than calling back to back
+                missed = int((now - next_call) / self.interval)
+                next_call = next_call + missed * self.interval
+                if self.stats is not None:
+                    self.stats.incr('missed_ticks', missed)
+            self._terminate.wait(next_call - now)
 
     def raise_any_exceptions(self):
         """Can be used by parent thread to capture any 
            exceptions raised by self.function"""
+        # called for every line inserted, the queue is only
+        # locked once an exception has been put in it
+        if not self._exceptionqueue.queue:
+            return
         try:
             error = self._exceptionqueue.get(block=False)
         except Queue.Empty:
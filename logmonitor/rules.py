@@ -0,0 +1,289 @@
+import re
+import datetime
+from .notifier import BaseNotifier, Message, MESSAGE_TYPES
+from .slidingwindow import SlidingWindowCounter
+from .doublebuffer import DoubleBuffer
+from .utils import datetime_to_seconds
+
+METRICS = ['hits', 'bytes', 'errors', '4xx', '5xx']
+# clear threshold of rules relative to their threshold by default, so
+# that values oscillating around the threshold do not flap alerts
+CLEAR_RATIO = 0.9
+
+# [NAME:] METRIC[/s|/hits] [by KEY] > THRESHOLD in SECONDS [clear THRESHOLD]
+RULE_PATTERN = re.compile(r"""
+    ^\s*(?:(?P<name>[\w.\-]+)\s*:\s*)?
+    (?P<metric>hits|bytes|errors|4xx|5xx)(?:/(?P<per>s|hits))?
+    (?:\s+by\s+(?P<key>section|host|status))?
+    \s*>\s*(?P<threshold>\d+(?:\.\d*)?)
+    \s+in\s+(?P<interval>\d+)s?
+    (?:\s+clear\s+(?P<clear>\d+(?:\.\d*)?))?\s*$
+    """, re.VERBOSE)
+
+
+class Rule(object):
+    """Alert rule: raised when the value of metric in the last
+    interval seconds is greater than threshold and cleared once
+    it is not greater than clear (hysteresis, defaults to
+    CLEAR_RATIO * threshold). The value is a count, a rate per second if per is
+    's' or a ratio to hits if per is 'hits'. Values are computed
+    for each section, host or status if key is given"""
+    def __init__(self, name, metric, threshold, interval, per=None, key=None, clear=None):
+        super(Rule, self).__init__()
+        if clear is None:
+            clear = CLEAR_RATIO * threshold
+        if clear > threshold:
+            raise ValueError("Clear threshold of rule %s is greater than its threshold" % name)
+        if interval < 1:
+            raise ValueError("Interval of rule %s is less than a second" % name)
+        self.name = name
+        self.metric = metric
+        self.threshold = threshold
+        self.interval = interval
+        self.per = per
+        self.key = key
+        self.clear = clear
+
+    @property
+    def label(self):
+        """Metric and per, e.g. 5xx/s"""
+        return self.metric + ('/' + self.per if self.per else '')
+
+    def value(self, totals):
+        """Value of the rule given the totals of metrics in its window"""
+        total = totals[self.metric]
+        if self.per == 's':
+            return total / float(self.interval)
+        if self.per == 'hits':
+            hits = totals['hits']
+            return total / float(hits) if hits else 0.0
+        return total
+
+
+def parse_rule(text):
+    """Parses a rule such as "api_5xx: 5xx/s by section > 1 in 60 clear 0.5",
+    raises ValueError if the rule is invalid"""
+    match = RULE_PATTERN.match(text)
+    if match is None:
+        raise ValueError("Invalid rule: %s" % text)
+    groups = match.groupdict()
+    clear = groups['clear']
+    return Rule(groups['name'] or text.strip(), groups['metric'],
+                float(groups['threshold']), int(groups['interval']),
+                groups['per'], groups['key'],
+                float(clear) if clear is not None else None)
+
+
+def load_rules(path):
+    """Parses the rules of a file, one rule per line,
+    blank lines and lines starting with '#' are ignored"""
+    rules = []
+    with open(path) as rulesfile:
+        for line in rulesfile:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                rules.append(parse_rule(line))
+    return rules
+
+
+def key_value(key, section, status):
+    if key == 'section':
+        return section
+    if key == 'host':
+        return section.partition('/')[0]
+    if key == 'status':
+        return str(status)
+    return ''
+
+
+def metric_counts(status, hits, bytes):
+    """Counts of each metric of hits with a status"""
+    return {'hits': hits,
+            'bytes': bytes,
+            'errors': hits if status >= 400 else 0,
+            '4xx': hits if 400 <= status < 500 else 0,
+            '5xx': hits if status >= 500 else 0}
+
+
+class WindowGroup(object):
+    """Sliding windows of the metrics used by the rules sharing a
+    key and an interval, a window per metric per key value. Empty
+    key values (e.g. of lines without a host) are not counted, at
+    most MAX_KEYS key values are counted and the windows of key
+    values without events in the interval are discarded"""
+    MAX_KEYS = 10000
+
+    def __init__(self, key, interval):
+        super(WindowGroup, self).__init__()
+        self.key = key
+        self.interval = interval
+        self.rules = []
+        self.metrics = set()
+        # key value -> metric -> SlidingWindowCounter
+        self.windows = {}
+        self.dropped_keys = 0
+
+    def add_rule(self, rule):
+        self.rules.append(rule)
+        self.metrics.add(rule.metric)
+        if rule.per == 'hits':
+            self.metrics.add('hits')
+
+    def add(self, value, second, counts):
+        if not value and self.key is not None:
+            return
+        metric_2_window = self.windows.get(value)
+        if metric_2_window is None:
+            if not any(counts[metric] for metric in self.metrics):
+                return
+            if len(self.windows) >= self.MAX_KEYS:
+                self.dropped_keys += 1
+                return
+            metric_2_window = self.windows[value] = dict(
+                (metric, SlidingWindowCounter(self.interval)) for metric in self.metrics)
+        for metric, window in metric_2_window.items():
+            count = counts[metric]
+            if count:
+                window.add(second, count)
+
+    def advance(self, second):
+        """Moves the windows forward to second, returns key value ->
+        metric -> total of the key values with events in the interval"""
+        value_2_totals = {}
+        for value, metric_2_window in self.windows.items():
+            totals = {}
+            for metric, window in metric_2_window.items():
+                window.advance(second)
+                totals[metric] = window.total
+            if any(totals.values()):
+                value_2_totals[value] = totals
+            else:
+                del self.windows[value]
+        return value_2_totals
+
+
+class RuleEngine(BaseNotifier):
+    """Evaluates a set of alert rules every notify interval from a
+    single thread. Rules sharing a key and an interval share their
+    sliding windows. Inserting a line costs a single dictionary
+    update whatever the number of rules: hits and bytes are counted
+    per (second, section, status) and counts are added to the
+    windows of every group when notifying. Windows end at the
+    current time, an alert message is shown when a rule (for a
+    key value) is raised and when it is cleared"""
+    name = 'rules'
+    EMPTY_TOTALS = dict((metric, 0) for metric in METRICS)
+
+    def __init__(self, display, notify_interval, rules, stats=None):
+        BaseNotifier.__init__(self, display, notify_interval, stats)
+        names = [rule.name for rule in rules]
+        if len(set(names)) < len(names):
+            raise ValueError("Rule names must be unique")
+        self.rules = rules
+        # (key, interval) -> WindowGroup
+        self.groups = {}
+        for rule in rules:
+            group = self.groups.get((rule.key, rule.interval))
+            if group is None:
+                group = self.groups[(rule.key, rule.interval)] = WindowGroup(rule.key, rule.interval)
+            group.add_rule(rule)
+        # (second, section, status) -> [hits, bytes] inserted since the last notify
+        self._pending = DoubleBuffer(dict)
+        # (rule name, key value) of raised alerts -> value when raised
+        self.raised = {}
+        # lines nearly always share datetimes with the previous line
+        self._last_datetime = None
+        self._last_second = None
+
+    def insert_data(self, linedata):
+        super(RuleEngine, self).insert_data(linedata)
+        datetime_val = linedata.datetime
+        if datetime_val != self._last_datetime:
+            self._last_datetime = datetime_val
+            self._last_second = datetime_to_seconds(datetime_val)
+        pending = self._pending.acquire()
+        event = (self._last_second, linedata.section, linedata.status)
+        counts = pending.get(event)
+        if counts is None:
+            pending[event] = [1, linedata.bytes]
+        else:
+            counts[0] += 1
+            counts[1] += linedata.bytes
+        self._pending.release()
+
+    def insert_lines(self, linedatas):
+        """Inserts a batch of LineData (e.g. of lines aggregated
+        by the columnar engine) acquiring the buffer once"""
+        super(RuleEngine, self).insert_data(None)
+        pending = self._pending.acquire()
+        for linedata in linedatas:
+            datetime_val = linedata.datetime
+            if datetime_val != self._last_datetime:
+                self._last_datetime = datetime_val
+                self._last_second = datetime_to_seconds(datetime_val)
+            event = (self._last_second, linedata.section, linedata.status)
+            counts = pending.get(event)
+            if counts is None:
+                pending[event] = [1, linedata.bytes]
+            else:
+                counts[0] += 1
+                counts[1] += linedata.bytes
+        self._pending.release()
+
+    def merge_pending(self):
+        pending = self._pending.swap()
+        for (second, section, status), (hits, bytes) in pending.items():
+            counts = metric_counts(status, hits, bytes)
+            for group in self.groups.values():
+                group.add(key_value(group.key, section, status), second, counts)
+
+    def message(self):
+        now = datetime.datetime.now().replace(microsecond=0)
+        return self.evaluate(now)
+
+    def evaluate(self, now):
+        """Message of the rules raised or cleared with windows ending at now"""
+        self.merge_pending()
+        second = datetime_to_seconds(now)
+        group_2_totals = dict((group_key, group.advance(second))
+                              for group_key, group in self.groups.items())
+        lines = []
+        for rule in self.rules:
+            value_2_totals = group_2_totals[(rule.key, rule.interval)]
+            # raised alerts are evaluated even once their windows are empty
+            values = set(value_2_totals)
+            values.update(value for name, value in self.raised if name == rule.name)
+            for value in sorted(values):
+                rule_value = rule.value(value_2_totals.get(value, self.EMPTY_TOTALS))
+                raised = (rule.name, value) in self.raised
+                if not raised and rule_value > rule.threshold:
+                    self.raised[(rule.name, value)] = rule_value
+                    lines.append(self.raised_message(rule, value, rule_value, now))
+                elif raised and rule_value <= rule.clear:
+                    del self.raised[(rule.name, value)]
+                    lines.append(self.cleared_message(rule, value, rule_value, now))
+        dropped_keys = sum(group.dropped_keys for group in self.groups.values())
+        if dropped_keys and self.stats is not None:
+            self.stats.incr('rule_keys_dropped', dropped_keys)
+        for group in self.groups.values():
+            group.dropped_keys = 0
+        return Message(lines, MESSAGE_TYPES.alert)
+
+    def rule_str(self, rule, value):
+        if rule.key is None:
+            return "Rule %s" % rule.name
+        return "Rule %s [%s %s]" % (rule.name, rule.key, value)
+
+    def raised_message(self, rule, value, rule_value, time):
+        return "%s generated an alert - %s = %s, triggered at %s" % (
+            self.rule_str(rule, value), rule.label, value_str(rule_value), time)
+
+    def cleared_message(self, rule, value, rule_value, time):
+        return "%s alert recovered - %s = %s, at %s" % (
+            self.rule_str(rule, value), rule.label, value_str(rule_value), time)
+
+
+def value_str(value):
+    if isinstance(value, float):
+        return "%.4g" % value
+    return str(value)
@@ -0,0 +1,107 @@
+def uri_section(uri):
+    """Section of a uri: the first part of its path"""
+    first = uri.find('/')
+    if first != -1:
+        second = uri.find('/', first + 1)
+        if second != -1:
+            return uri[first + 1:second]
+    return ''
+
+
+class SectionTable(object):
+    """Interns sections ('host/section' strings): each distinct section
+    is kept once and given an integer id so that notifiers count
+    sections by id and only resolve ids to sections when showing them.
+    Sections of lines are looked up by (host, section) pairs so the
+    section string is only built the first time a pair is seen.
+    Sections are kept in two generations of at most max_sections
+    sections (None for no limit): when the current generation is full
+    it replaces the previous generation, whose sections are forgotten,
+    and sections of the previous generation used again are moved to
+    the current generation keeping their ids. Ids are never reused,
+    the ids of forgotten sections can no longer be resolved"""
+    def __init__(self, max_sections=65536):
+        super(SectionTable, self).__init__()
+        self.max_sections = max_sections
+        self._next_id = 0
+        # section -> section id
+        self._section_2_id = {}
+        self._previous_section_2_id = {}
+        # section id -> section
+        self._id_2_section = {}
+        self._previous_id_2_section = {}
+        # (host, section) -> (section, section id) of the current
+        # generation, read directly by parsers to avoid method calls
+        self.host_sections = {}
+        self._previous_host_sections = {}
+
+    def __len__(self):
+        return len(self._id_2_section) + len(self._previous_id_2_section)
+
+    def _rotate(self):
+        """Starts a new generation if the current generation is full"""
+        if self.max_sections is None or len(self._id_2_section) < self.max_sections:
+            return
+        self._previous_section_2_id = self._section_2_id
+        self._previous_id_2_section = self._id_2_section
+        self._previous_host_sections = self.host_sections
+        self._section_2_id = {}
+        self._id_2_section = {}
+        self.host_sections = {}
+
+    def _intern(self, section):
+        """Returns the interned section equal to section and its id"""
+        section_id = self._section_2_id.get(section)
+        if section_id is not None:
+            return self._id_2_section[section_id], section_id
+        self._rotate()
+        section_id = self._previous_section_2_id.pop(section, None)
+        if section_id is None:
+            section_id = self._next_id
+            self._next_id += 1
+        else:
+            section = self._previous_id_2_section.pop(section_id)
+        self._section_2_id[section] = section_id
+        self._id_2_section[section_id] = section
+        return section, section_id
+
+    def section_id(self, section):
+        """Returns the id of a section, interning it if new"""
+        return self._intern(section)[1]
+
+    def intern(self, section):
+        """Returns the interned section equal to section"""
+        return self._intern(section)[0]
+
+    def key(self, section):
+        """Key a section is counted by"""
+        return self.section_id(section)
+
+    def name(self, key):
+        """Section of a key, raises KeyError if it was forgotten"""
+        if not isinstance(key, (int, long)):
+            return key
+        section = self._id_2_section.get(key)
+        if section is None:
+            section = self._previous_id_2_section[key]
+        return section
+
+    def host_section(self, host, section):
+        """Returns the interned 'host/section' section and
+        its id of a host and a section"""
+        pair = (host, section)
+        entry = self.host_sections.get(pair)
+        if entry is None:
+            entry = self._previous_host_sections.pop(pair, None)
+            if entry is None:
+                entry = self._intern(host + '/' + section)
+            else:
+                entry = self._intern(entry[0])
+            # the generation may have changed
+            self.host_sections[pair] = entry
+        return entry
+
+
+# sections of all log files read by the process, so notifiers
+# resolve the section ids of lines of any log file
+SECTION_TABLE = SectionTable()
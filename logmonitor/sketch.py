@@ -0,0 +1,109 @@
+import math
+
+
+class QuantileSketch(object):
+    """Mergeable quantile sketch (in the style of DDSketch). Positive
+    values are counted in logarithmically sized buckets so estimated
+    quantiles are within relative_accuracy of the true value. At most
+    max_buckets buckets are kept, the lowest buckets are collapsed
+    when there are more"""
+    # values below MIN_VALUE are counted as zero
+    MIN_VALUE = 1e-9
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        super(QuantileSketch, self).__init__()
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._multiplier = 1 / math.log(self._gamma)
+        # bucket key -> count, bucket key k holds values
+        # in (gamma ** (k - 1), gamma ** k]
+        self._buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def insert(self, value, count=1):
+        """Inserts count occurrences of value"""
+        self.count += count
+        if value < self.MIN_VALUE:
+            self.zero_count += count
+            return
+        key = int(math.ceil(math.log(value) * self._multiplier))
+        buckets = self._buckets
+        if key in buckets:
+            buckets[key] += count
+        else:
+            buckets[key] = count
+            if len(buckets) > self.max_buckets:
+                self._collapse()
+
+    def insert_values(self, values):
+        """Inserts a batch (list) of values, faster than
+        inserting them one at a time"""
+        log = math.log
+        ceil = math.ceil
+        multiplier = self._multiplier
+        min_value = self.MIN_VALUE
+        buckets = self._buckets
+        zero_count = 0
+        for value in values:
+            if value < min_value:
+                zero_count += 1
+                continue
+            key = int(ceil(log(value) * multiplier))
+            if key in buckets:
+                buckets[key] += 1
+            else:
+                buckets[key] = 1
+        self.count += len(values)
+        self.zero_count += zero_count
+        if len(buckets) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self):
+        """Merges the lowest buckets until there are max_buckets"""
+        keys = sorted(self._buckets)
+        excess = len(keys) - self.max_buckets
+        if excess <= 0:
+            return
+        collapsed = sum(self._buckets.pop(key) for key in keys[:excess])
+        self._buckets[keys[excess]] += collapsed
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for key, count in other._buckets.items():
+            self._buckets[key] = self._buckets.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self._collapse()
+
+    def state(self):
+        """Returns the sketch as a dictionary of JSON types"""
+        return {'relative_accuracy': self.relative_accuracy,
+                'max_buckets': self.max_buckets,
+                'buckets': sorted(self._buckets.items()),
+                'zero_count': self.zero_count,
+                'count': self.count}
+
+    def restore_state(self, state):
+        """Restores the counts of a state returned by state, the sketch
+        must have been created with the same accuracy and buckets"""
+        self._buckets = dict((int(key), count) for key, count in state['buckets'])
+        self.zero_count = state['zero_count']
+        self.count = state['count']
+
+    def quantile(self, q):
+        """Estimated q quantile (0 <= q <= 1), None if empty"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self._buckets):
+            seen += self._buckets[key]
+            if rank < seen:
+                # estimate with the smallest relative error for the bucket
+                return 2 * self._gamma ** key / (self._gamma + 1)
+        return 2 * self._gamma ** max(self._buckets) / (self._gamma + 1)
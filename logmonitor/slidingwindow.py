@@ -0,0 +1,56 @@
+class SlidingWindowCounter(object):
+    """Counts events that occurred in the last interval seconds 
+    using a ring of per second buckets indexed by epoch second 
+    modulo the ring size. Events at second t are retained while
+    t >= end - interval, where end is the latest second the 
+    window has been advanced to"""
+    def __init__(self, interval):
+        super(SlidingWindowCounter, self).__init__()
+        self.interval = interval
+        self._size = interval + 1
+        self._buckets = [0] * self._size
+        self._end = None
+        self.total = 0
+
+    def advance(self, second):
+        """Moves the end of the window forward to second
+        expiring buckets that fall out of the window"""
+        if self._end is None:
+            self._end = second
+            return
+        if second <= self._end:
+            return
+        if second - self._end >= self._size:
+            self._buckets = [0] * self._size
+            self.total = 0
+        else:
+            buckets = self._buckets
+            for expired in range(self._end + 1, second + 1):
+                index = expired % self._size
+                self.total -= buckets[index]
+                buckets[index] = 0
+        self._end = second
+
+    def add(self, second, count=1):
+        """Adds count events at second, events later than the end 
+        of the window advance it. Returns False if second is 
+        too old to fall in the window"""
+        if self._end is None or second > self._end:
+            self.advance(second)
+        elif second < self._end - self.interval:
+            return False
+        self._buckets[second % self._size] += count
+        self.total += count
+        return True
+
+    def counts(self):
+        """Returns a dictionary of second -> count of 
+        the seconds in the window with events"""
+        if self._end is None:
+            return {}
+        result = {}
+        for second in range(self._end - self.interval, self._end + 1):
+            count = self._buckets[second % self._size]
+            if count:
+                result[second] = count
+        return result
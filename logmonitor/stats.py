@@ -0,0 +1,59 @@
+import os
+import json
+import time
+from threading import Lock
+from .sketch import QuantileSketch
+
+
+class Stats(object):
+    """Self-metrics of the monitor: counters, gauges and histograms.
+    Counters and histograms are updated once per block of lines read
+    or per notify rather than per line so a lock is cheap. Gauges
+    are functions that are only called when a snapshot is taken"""
+    def __init__(self):
+        super(Stats, self).__init__()
+        self._lock = Lock()
+        self._counters = {}
+        # name -> QuantileSketch of observed values
+        self._histograms = {}
+        self._gauges = {}
+
+    def incr(self, name, count=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + count
+
+    def observe(self, name, value):
+        with self._lock:
+            sketch = self._histograms.get(name)
+            if sketch is None:
+                sketch = self._histograms[name] = QuantileSketch()
+            sketch.insert(value)
+
+    def gauge(self, name, function):
+        """Registers a function returning the current value of name"""
+        self._gauges[name] = function
+
+    def snapshot(self):
+        """Returns a dictionary of the current values of all metrics,
+        histograms are summarized by count, p50, p99 and max"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {}
+            for name, sketch in self._histograms.items():
+                histograms[name] = {'count': sketch.count,
+                                    'p50': sketch.quantile(0.5),
+                                    'p99': sketch.quantile(0.99),
+                                    'max': sketch.quantile(1.0)}
+        gauges = dict((name, function()) for name, function in self._gauges.items())
+        return {'time': time.time(),
+                'counters': counters,
+                'gauges': gauges,
+                'histograms': histograms}
+
+    def dump(self, path):
+        """Writes a snapshot as JSON to path, the file is
+        replaced atomically so readers never see partial dumps"""
+        temppath = path + '.tmp'
+        with open(temppath, 'w') as statsfile:
+            json.dump(self.snapshot(), statsfile, indent=2, sort_keys=True)
+        os.rename(temppath, path)
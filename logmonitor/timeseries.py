@@ -0,0 +1,220 @@
+import heapq
+from threading import Lock
+from .doublebuffer import DoubleBuffer
+from .topk import SpaceSaving
+from .utils import datetime_to_seconds
+
+# characters of sparklines from lowest to highest
+SPARK_CHARS = " .:-=+*#%@"
+
+
+def sparkline(values):
+    """Text sparkline of values scaled to the largest value"""
+    highest = max(values) if values else 0
+    if highest <= 0:
+        return SPARK_CHARS[0] * len(values)
+    top = len(SPARK_CHARS) - 1
+    return "".join(SPARK_CHARS[int(round(value * top / float(highest)))] for value in values)
+
+
+class Bucket(object):
+    """Traffic in a time bucket, hits are counted for
+    (approximately) the capacity popular sections"""
+    def __init__(self, capacity):
+        super(Bucket, self).__init__()
+        self.hits = 0
+        self.bytes = 0
+        self.errors = 0
+        self.section_hits = SpaceSaving(capacity)
+
+    def merge(self, other):
+        self.hits += other.hits
+        self.bytes += other.bytes
+        self.errors += other.errors
+        self.section_hits.merge(other.section_hits)
+
+
+class Rollup(object):
+    """Ring of size buckets of seconds seconds each, only buckets
+    of the last size * seconds seconds (up to the latest bucket)
+    are kept. Buckets are indexed by their start second so a
+    bucket is found in O(1) and ranges are read in O(buckets)"""
+    def __init__(self, seconds, size, capacity):
+        super(Rollup, self).__init__()
+        self.seconds = seconds
+        self.size = size
+        self.capacity = capacity
+        self._starts = [None] * size
+        self._buckets = [None] * size
+        # start second of the latest bucket
+        self.end = None
+
+    def bucket(self, second):
+        """Returns the bucket second falls in, a new bucket replaces
+        the expired bucket it is indexed with. Returns None if
+        second is too old to be kept"""
+        start = second - second % self.seconds
+        if self.end is None or start > self.end:
+            self.end = start
+        elif start <= self.end - self.size * self.seconds:
+            return None
+        index = (start // self.seconds) % self.size
+        if self._starts[index] != start:
+            self._starts[index] = start
+            self._buckets[index] = Bucket(self.capacity)
+        return self._buckets[index]
+
+    def get(self, start):
+        """Bucket starting at start, None if it had no traffic or expired"""
+        if self.end is None or start <= self.end - self.size * self.seconds:
+            return None
+        index = (start // self.seconds) % self.size
+        if self._starts[index] != start:
+            return None
+        return self._buckets[index]
+
+    def latest(self, count, end=None):
+        """Returns (start, bucket) of the count buckets up to the
+        bucket end (defaults to the latest) falls in, oldest first.
+        bucket is None for buckets without traffic"""
+        if end is None:
+            end = self.end
+        if end is None:
+            return []
+        end = end - end % self.seconds
+        return [(start, self.get(start))
+                for start in range(end - (count - 1) * self.seconds, end + 1, self.seconds)]
+
+
+class PendingSecond(object):
+    """Traffic of a second inserted between merges, sections
+    are counted exactly until merged"""
+    def __init__(self):
+        super(PendingSecond, self).__init__()
+        self.hits = 0
+        self.bytes = 0
+        self.errors = 0
+        self.section_2_hits = {}
+
+
+class TimeSeries(object):
+    """In-memory history of traffic (hits, bytes, errors and popular
+    sections) by logged time at several resolutions: by default
+    per second for 10 minutes, per minute for a day and per hour
+    for a week. Memory is bounded by the number of buckets. Lines
+    are counted per second by the thread inserting data and rolled
+    up into the buckets of every resolution by merge_pending, which
+    is called by the thread reading the time series. Buckets count
+    SECTIONS_FACTOR * top_k sections so the top_k sections stay
+    accurate when the buckets of many seconds are merged"""
+    # (seconds per bucket, number of buckets) of each resolution
+    RESOLUTIONS = [(1, 600), (60, 1440), (3600, 168)]
+    SECTIONS_FACTOR = 4
+
+    def __init__(self, top_k=10, resolutions=RESOLUTIONS):
+        super(TimeSeries, self).__init__()
+        self.top_k = top_k
+        self.capacity = self.SECTIONS_FACTOR * top_k
+        self.rollups = [Rollup(seconds, size, self.capacity) for seconds, size in resolutions]
+        self._lock = Lock()
+        # second -> PendingSecond
+        self._pending = DoubleBuffer(dict)
+        # lines nearly always share datetimes with the previous line
+        self._last_datetime = None
+        self._last_second = None
+
+    def insert_data(self, linedata):
+        datetime_val = linedata.datetime
+        if datetime_val != self._last_datetime:
+            self._last_datetime = datetime_val
+            self._last_second = datetime_to_seconds(datetime_val)
+        second_2_pending = self._pending.acquire()
+        pending = second_2_pending.get(self._last_second)
+        if pending is None:
+            pending = second_2_pending[self._last_second] = PendingSecond()
+        pending.hits += 1
+        pending.bytes += linedata.bytes
+        # 400 and above status codes are errors
+        if linedata.status >= 400:
+            pending.errors += 1
+        section_2_hits = pending.section_2_hits
+        section_2_hits[linedata.section] = section_2_hits.get(linedata.section, 0) + 1
+        self._pending.release()
+
+    def insert_second_hits(self, second_2_hits):
+        """Inserts a dictionary of epoch second -> hits
+        (e.g. of a batch of lines aggregated without sections)"""
+        second_2_pending = self._pending.acquire()
+        for second, hits in second_2_hits.items():
+            pending = second_2_pending.get(second)
+            if pending is None:
+                pending = second_2_pending[second] = PendingSecond()
+            pending.hits += hits
+        self._pending.release()
+
+    def merge_pending(self):
+        """Rolls up the seconds inserted since the last merge"""
+        second_2_pending = self._pending.swap()
+        with self._lock:
+            for second, pending in sorted(second_2_pending.items()):
+                bucket = Bucket(self.capacity)
+                bucket.hits = pending.hits
+                bucket.bytes = pending.bytes
+                bucket.errors = pending.errors
+                # only the most popular sections are counted (exactly),
+                # inserting every section would replace popular
+                # sections with the last ones
+                for section, hits in heapq.nlargest(self.capacity, pending.section_2_hits.items(),
+                                                    key=lambda section_hits: section_hits[1]):
+                    bucket.section_hits.insert(section, hits)
+                bucket.section_hits.total = sum(pending.section_2_hits.values())
+                for rollup in self.rollups:
+                    rollup_bucket = rollup.bucket(second)
+                    if rollup_bucket is not None:
+                        rollup_bucket.merge(bucket)
+
+    def rollup(self, seconds):
+        """Rollup of the resolution of buckets of seconds seconds"""
+        for rollup in self.rollups:
+            if rollup.seconds == seconds:
+                return rollup
+        raise ValueError("No resolution of %d seconds" % seconds)
+
+    @property
+    def end(self):
+        """Latest second inserted, None if none"""
+        return self.rollups[0].end
+
+    def latest(self, seconds, count, end=None):
+        """Returns (start, bucket) of the count latest buckets of
+        seconds seconds up to end (defaults to the latest second
+        inserted), oldest first. bucket is None without traffic"""
+        with self._lock:
+            return self.rollup(seconds).latest(count, end)
+
+    def range(self, seconds, start, end):
+        """Returns (start, bucket) of the buckets of seconds seconds
+        starting from start up to end, oldest first"""
+        count = (end - end % seconds - (start - start % seconds)) // seconds + 1
+        return self.latest(seconds, max(count, 0), end)
+
+    def trend_lines(self, width=20, end=None):
+        """Lines showing the hits per bucket of the latest width
+        buckets of each resolution as sparklines along with the
+        average rate of hits per second"""
+        lines = ["Trends (hits/s):"]
+        for rollup in self.rollups:
+            buckets = self.latest(rollup.seconds, width, end)
+            hits = [bucket.hits if bucket is not None else 0 for _, bucket in buckets]
+            rate = sum(hits) / float(width * rollup.seconds)
+            lines.append("%4s |%s| %.1f" % (duration_str(width * rollup.seconds),
+                                            sparkline(hits), rate))
+        return lines
+
+
+def duration_str(seconds):
+    """Compact duration, e.g. 20s, 20m, 20h or 7d"""
+    for unit, unit_seconds in [('d', 86400), ('h', 3600), ('m', 60)]:
+        if seconds >= unit_seconds and seconds % unit_seconds == 0:
+            return "%d%s" % (seconds // unit_seconds, unit)
+    return "%ds" % seconds
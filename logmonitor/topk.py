@@ -0,0 +1,122 @@
+import heapq
+
+
+class SpaceSaving(object):
+    """Approximate counts of the k most frequent items in a stream
+    using the Space-Saving algorithm, memory is O(k). The count of
+    an item may overestimate its true count by at most its error,
+    errors are never larger than the smallest count once k items
+    are counted (which is at most total / k)"""
+    def __init__(self, k):
+        super(SpaceSaving, self).__init__()
+        self.k = k
+        self.total = 0
+        self._counts = {}
+        self._errors = {}
+        # a (count, item) entry per counted item, the count of an
+        # entry may be lower than the item's current count
+        self._heap = []
+
+    def __len__(self):
+        return len(self._counts)
+
+    def insert(self, item, count=1):
+        """Counts item, returns the item it replaced if any"""
+        self.total += count
+        counts = self._counts
+        if item in counts:
+            counts[item] += count
+        elif len(counts) < self.k:
+            counts[item] = count
+            self._errors[item] = 0
+            heapq.heappush(self._heap, (count, item))
+        else:
+            # item replaces the item with the smallest count
+            min_count, min_item = self._pop_min()
+            del counts[min_item]
+            del self._errors[min_item]
+            counts[item] = min_count + count
+            self._errors[item] = min_count
+            heapq.heappush(self._heap, (min_count + count, item))
+            return min_item
+        return None
+
+    def _pop_min(self):
+        """Removes and returns the (count, item) with the smallest count"""
+        heap = self._heap
+        while True:
+            entry_count, item = heap[0]
+            count = self._counts[item]
+            if entry_count == count:
+                return heapq.heappop(heap)
+            # update the out of date entry
+            heapq.heapreplace(heap, (count, item))
+
+    def min_count(self):
+        """Smallest count once k items are counted, otherwise 0"""
+        if len(self._counts) < self.k:
+            return 0
+        return min(self._counts.values())
+
+    def error_bound(self):
+        """Maximum amount by which any count may be overestimated"""
+        if not self._errors:
+            return 0
+        return max(self._errors.values())
+
+    def __contains__(self, item):
+        return item in self._counts
+
+    def count(self, item):
+        return self._counts.get(item, 0)
+
+    def top(self, n=None):
+        """Returns (item, count, error) of the n (defaults to k)
+        items with the largest counts, largest first"""
+        items = sorted(self._counts.items(), key=lambda item_count: (-item_count[1], item_count[0]))
+        return [(item, count, self._errors[item]) for item, count in items[:n]]
+
+    def merge(self, other):
+        """Merges the counts of another SpaceSaving, an item not
+        counted by a summary that has k items may have occurred up
+        to the smallest count of that summary"""
+        self_min = self.min_count()
+        other_min = other.min_count()
+        counts = {}
+        errors = {}
+        for item in set(self._counts) | set(other._counts):
+            counts[item] = (self._counts.get(item, self_min) +
+                            other._counts.get(item, other_min))
+            errors[item] = (self._errors.get(item, self_min) +
+                            other._errors.get(item, other_min))
+        items = sorted(counts, key=lambda item: (-counts[item], item))[:self.k]
+        self._counts = dict((item, counts[item]) for item in items)
+        self._errors = dict((item, errors[item]) for item in items)
+        self._heap = [(count, item) for item, count in self._counts.items()]
+        heapq.heapify(self._heap)
+        self.total += other.total
+
+    def map_items(self, function):
+        """Returns a copy counting function(item) for each item,
+        function must map distinct items to distinct items"""
+        result = SpaceSaving(self.k)
+        result.total = self.total
+        result._counts = dict((function(item), count) for item, count in self._counts.items())
+        result._errors = dict((function(item), error) for item, error in self._errors.items())
+        result._heap = [(count, item) for item, count in result._counts.items()]
+        heapq.heapify(result._heap)
+        return result
+
+    def state(self):
+        """Returns the counts as a dictionary of JSON types"""
+        return {'k': self.k,
+                'total': self.total,
+                'items': [list(item_count_error) for item_count_error in self.top()]}
+
+    def restore_state(self, state):
+        """Restores the counts of a state returned by state"""
+        self.total = state['total']
+        self._counts = dict((item, count) for item, count, _ in state['items'])
+        self._errors = dict((item, error) for item, _, error in state['items'])
+        self._heap = [(count, item) for item, count in self._counts.items()]
+        heapq.heapify(self._heap)
@@ -1,4 +1,17 @@
+import datetime
+
+_EPOCH = datetime.datetime(1970, 1, 1)
 
 def enum(*sequential, **named):
     enums = dict(zip(sequential, range(len(sequential))), **named)
     return type('Enum', (), enums)
+
+def datetime_to_seconds(datetime_val):
+    """Whole seconds between the epoch and a naive datetime
+    (the datetime is not converted to utc)"""
+    delta = datetime_val - _EPOCH
+    return delta.days * 86400 + delta.seconds
+
+def seconds_to_datetime(seconds):
+    """Naive datetime of whole seconds since the epoch"""
+    return _EPOCH + datetime.timedelta(seconds=seconds)
@@ -0,0 +1,155 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+
+class BaseWatcher(object):
+    """Base class for watching files for changes"""
+    def __init__(self):
+        super(BaseWatcher, self).__init__()
+
+    def add(self, filepath):
+        """Start watching filepath, the file need not exist"""
+        raise NotImplementedError(self.__class__.__name__ + '.add')
+
+    def wait(self, timeout):
+        """Block until a watched file changes or timeout seconds
+        elapse. Returns a list of the watched file paths that changed"""
+        raise NotImplementedError(self.__class__.__name__ + '.wait')
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(BaseWatcher):
+    """Watches files by polling os.stat, the wait between polls
+    doubles from MIN_WAIT up to MAX_WAIT"""
+    MIN_WAIT = 0.001
+    MAX_WAIT = 0.1
+
+    def __init__(self):
+        BaseWatcher.__init__(self)
+        self._filepath_2_stat = {}
+
+    def _stat(self, filepath):
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
+    def add(self, filepath):
+        self._filepath_2_stat[filepath] = self._stat(filepath)
+
+    def wait(self, timeout):
+        deadline = time.time() + timeout
+        wait = self.MIN_WAIT
+        while True:
+            changed = []
+            for filepath, last_stat in self._filepath_2_stat.items():
+                stat = self._stat(filepath)
+                if stat != last_stat:
+                    self._filepath_2_stat[filepath] = stat
+                    changed.append(filepath)
+            remaining = deadline - time.time()
+            if changed or remaining <= 0:
+                return changed
+            time.sleep(min(wait, remaining))
+            wait = min(wait * 2, self.MAX_WAIT)
+
+
+class InotifyWatcher(BaseWatcher):
+    """Watches files using the linux inotify api. The directories
+    containing the files are watched so that files that are renamed,
+    recreated or truncated are detected"""
+    # inotify event masks (see inotify.h)
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM |
+                  IN_MOVED_TO | IN_CREATE | IN_DELETE)
+    # struct inotify_event header: wd, mask, cookie, len
+    EVENT_HEADER = struct.Struct('iIII')
+    READ_SIZE = 64 * 1024
+
+    def __init__(self):
+        BaseWatcher.__init__(self)
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, "inotify is only available on linux")
+        libc_path = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(libc_path, use_errno=True)
+        # raises AttributeError if libc does not provide inotify
+        self._libc.inotify_init
+        self._libc.inotify_add_watch
+        self._fd = self._libc.inotify_init()
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._dirpath_2_wd = {}
+        # watch descriptor -> {file name: watched file path}
+        self._wd_2_names = {}
+
+    def add(self, filepath):
+        dirpath, name = os.path.split(os.path.abspath(filepath))
+        wd = self._dirpath_2_wd.get(dirpath)
+        if wd is None:
+            wd = self._libc.inotify_add_watch(self._fd, dirpath, self.WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err), dirpath)
+            self._dirpath_2_wd[dirpath] = wd
+            self._wd_2_names[wd] = {}
+        self._wd_2_names[wd][name] = filepath
+
+    def all_filepaths(self):
+        return [filepath for names in self._wd_2_names.values()
+                for filepath in names.values()]
+
+    def wait(self, timeout):
+        try:
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+        if not readable:
+            return []
+        data = os.read(self._fd, self.READ_SIZE)
+        changed = set()
+        offset = 0
+        header_size = self.EVENT_HEADER.size
+        while offset + header_size <= len(data):
+            wd, mask, _, name_len = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += header_size
+            name = data[offset:offset + name_len].rstrip('\0')
+            offset += name_len
+            if mask & self.IN_Q_OVERFLOW:
+                # events were dropped, assume everything changed
+                return self.all_filepaths()
+            filepath = self._wd_2_names.get(wd, {}).get(name)
+            if filepath is not None:
+                changed.add(filepath)
+        return list(changed)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def get_watcher():
+    """Returns an InotifyWatcher if inotify is available
+    otherwise a PollingWatcher"""
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError):
+        return PollingWatcher()
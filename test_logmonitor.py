@@ -4,8 +4,42 @@ import unittest
 import time
 import datetime
 import random
-from logmonitor.notifier import AlertNotifier
-from logmonitor.logparser import CommonLogParser, LINE_DATA_FIELDS
+import os
+import shutil
+import tempfile
+import threading
+import json
+import gzip
+import socket
+import urllib2
+import cPickle as pickle
+from logmonitor.notifier import AlertNotifier, SummaryNotifier, SummaryData, StatsNotifier, Message, MESSAGE_TYPES
+from logmonitor.logparser import CommonLogParser, W3CLogParser, LogParseError, LineData, LINE_DATA_FIELDS
+from logmonitor.directivecache import DirectiveCache
+from logmonitor.slidingwindow import SlidingWindowCounter
+from logmonitor.topk import SpaceSaving
+from logmonitor.sketch import QuantileSketch
+from logmonitor.multifollow import MultiLogFollower
+from logmonitor import backfill
+from logmonitor.watcher import PollingWatcher, InotifyWatcher
+from logmonitor.stats import Stats
+from logmonitor.repeatfunctionthread import RepeatFunctionThread
+from logmonitor.checkpoint import Checkpoint
+from logmonitor.archive import decompressed_blocks, rotated_filepaths
+from logmonitor.columnar import ColumnarAggregate, numpy
+from logmonitor.utils import datetime_to_seconds, seconds_to_datetime
+from logmonitor.sections import SectionTable, SECTION_TABLE, uri_section
+from logmonitor.benchmark import LogGenerator, compare
+from logmonitor.timeseries import TimeSeries, Rollup, sparkline
+from logmonitor.rules import RuleEngine, parse_rule
+from logmonitor.anomaly import AnomalyDetector, EwmaStats, KeyState, seconds_per_hour
+try:
+    import logmonitor.display
+    from logmonitor.display import AsyncDisplay, ScreenBuffer, WindowDisplay
+    from logmonitor.exporter import PrometheusDisplay, StatsdDisplay
+except ImportError:
+    # clint is not installed
+    AsyncDisplay = None
 
 class AlertingLogicTestCase(unittest.TestCase):
     def setUp(self):
@@ -79,6 +113,1469 @@ class AlertingLogicTestCase(unittest.TestCase):
         self.assertTrue(self.alert_notifier.is_alert_displayed)
         
 
+class EventTimeAlertTestCase(unittest.TestCase):
+    def setUp(self):
+        # alert if more than 5 hits in a 5 second window
+        self.alert_notifier = AlertNotifier(None, 1, 5, 5, event_time=True)
+
+    def insert(self, seconds):
+        messages = []
+        for second in seconds:
+            messages.extend(self.alert_notifier.insert_event(second))
+        return [(message.data['time'], message.data['alert']) for message in messages]
+
+    def test_alert_and_recovery_stamped_with_event_time(self):
+        # 6 hits at 100 are evaluated once a later hit is inserted
+        self.assertEqual(self.insert([100] * 6), [])
+        self.assertEqual(self.insert([101]), [(100, True)])
+        # hits at 100 fall out of the window at 106
+        self.assertEqual(self.insert([200]), [(106, False)])
+        lines = self.alert_notifier.evaluate_second(106).lines
+        self.assertEqual(lines, [])
+
+    def test_lateness(self):
+        self.alert_notifier.lateness = 2
+        self.assertEqual(self.insert([100, 101, 102, 100, 100, 100, 101, 103]), [])
+        # the late hits at 100 are counted when 100 is evaluated
+        self.assertEqual(self.insert([104]), [(101, True)])
+        self.assertEqual(self.alert_notifier.watermark, 101)
+
+    def test_hits_later_than_lateness(self):
+        self.insert([100, 101, 102])
+        # counted in the window for later seconds
+        self.assertEqual(self.insert([100] * 4), [])
+        self.assertEqual(self.insert([103]), [(102, True)])
+        # too old to fall in the window
+        self.insert([10])
+        self.assertEqual(self.alert_notifier.hits, 7)
+
+    def test_recovery_when_traffic_stops(self):
+        self.alert_notifier.lateness = 2
+        self.assertEqual(self.insert([100] * 6 + [103]), [(100, True)])
+        now = time.time()
+        self.assertEqual(self.alert_notifier.advance_idle(now), [])
+        self.assertEqual(self.alert_notifier.watermark, 100)
+        # the logged time follows the wall clock once traffic stops
+        messages = self.alert_notifier.advance_idle(now + 10)
+        self.assertEqual([(message.data['time'], message.data['alert']) for message in messages],
+                         [(106, False)])
+        self.assertEqual(self.alert_notifier.watermark, 110)
+        # late hits still in the window are counted
+        self.assertEqual(self.insert([109] * 6), [])
+        self.assertEqual(self.alert_notifier.hits, 6)
+
+
+class SummaryNotifierTestCase(unittest.TestCase):
+    def test_concurrent_purge(self):
+        """counts are exact while data is purged by another thread"""
+        summary_notifier = SummaryNotifier(None, 1)
+        linedata = CommonLogParser('').parse_line(
+                'host - - [10/Oct/2000:13:55:36 -0700] "GET /a/b.gif HTTP/1.0" 404 10')
+        num_lines = 100000
+        def insert():
+            for i in range(num_lines):
+                summary_notifier.insert_data(linedata)
+        inserter = threading.Thread(target=insert)
+        inserter.start()
+        counts = []
+        def purge():
+            # counts are read as soon as the data is purged
+            data = summary_notifier.purge_data()
+            counts.append((data.section_hits.count(SECTION_TABLE.key('host/a')),
+                           data.error_code_count, data.bytes))
+        while inserter.is_alive():
+            purge()
+        inserter.join()
+        purge()
+        hits, error_code_count, bytes = [sum(values) for values in zip(*counts)]
+        self.assertEqual(hits, num_lines)
+        self.assertEqual(error_code_count, num_lines)
+        self.assertEqual(bytes, 10 * num_lines)
+
+    def test_many_sections(self):
+        """popular sections are shown among thousands of one hit sections"""
+        summary_notifier = SummaryNotifier(None, 1, top_k=5)
+        start = datetime.datetime(2000, 10, 10, 13, 55, 36)
+        sections = ['host/popular%d' % i for i in range(5)] * 600
+        sections += ['host/rare%d' % i for i in range(5000)]
+        random.Random(1).shuffle(sections)
+        for section in sections:
+            summary_notifier.insert_data(LineData(section, 10, start, 200))
+        message = summary_notifier.summary_message(summary_notifier.purge_data())
+        shown = sorted(section for section, _ in message.data['section_hits'])
+        self.assertEqual(shown, ['host/popular%d' % i for i in range(5)])
+        for section, hits in message.data['section_hits']:
+            self.assertTrue(0 < hits <= 600)
+
+    def test_section_quantiles(self):
+        """quantiles of sections are shown once estimated from enough hits"""
+        summary_notifier = SummaryNotifier(None, 1, top_k=1)
+        start = datetime.datetime(2000, 10, 10, 13, 55, 36)
+        for i in range(3):
+            summary_notifier.insert_data(LineData('host/a', 10, start, 200, 5.0))
+        summary_data = summary_notifier.purge_data()
+        self.assertEqual(summary_data.section_2_sketches[SECTION_TABLE.key('host/a')][0].count, 3)
+        lines = summary_notifier.summary_message(summary_data).lines
+        self.assertIn("Response Time p50/p95/p99: 5/5/5 ms", lines)
+        self.assertFalse(any(line.startswith("  time p50/p95/p99") for line in lines))
+        for i in range(30):
+            summary_notifier.insert_data(LineData('host/a', 10, start, 200, 5.0))
+        lines = summary_notifier.summary_message(summary_notifier.purge_data()).lines
+        self.assertIn("  time p50/p95/p99: 5/5/5 ms", lines)
+
+    def test_sections_counted_by_id(self):
+        """sections are counted by id and pickled by name"""
+        summary_notifier = SummaryNotifier(None, 1, top_k=2)
+        linedata = CommonLogParser('').parse_line(
+                'host - - [10/Oct/2000:13:55:36 -0700] "GET /a/b.gif HTTP/1.0" 200 10')
+        summary_notifier.insert_data(linedata)
+        summary_notifier.insert_data(LineData('host/c', 10, linedata.datetime, 200))
+        summary_data = summary_notifier.purge_data()
+        self.assertEqual(sorted(key for key, _, _ in summary_data.section_hits.top()),
+                         sorted([SECTION_TABLE.section_id('host/a'),
+                                 SECTION_TABLE.section_id('host/c')]))
+        state = summary_data.__getstate__()
+        self.assertEqual(sorted(section for section, _, _ in state['section_hits'].top()),
+                         ['host/a', 'host/c'])
+        self.assertEqual(sorted(state['section_2_sketches']), ['host/a', 'host/c'])
+        copied = pickle.loads(pickle.dumps(summary_data, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(copied.section_hits.top(), summary_data.section_hits.top())
+        message = summary_notifier.summary_message(copied)
+        self.assertIn("host/a : 1 hits", message.lines)
+
+    def test_section_sketches_of_counted_sections(self):
+        summary_data = SummaryData(1)
+        summary_data.FLUSH_SIZE = 10
+        start = datetime.datetime(2000, 10, 10, 13, 55, 36)
+        for i in range(200):
+            summary_data.insert_data(LineData('host/%d' % (i % 20), i, start, 200, 1.0))
+        summary_data.flush()
+        # sketches are only kept for the sections counted and have
+        # the hits of the sections since they were last counted
+        self.assertEqual(sorted(summary_data.section_2_sketches),
+                         sorted(section for section, _, _ in summary_data.section_hits.top()))
+        for section, hits, error in summary_data.section_hits.top():
+            self.assertEqual(summary_data.section_2_sketches[section][1].count, hits - error)
+        self.assertEqual(summary_data.response_bytes.count, 200)
+        self.assertEqual(summary_data.bytes, sum(range(200)))
+
+class TimeSeriesTestCase(unittest.TestCase):
+    def test_rollups(self):
+        timeseries = TimeSeries(top_k=2, resolutions=[(1, 60), (60, 10)])
+        start = datetime.datetime(2000, 10, 10, 13, 55, 0)
+        for second in range(120):
+            for i in range(second % 3 + 1):
+                timeseries.insert_data(LineData('host/%d' % i, 10, 
+                                                start + datetime.timedelta(seconds=second),
+                                                404 if i == 2 else 200, None))
+        timeseries.merge_pending()
+        end = datetime_to_seconds(start) + 119
+        self.assertEqual(timeseries.end, end)
+        buckets = timeseries.latest(1, 3)
+        self.assertEqual([(second, bucket.hits) for second, bucket in buckets],
+                         [(end - 2, 1), (end - 1, 2), (end, 3)])
+        # seconds older than a minute expired
+        self.assertEqual(timeseries.latest(1, 1, end - 60), [(end - 60, None)])
+        minutes = timeseries.range(60, end - 119, end)
+        self.assertEqual(len(minutes), 2)
+        for _, bucket in minutes:
+            self.assertEqual((bucket.hits, bucket.bytes, bucket.errors), (120, 1200, 20))
+            self.assertEqual(bucket.section_hits.top(2), [('host/0', 60, 0), ('host/1', 40, 0)])
+        lines = timeseries.trend_lines(width=3, end=end)
+        self.assertEqual(lines[1], "  3s |-*@| 2.0")
+
+    def test_popular_sections_of_busy_seconds(self):
+        timeseries = TimeSeries(top_k=1, resolutions=[(1, 60), (60, 10)])
+        start = datetime.datetime(2000, 10, 10, 13, 55, 0)
+        for second in range(3):
+            logged = start + datetime.timedelta(seconds=second)
+            for i in range(10):
+                timeseries.insert_data(LineData('host/popular', 10, logged, 200, None))
+            # more sections than are counted in a bucket
+            for i in range(50):
+                timeseries.insert_data(LineData('host/%d-%d' % (second, i), 10, logged, 200, None))
+        timeseries.merge_pending()
+        [(_, minute)] = timeseries.latest(60, 1)
+        self.assertEqual(minute.section_hits.top(1), [('host/popular', 30, 0)])
+
+    def test_rollup_bounded(self):
+        rollup = Rollup(10, 3, 2)
+        self.assertTrue(rollup.bucket(5) is rollup.bucket(9))
+        rollup.bucket(25).hits = 1
+        self.assertTrue(rollup.bucket(5) is not None)
+        rollup.bucket(35)
+        self.assertEqual(rollup.bucket(9), None)
+        self.assertEqual([start for start, _ in rollup.latest(3)], [10, 20, 30])
+        self.assertEqual(rollup.get(0), None)
+        self.assertEqual(rollup.get(20).hits, 1)
+
+    def test_sparkline(self):
+        self.assertEqual(sparkline([0, 1, 9, 3]), " .@-")
+        self.assertEqual(sparkline([0, 0]), "  ")
+
+    def test_summary_trends(self):
+        summary_notifier = SummaryNotifier(None, 1, timeseries=TimeSeries())
+        summary_notifier.insert_data(LineData('host/a', 10, datetime.datetime.now(), 200, None))
+        lines = summary_notifier.message().lines
+        self.assertTrue("Trends (hits/s):" in lines)
+        self.assertEqual(lines[-1], "-" * 25)
+
+
+class RuleEngineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.start = datetime.datetime(2000, 10, 10, 13, 55, 0)
+
+    def insert(self, rule_engine, seconds, section, status, hits=1, bytes=100):
+        for _ in range(hits):
+            rule_engine.insert_data(LineData(section, bytes, 
+                                             self.start + datetime.timedelta(seconds=seconds),
+                                             status, None))
+
+    def evaluate(self, rule_engine, seconds):
+        return rule_engine.evaluate(self.start + datetime.timedelta(seconds=seconds)).lines
+
+    def test_parse_rule(self):
+        rule = parse_rule("api_5xx: 5xx/s by section > 1.5 in 60 clear 0.5")
+        self.assertEqual((rule.name, rule.metric, rule.per, rule.key, rule.threshold,
+                          rule.interval, rule.clear),
+                         ('api_5xx', '5xx', 's', 'section', 1.5, 60, 0.5))
+        rule = parse_rule("hits > 20 in 120")
+        self.assertEqual((rule.name, rule.per, rule.key, rule.clear), 
+                         ("hits > 20 in 120", None, None, 18))
+        for text in ["hits > 20", "latency > 1 in 10", "hits > 1 in 10 clear 2"]:
+            self.assertRaises(ValueError, parse_rule, text)
+
+    def test_shared_windows(self):
+        rule_engine = RuleEngine(None, 1, [parse_rule("a: 5xx by section > 2 in 10"),
+                                           parse_rule("b: 5xx/hits by section > 0.5 in 10"),
+                                           parse_rule("c: bytes by host > 500 in 5")])
+        self.assertEqual(len(rule_engine.groups), 2)
+        self.insert(rule_engine, 0, 'host/api', 500, hits=3)
+        self.insert(rule_engine, 0, 'host/api', 200, hits=2)
+        self.insert(rule_engine, 0, 'host/img', 503)
+        self.insert(rule_engine, 0, 'host/img', 200, hits=2)
+        lines = self.evaluate(rule_engine, 1)
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith("Rule a [section host/api] generated an alert - 5xx = 3"))
+        self.assertTrue(lines[1].startswith("Rule b [section host/api] generated an alert - 5xx/hits = 0.6"))
+        self.assertTrue(lines[2].startswith("Rule c [host host] generated an alert - bytes = 800"))
+        self.assertEqual(sorted(rule_engine.raised), [('a', 'host/api'), ('b', 'host/api'), ('c', 'host')])
+        # hits expire from the window
+        lines = self.evaluate(rule_engine, 11)
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(rule_engine.raised, {})
+        self.assertEqual(rule_engine.groups[('section', 10)].windows, {})
+
+    def test_empty_key_values(self):
+        rule_engine = RuleEngine(None, 1, [parse_rule("a: hits by host > 1 in 10"),
+                                           parse_rule("b: hits > 1 in 10"),
+                                           parse_rule("c: 5xx by section > 1 in 10")])
+        # lines without a host
+        self.insert(rule_engine, 0, '/api', 200, hits=3)
+        lines = self.evaluate(rule_engine, 1)
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].startswith("Rule b generated an alert - hits = 3"))
+        self.assertEqual(rule_engine.groups[('host', 10)].windows, {})
+        # key values without events of the metrics of the rules
+        self.assertEqual(rule_engine.groups[('section', 10)].windows, {})
+
+    def test_insert_lines(self):
+        rules = [parse_rule("5xx by section > 2 in 10")]
+        rule_engine, batch_rule_engine = RuleEngine(None, 1, rules), RuleEngine(None, 1, rules)
+        self.insert(rule_engine, 0, 'host/api', 503, hits=3)
+        batch_rule_engine.insert_lines([LineData('host/api', 100, self.start, 503, None)] * 3)
+        self.assertEqual(self.evaluate(batch_rule_engine, 1), self.evaluate(rule_engine, 1))
+        self.assertEqual(len(rule_engine.raised), 1)
+
+    def test_hysteresis(self):
+        rule_engine = RuleEngine(None, 1, [parse_rule("hits/s > 2 in 10 clear 1")])
+        self.insert(rule_engine, 0, 'host/api', 200, hits=21)
+        self.assertEqual(len(self.evaluate(rule_engine, 0)), 1)
+        # not cleared while above the clear threshold
+        self.insert(rule_engine, 10, 'host/api', 200, hits=15)
+        self.assertEqual(self.evaluate(rule_engine, 20), [])
+        lines = self.evaluate(rule_engine, 21)
+        self.assertTrue(lines[0].startswith("Rule hits/s > 2 in 10 clear 1 alert recovered - hits/s = 0"))
+
+    def test_oscillating_value(self):
+        """alerts do not flap while the value oscillates around the threshold"""
+        for text, expected in [("hits > 11 in 10", 1), ("hits > 11 in 10 clear 11", 5)]:
+            rule_engine = RuleEngine(None, 1, [parse_rule(text)])
+            lines = []
+            for second in range(60):
+                # the window (of 11 seconds) has 11 hits, 12 every other 11 seconds
+                self.insert(rule_engine, second, 'host/api', 200,
+                            hits=2 if second % 22 == 10 else 1)
+                lines.extend(self.evaluate(rule_engine, second))
+            self.assertEqual(len(lines), expected)
+            self.assertTrue(lines[0].startswith("Rule %s generated an alert - hits = 12" % text))
+
+
+class AnomalyDetectorTestCase(unittest.TestCase):
+    def test_ewma_stats(self):
+        values = [3, 1, 4, 1, 5, 9, 2, 6]
+        stats = EwmaStats()
+        for value in values:
+            stats.update(value, 0.01)
+        # equally weighted while fewer than 1 / alpha values
+        mean = sum(values) / float(len(values))
+        self.assertAlmostEqual(stats.mean, mean)
+        self.assertAlmostEqual(stats.variance, sum((value - mean) ** 2 for value in values) / len(values))
+        for _ in range(1000):
+            stats.update(10, 0.01)
+        self.assertAlmostEqual(stats.mean, 10, places=3)
+
+    def test_update_zeros(self):
+        # across equally and exponentially weighted values
+        for count in [0, 3, 8, 30]:
+            stats, zeros_stats = EwmaStats(), EwmaStats()
+            for value in [4, 7, 2][:count]:
+                stats.update(value, 0.1)
+                zeros_stats.update(value, 0.1)
+            for _ in range(count):
+                stats.update(0, 0.1)
+            zeros_stats.update_zeros(count, 0.1)
+            self.assertEqual(zeros_stats.count, stats.count)
+            self.assertAlmostEqual(zeros_stats.mean, stats.mean)
+            self.assertAlmostEqual(zeros_stats.variance, stats.variance)
+        self.assertEqual(seconds_per_hour(3590, 7300), {0: 10, 1: 3600, 2: 100})
+
+    def test_seasonal_baseline(self):
+        detector = AnomalyDetector(10, seasonal=True, min_samples=2)
+        state = KeyState(True, 0)
+        state.hourly[3].update(5, detector.alpha)
+        self.assertTrue(detector.expected(state, 3) is state.baseline)
+        state.hourly[3].update(5, detector.alpha)
+        self.assertTrue(detector.expected(state, 3) is state.hourly[3])
+
+    def test_adaptive_alerts(self):
+        detector = AnomalyDetector(10, by_section=True, min_samples=60)
+        alert_notifier = AlertNotifier(None, 1, 10, 0, anomaly_detector=detector)
+        rand = random.Random(1)
+        start = datetime.datetime(2000, 10, 10, 13, 55, 0)
+
+        def simulate_second(second, section_2_hits):
+            logged = start + datetime.timedelta(seconds=second)
+            for section, hits in section_2_hits.items():
+                for _ in range(hits):
+                    alert_notifier.insert_data(LineData(section, 10, logged, 200, None))
+            return alert_notifier.evaluate(logged + datetime.timedelta(seconds=1)).lines
+
+        for second in range(300):
+            lines = simulate_second(second, {'host/a': rand.randint(3, 7), 
+                                             'host/b': rand.randint(0, 2)})
+            self.assertEqual(lines, [])
+        lines = []
+        for second in range(300, 305):
+            lines.extend(simulate_second(second, {'host/a': 5, 'host/b': 30}))
+        self.assertTrue(alert_notifier.is_alert_displayed)
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(any(line.startswith("High traffic anomaly generated an alert") for line in lines))
+        self.assertTrue(any(line.startswith("Section host/b traffic anomaly") for line in lines))
+        lines = []
+        for second in range(305, 360):
+            lines.extend(simulate_second(second, {'host/a': 5, 'host/b': 1}))
+        self.assertFalse(alert_notifier.is_alert_displayed)
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(any(line.startswith("Section host/b alert recovered") for line in lines))
+
+
+class SpaceSavingTestCase(unittest.TestCase):
+    def test_top(self):
+        section_hits = SpaceSaving(3)
+        true_hits = dict(a=10, b=1, c=1, d=1, e=9, f=1)
+        for section in 'abcdef':
+            for i in range(true_hits[section]):
+                section_hits.insert(section)
+        top = section_hits.top()
+        self.assertEqual(len(section_hits), 3)
+        # sections with more than total / k hits are always counted
+        self.assertEqual([section for section, _, _ in top[:2]], ['a', 'e'])
+        for section, hits, error in top:
+            self.assertTrue(hits - error <= true_hits[section] <= hits)
+        self.assertTrue(section_hits.error_bound() <= section_hits.total / 3)
+
+    def test_merge(self):
+        first, second, whole = SpaceSaving(2), SpaceSaving(2), SpaceSaving(2)
+        for section in 'aaabbc':
+            first.insert(section)
+            whole.insert(section)
+        for section in 'aacccd':
+            second.insert(section)
+            whole.insert(section)
+        first.merge(second)
+        self.assertEqual(first.total, 12)
+        self.assertEqual([section for section, _, _ in first.top()], ['a', 'c'])
+        for section, hits, error in first.top():
+            self.assertTrue(hits - error <= dict(a=5, c=4)[section] <= hits)
+
+
+class QuantileSketchTestCase(unittest.TestCase):
+    def assertWithinAccuracy(self, estimate, value, accuracy=0.01):
+        self.assertTrue(abs(estimate - value) <= accuracy * value,
+                        "%s not within %s of %s" % (estimate, accuracy, value))
+
+    def test_quantiles(self):
+        sketch = QuantileSketch()
+        for value in range(1, 1001):
+            sketch.insert(value)
+        self.assertWithinAccuracy(sketch.quantile(0.5), 500)
+        self.assertWithinAccuracy(sketch.quantile(0.99), 990)
+        self.assertEqual(QuantileSketch().quantile(0.5), None)
+
+    def test_merge(self):
+        first, second = QuantileSketch(), QuantileSketch()
+        for value in range(1, 1001):
+            (first if value % 3 else second).insert(value)
+        first.merge(second)
+        self.assertEqual(first.count, 1000)
+        self.assertWithinAccuracy(first.quantile(0.95), 950)
+
+    def test_insert_values(self):
+        sketch, batch_sketch = QuantileSketch(), QuantileSketch()
+        values = [0, 0.5, 3, 3, 1000, 12.25]
+        for value in values:
+            sketch.insert(value)
+        batch_sketch.insert_values(values)
+        self.assertEqual((batch_sketch.count, batch_sketch.zero_count, batch_sketch._buckets),
+                         (sketch.count, sketch.zero_count, sketch._buckets))
+
+    def test_bounded_buckets(self):
+        sketch = QuantileSketch(max_buckets=10)
+        for value in range(1, 10000):
+            sketch.insert(value)
+        self.assertTrue(len(sketch._buckets) <= 10)
+        self.assertWithinAccuracy(sketch.quantile(0.99), 9900)
+
+
+class SlowDisplay(object):
+    def __init__(self):
+        self.messages = []
+        self.release = threading.Event()
+
+    def show(self, message):
+        self.release.wait()
+        self.messages.append(message)
+
+
+@unittest.skipIf(AsyncDisplay is None, 'clint not installed')
+class AsyncDisplayTestCase(unittest.TestCase):
+    def show_messages(self, overflow_policy):
+        slow_display = SlowDisplay()
+        async_display = AsyncDisplay(slow_display, 5, overflow_policy)
+        for i in range(20):
+            async_display.show(Message(['alert %d' % i], MESSAGE_TYPES.alert))
+            async_display.show(Message(['summary %d' % i], MESSAGE_TYPES.summary))
+        slow_display.release.set()
+        while async_display._messages:
+            time.sleep(0.01)
+        time.sleep(0.01)
+        self.assertTrue(async_display.overflow_count > 0)
+        return slow_display.messages
+
+    def test_coalesce(self):
+        messages = self.show_messages('coalesce')
+        self.assertEqual(messages[-1].lines, ['summary 19'])
+        alert_lines = sum([message.lines for message in messages
+                           if message.type == MESSAGE_TYPES.alert], [])
+        self.assertEqual(alert_lines[-5:], ['alert %d' % i for i in range(15, 20)])
+
+    def test_drop_oldest(self):
+        messages = self.show_messages('drop-oldest')
+        self.assertTrue(len(messages) <= 6)
+        self.assertEqual(messages[-1].lines, ['summary 19'])
+
+
+class FakeSubwindow(object):
+    """Records the rows drawn in place of a curses subwindow"""
+    def __init__(self, height, width):
+        self.height = height
+        self.width = width
+        # (y, x, text) of the strings drawn
+        self.drawn = []
+        self.refreshes = 0
+
+    def getmaxyx(self):
+        return self.height, self.width
+
+    def addstr(self, y, x, text):
+        self.drawn.append((y, x, text))
+
+    def border(self):
+        pass
+
+    def refresh(self):
+        pass
+
+    def noutrefresh(self):
+        self.refreshes += 1
+
+
+class FakeCurses(object):
+    """Creates FakeSubwindows and counts screen updates"""
+    def __init__(self):
+        self.updates = 0
+
+    def curs_set(self, visibility):
+        pass
+
+    def newwin(self, height, width, y, x):
+        return FakeSubwindow(height, width)
+
+    def doupdate(self):
+        self.updates += 1
+
+
+@unittest.skipIf(AsyncDisplay is None, 'clint not installed')
+class ScreenBufferTestCase(unittest.TestCase):
+    def setUp(self):
+        # 3 rows of 10 characters inside the border
+        self.screen = ScreenBuffer(FakeSubwindow(5, 12))
+
+    def test_wrap_line(self):
+        self.assertEqual(self.screen.wrap_line(''), [''])
+        self.assertEqual(self.screen.wrap_line('0123456789'), ['0123456789'])
+        self.assertEqual(self.screen.wrap_line('abcdefghijklmnopqrstu'),
+                         ['abcdefghij', '> klmnopqr', '> stu'])
+        self.assertEqual(self.screen.wrap_line('abcdefghijklmnopqr'),
+                         ['abcdefghij', '> klmnopqr'])
+
+    def test_set_lines(self):
+        self.screen.set_lines(['a', 'b', 'c', 'd'])
+        self.assertEqual(self.screen.rows, ['a', 'b', 'c'])
+        self.screen.set_lines(['abcdefghijklm'])
+        self.assertEqual(self.screen.rows, ['abcdefghij', '> klm', ''])
+
+    def test_append_lines_scrolls(self):
+        self.screen.append_lines(['1', '2'])
+        self.assertEqual(self.screen.rows, ['1', '2', ''])
+        self.screen.append_lines(['3', '4'])
+        self.assertEqual(self.screen.rows, ['2', '3', '4'])
+        # wrapped lines scroll by their rows
+        self.screen.append_lines(['abcdefghijklm'])
+        self.assertEqual(self.screen.rows, ['4', 'abcdefghij', '> klm'])
+        self.screen.append_lines(['5', '6', '7', '8'])
+        self.assertEqual(self.screen.rows, ['6', '7', '8'])
+        self.assertEqual(self.screen.used_rows, 3)
+
+    def test_changed_rows(self):
+        self.assertEqual(self.screen.changed_rows(), [])
+        self.screen.set_lines(['a', 'b'])
+        self.assertEqual(self.screen.changed_rows(), [(0, 'a'), (1, 'b')])
+        self.assertEqual(self.screen.changed_rows(), [])
+        self.screen.set_lines(['a', 'c'])
+        self.assertEqual(self.screen.changed_rows(), [(1, 'c')])
+        # rows no longer used are cleared
+        self.screen.set_lines(['a'])
+        self.assertEqual(self.screen.changed_rows(), [(1, '')])
+
+
+@unittest.skipIf(AsyncDisplay is None, 'clint not installed')
+class WindowDisplayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.curses = logmonitor.display.curses
+        self.fake_curses = logmonitor.display.curses = FakeCurses()
+        # subwindows of 3 rows of 10 (left) and 22 (right) characters,
+        # frames are only rendered by the test
+        self.window_display = WindowDisplay(FakeSubwindow(5, 36), max_fps=0.001)
+
+    def tearDown(self):
+        self.window_display.render_thread.stop()
+        self.window_display.render_thread.join()
+        logmonitor.display.curses = self.curses
+
+    def test_render_changed_rows(self):
+        window_display = self.window_display
+        left = window_display.left_subwindow
+        right = window_display.right_subwindow
+        window_display.show(Message(['summary', 'a'], MESSAGE_TYPES.summary))
+        window_display.show(Message(['alert 1'], MESSAGE_TYPES.alert))
+        window_display.show(Message(['stats'], MESSAGE_TYPES.stats))
+        window_display.render()
+        # rows are drawn inside the border, padded to overwrite older rows
+        self.assertEqual(left.drawn, [(1, 1, 'summary   '), (2, 1, 'a         ')])
+        self.assertEqual(right.drawn, [(1, 1, 'alert 1'.ljust(22))])
+        self.assertEqual(self.fake_curses.updates, 1)
+
+        # nothing is drawn when nothing changed
+        window_display.render()
+        self.assertEqual(len(left.drawn) + len(right.drawn), 3)
+        self.assertEqual(self.fake_curses.updates, 1)
+
+        # only the changed rows of the changed subwindow are drawn
+        left.drawn = []
+        right.drawn = []
+        window_display.show(Message(['summary', 'b'], MESSAGE_TYPES.summary))
+        window_display.render()
+        self.assertEqual(left.drawn, [(2, 1, 'b         ')])
+        self.assertEqual(right.drawn, [])
+        self.assertEqual((left.refreshes, right.refreshes), (2, 1))
+        self.assertEqual(self.fake_curses.updates, 2)
+
+    def test_alerts_scroll(self):
+        window_display = self.window_display
+        for i in range(5):
+            window_display.show(Message(['alert %d' % i], MESSAGE_TYPES.alert))
+        window_display.render()
+        self.assertEqual(window_display.right_screen.rows, ['alert 2', 'alert 3', 'alert 4'])
+        window_display.right_subwindow.drawn = []
+        window_display.show(Message(['alert 5'], MESSAGE_TYPES.alert))
+        window_display.render()
+        # every row moved up
+        self.assertEqual([row.rstrip() for _, _, row in window_display.right_subwindow.drawn],
+                         ['alert 3', 'alert 4', 'alert 5'])
+
+
+@unittest.skipIf(AsyncDisplay is None, 'clint not installed')
+class ExporterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.summary_notifier = SummaryNotifier(None, 10, top_k=2)
+        for section, status in [('a', 200), ('a', 500), ('b', 200)]:
+            self.summary_notifier.insert_data(LineData('host/' + section, 100,
+                                                       datetime.datetime.now(), status))
+        self.summary = self.summary_notifier.message()
+        self.alert = Message([], MESSAGE_TYPES.alert, {'hits': 30, 'alert': True})
+
+    def test_prometheus(self):
+        display = PrometheusDisplay('localhost', 0)
+        try:
+            display.show(self.summary)
+            display.show(self.summary)
+            display.show(self.alert)
+            url = 'http://localhost:%d/metrics' % display.port
+            text = urllib2.urlopen(url).read()
+        finally:
+            display.close()
+        self.assertIn('logmonitor_hits_total 6\n', text)
+        self.assertIn('logmonitor_bytes_total 600\n', text)
+        self.assertIn('logmonitor_http_errors_total 2\n', text)
+        self.assertIn('logmonitor_section_hits_total{section="host/a"} 4\n', text)
+        self.assertIn('logmonitor_window_hits 30\n', text)
+        self.assertIn('logmonitor_alert 1\n', text)
+
+    def test_statsd_batches(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('localhost', 0))
+        server.settimeout(1)
+        display = StatsdDisplay('localhost', server.getsockname()[1])
+        display.MAX_PACKET_SIZE = 60
+        display.show(self.summary)
+        metrics = []
+        while len(metrics) < 5:
+            packet = server.recv(display.MAX_PACKET_SIZE)
+            self.assertTrue(len(packet) <= display.MAX_PACKET_SIZE)
+            metrics.extend(packet.split('\n'))
+        server.close()
+        self.assertEqual(metrics, ['logmonitor.hits:3|c',
+                                   'logmonitor.bytes:300|c',
+                                   'logmonitor.http_errors:1|c',
+                                   'logmonitor.section.host_a.hits:2|c',
+                                   'logmonitor.section.host_b.hits:1|c'])
+
+
+class SlidingWindowCounterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.window = SlidingWindowCounter(5)
+
+    def test_expire(self):
+        self.window.add(100)
+        self.window.add(102, 2)
+        self.window.advance(105)
+        self.assertEqual(self.window.total, 3)
+        self.window.advance(106)
+        self.assertEqual(self.window.total, 2)
+        self.window.advance(1000)
+        self.assertEqual(self.window.total, 0)
+
+    def test_out_of_order(self):
+        self.window.add(110)
+        self.assertTrue(self.window.add(107))
+        self.assertTrue(self.window.add(105))
+        self.assertFalse(self.window.add(104))
+        self.assertEqual(self.window.total, 3)
+        self.window.advance(112)
+        self.assertEqual(self.window.total, 2)
+
+
+class SectionTableTestCase(unittest.TestCase):
+    def test_uri_section(self):
+        self.assertEqual(uri_section('/pages/create'), 'pages')
+        self.assertEqual(uri_section('/pages'), '')
+        self.assertEqual(uri_section('http://my.site.com/pages/create'), '')
+        self.assertEqual(uri_section(''), '')
+
+    def test_interning(self):
+        section_table = SectionTable(max_sections=2)
+        section = section_table.intern(''.join(['host/', 'pages']))
+        self.assertTrue(section_table.intern(''.join(['host/', 'pages'])) is section)
+        self.assertEqual(section_table.section_id('host/pages'), 0)
+        self.assertEqual(section_table.section_id('host/users'), 1)
+        self.assertEqual(section_table.name(1), 'host/users')
+        self.assertEqual(section_table.name('host/other'), 'host/other')
+        # the generation is full, a new generation is started
+        self.assertEqual(section_table.section_id('host/other'), 2)
+        self.assertEqual(len(section_table), 3)
+        # sections of the previous generation keep their ids
+        self.assertTrue(section_table.intern('host/pages') is section)
+        self.assertEqual(section_table.section_id('host/pages'), 0)
+        self.assertEqual(section_table.name(1), 'host/users')
+        # 'host/users' is forgotten with the previous generation
+        self.assertEqual(section_table.section_id('host/new'), 3)
+        self.assertRaises(KeyError, section_table.name, 1)
+        self.assertEqual(section_table.section_id('host/users'), 4)
+        self.assertEqual(len(section_table), 4)
+
+    def test_host_sections(self):
+        section_table = SectionTable(max_sections=2)
+        section, section_id = section_table.host_section('host', 'pages')
+        self.assertEqual((section, section_id), ('host/pages', 0))
+        self.assertTrue(section_table.host_section('host', 'pages')[0] is section)
+        self.assertEqual(section_table.host_section('host', 'users'), ('host/users', 1))
+        self.assertEqual(section_table.key('host/users'), 1)
+        self.assertEqual(section_table.host_section('host', 'other'), ('host/other', 2))
+        self.assertEqual(section_table.host_sections, {('host', 'other'): ('host/other', 2)})
+        self.assertEqual(section_table.host_section('host', 'pages'), ('host/pages', 0))
+        self.assertEqual(len(section_table.host_sections), 2)
+
+    def test_full_table(self):
+        """the table stays bounded when filled past max_sections"""
+        section_table = SectionTable(max_sections=4)
+        self.assertEqual(section_table.host_section('host', 'pages'), ('host/pages', 0))
+        section_ids = set()
+        for i in range(100):
+            section_id = section_table.host_section('host%d' % i, 'pages')[1]
+            section_ids.add(section_id)
+            # a section used all along is never forgotten
+            self.assertEqual(section_table.host_section('host', 'pages'), ('host/pages', 0))
+            self.assertTrue(len(section_table) <= 8)
+            self.assertTrue(len(section_table.host_sections) <= 4)
+        # ids are never reused
+        self.assertEqual(len(section_ids), 100)
+        self.assertNotIn(0, section_ids)
+        self.assertEqual(section_table.name(section_id), 'host99/pages')
+        self.assertRaises(KeyError, section_table.name, 1)
+
+    def test_summary_of_forgotten_sections(self):
+        """summaries show sections forgotten by the table"""
+        max_sections = SECTION_TABLE.max_sections
+        SECTION_TABLE.max_sections = 4
+        try:
+            logparser = CommonLogParser('')
+            summary_data = SummaryData(2)
+            hosts = [0] * 15 + [1] * 10 + [2] * 5
+            lines = ['host%d - - [09/May/2016:12:00:00 +0000] "GET /pages/%d HTTP/1.0" 200 10'
+                     % (host, i) for i, host in enumerate(hosts)]
+            for linedata in logparser.parse_lines(lines):
+                summary_data.insert_data(linedata)
+            summary_data.flush()
+            keys = [key for key, _, _ in summary_data.section_hits.top()]
+            other = SummaryData(2)
+            lines = ['other%d - - [09/May/2016:12:00:00 +0000] "GET /pages/ HTTP/1.0" 200 10' % i
+                     for i in range(30)]
+            for linedata in logparser.parse_lines(lines):
+                other.insert_data(linedata)
+            summary_data.merge(other)
+        finally:
+            SECTION_TABLE.max_sections = max_sections
+        self.assertRaises(KeyError, SECTION_TABLE.name, keys[0])
+        message = SummaryNotifier(None, 1, top_k=2).summary_message(summary_data)
+        self.assertEqual([section for section, _ in message.data['section_hits']],
+                         ['host0/pages', 'host1/pages'])
+        copied = pickle.loads(pickle.dumps(summary_data, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(sorted(copied.section_names.values()),
+                         sorted(summary_data.section_names.values()))
+        self.assertEqual(SummaryNotifier(None, 1, top_k=2).summary_message(copied).data, message.data)
+
+    def test_parsed_section_ids(self):
+        logparser = CommonLogParser('')
+        lines = ['host - - [09/May/2016:12:00:00 +0000] "GET /pages/%d HTTP/1.0" 200 10' % i
+                 for i in range(3)]
+        # the fast and slow paths intern sections in the same table
+        linedatas = logparser.parse_lines(lines) + [logparser.parse_line_slow(lines[0])]
+        self.assertEqual(set(linedata.section_id for linedata in linedatas),
+                         set([SECTION_TABLE.section_id('host/pages')]))
+        self.assertTrue(all(linedata.section is SECTION_TABLE.name(linedata.section_id)
+                            for linedata in linedatas))
+
+
+class LogGeneratorTestCase(unittest.TestCase):
+    def test_deterministic(self):
+        lines = list(LogGenerator(seed=3).lines(1000))
+        self.assertEqual(lines, list(LogGenerator(seed=3).lines(1000)))
+        self.assertNotEqual(lines, list(LogGenerator(seed=4).lines(1000)))
+
+    def test_common_lines(self):
+        generator = LogGenerator(rate=10, sections=20, error_ratio=0.2,
+                                 burst_interval=10, burst_factor=5, burst_duration=2)
+        logparser = CommonLogParser('')
+        linedatas = logparser.parse_lines(list(generator.lines(1800)))
+        self.assertEqual(len(linedatas), 1800)
+        second_2_hits = {}
+        section_2_hits = {}
+        for linedata in linedatas:
+            second_2_hits[linedata.datetime] = second_2_hits.get(linedata.datetime, 0) + 1
+            section = linedata.section.split('/')[1]
+            section_2_hits[section] = section_2_hits.get(section, 0) + 1
+        # 2 seconds of 50 lines and 8 seconds of 10 lines every 10 seconds
+        self.assertEqual(sorted(set(second_2_hits.values())), [10, 50])
+        self.assertEqual(max(section_2_hits, key=section_2_hits.get), 'section0')
+        errors = sum(1 for linedata in linedatas if linedata.status >= 400)
+        self.assertTrue(270 < errors < 450)
+
+    def test_w3c_directive_changes(self):
+        generator = LogGenerator('w3c', directive_interval=100)
+        lines = list(generator.lines(1000))
+        self.assertEqual(len([line for line in lines if line.startswith('#Fields:')]), 10)
+        logparser = W3CLogParser('')
+        logparser.reset_fields()
+        linedatas = logparser.parse_lines(lines)
+        self.assertEqual(len(linedatas), 1000)
+        self.assertEqual(set(linedata.datetime.date() for linedata in linedatas),
+                         set([datetime.date(2000, 1, 1)]))
+
+    def test_compare(self):
+        ratios = compare({'ingest': {'lines_per_sec': 150.0, 'watcher': 'a'}, 'rss': 10},
+                         {'ingest': {'lines_per_sec': 100.0, 'watcher': 'b'}, 'rss': 0})
+        self.assertEqual(ratios, {'ingest.lines_per_sec': 1.5})
+
+
+class CommonLogParserTestCase(unittest.TestCase):
+    def setUp(self):
+        self.common_log_parser = CommonLogParser('')
+
+    def test_fast_path_matches_linedata(self):
+        lines = ['host - - [10/Oct/2000:13:55:36 -0700] "GET /a/b.gif HTTP/1.0" 200 2326\r\n',
+                 '  host - - [10/Oct/2000:13:55:36 -0700] "GET /a/b.gif HTTP/1.0" 200 2326',
+                 'host - - [10/Oct/2000:13:55:37 -0700] "GET http://host/b HTTP/1.0" - -',
+                 'host - - [10/Oct/2000:13:55:37 -0700] "GET / HTTP/1.0" 304 0 "ref" "agent"',
+                 'host a b [11/Oct/2000:13:55:37 -0700] "POST /a/b/c HTTP/1.1" 404 12  ',
+                 'host a b [11/Oct/2000:13:55:37 -0700] "GET  /a/b/c HTTP/1.1" 404 12']
+        for line in lines:
+            self.assertEqual(self.common_log_parser.parse_line(line),
+                             self.common_log_parser.parse_line_slow(line))
+
+    def test_parse_lines(self):
+        lines = ['host - - [10/Oct/2000:13:55:36 -0700] "GET /a/b.gif HTTP/1.0" 200 2326\r',
+                 '  host - - [10/Oct/2000:13:55:36 -0700] "GET /a/b.gif HTTP/1.0" 200 2326',
+                 'invalid',
+                 'host - - [10/Oct/2000:13:55:37 -0700] "GET / HTTP/1.0" 304 0 "ref" "agent" 10',
+                 '',
+                 'host a b [11/Oct/2000:13:55:37 -0700] "GET  /a/b/c HTTP/1.1" 404 12']
+        self.common_log_parser.stats = Stats()
+        linedatas = self.common_log_parser.parse_lines(lines)
+        # lines are parsed in order whether matched by the fast pattern or not
+        self.assertEqual(linedatas, [self.common_log_parser.parse_line_slow(line)
+                                     for line in lines if line not in ['invalid', '']])
+        counters = self.common_log_parser.stats.snapshot()['counters']
+        self.assertEqual(counters['parse_errors'], 2)
+        self.assertEqual(counters['lines_parsed'], 4)
+
+    def test_parse_matched_lines(self):
+        """batches of lines all matched by the fast pattern are converted by column"""
+        lines = ['host - - [10/Oct/2000:13:55:36 -0700] "GET /a/b.gif HTTP/1.0" 200 2326 1500',
+                 'host - - [10/Oct/2000:13:55:37 -0700] "GET http://host/b HTTP/1.0" - -',
+                 'host - - [99/Foo/2000:13:55:37 -0700] "GET /a/b.gif HTTP/1.0" 200 2326 1500',
+                 'other - - [10/Oct/2000:13:55:37 -0700] "GET /c/ HTTP/1.0" 404 12 7']
+        self.common_log_parser.stats = Stats()
+        linedatas = self.common_log_parser.parse_lines(lines)
+        self.assertEqual(linedatas, [self.common_log_parser.parse_line_slow(line)
+                                     for line in lines[:2] + lines[3:]])
+        self.assertEqual([(linedata.status, linedata.bytes, linedata.latency) for linedata in linedatas],
+                         [(200, 2326, 1.5), (0, 0, None), (404, 12, 0.007)])
+        self.assertEqual(self.common_log_parser.stats.snapshot()['counters']['parse_errors'], 1)
+
+    def test_line_data(self):
+        linedata = LineData('host/a', 10, datetime.datetime(2000, 10, 10), 200, 1.5, 3)
+        self.assertEqual(linedata[LINE_DATA_FIELDS.latency], 1.5)
+        self.assertEqual(linedata.section_id, 3)
+        # section ids are not compared
+        self.assertEqual(linedata, LineData('host/a', 10, datetime.datetime(2000, 10, 10), 200, 1.5))
+        self.assertEqual(pickle.loads(pickle.dumps(linedata, pickle.HIGHEST_PROTOCOL)).section_id, 3)
+        self.assertEqual(LineData('host/a', 10, None, 200).latency, None)
+
+    def test_line_data_fields(self):
+        linedata = self.common_log_parser.parse_line(
+                'host - - [10/Oct/2000:13:55:36 -0700] "GET /a/b.gif HTTP/1.0" 404 2326')
+        self.assertEqual(linedata[LINE_DATA_FIELDS.section], 'host/a')
+        self.assertEqual(linedata[LINE_DATA_FIELDS.bytes], 2326)
+        self.assertEqual(linedata[LINE_DATA_FIELDS.datetime], datetime.datetime(2000, 10, 10, 13, 55, 36))
+        self.assertEqual(linedata[LINE_DATA_FIELDS.status], 404)
+        self.assertEqual(linedata.status, 404)
+
+    def test_latency(self):
+        linedata = self.common_log_parser.parse_line(
+                'host - - [10/Oct/2000:13:55:36 -0700] "GET /a/b.gif HTTP/1.0" 200 2326 "ref" "agent" 1500')
+        self.assertEqual(linedata.latency, 1.5)
+        self.assertEqual(linedata, self.common_log_parser.parse_line_slow(
+                'host - - [10/Oct/2000:13:55:36 -0700] "GET /a/b.gif HTTP/1.0" 200 2326 "ref" "agent" 1500'))
+        linedata = self.common_log_parser.parse_line(
+                'host - - [10/Oct/2000:13:55:36 -0700] "GET /a/b.gif HTTP/1.0" 200 2326')
+        self.assertEqual(linedata.latency, None)
+
+    def test_invalid_line(self):
+        self.assertRaises(LogParseError, self.common_log_parser.parse_line, 'invalid')
+        line = 'host - - [10/Oct/2000:13:55:36 -0700] "GET /a HTTP/1.0" 200 12ab'
+        self.assertRaises(LogParseError, self.common_log_parser.parse_line, line)
+        self.common_log_parser.stats = Stats()
+        self.assertEqual(self.common_log_parser.parse_lines([line]), [])
+        self.assertEqual(self.common_log_parser.stats.snapshot()['counters']['parse_errors'], 1)
+
+    def test_invalid_date(self):
+        lines = ['host - - [99/Foo/2000:00:00:00 +0000] "GET /a/b HTTP/1.0" 200 12',
+                 'host - - [99/Foo/2000:00:00:00] "GET /a/b HTTP/1.0" 200 12',
+                 'host - - [10/Oct/2000:13:55:36 -0700] "GET /a/b HTTP/1.0" 200 12']
+        for line in lines[:2]:
+            self.assertRaises(LogParseError, self.common_log_parser.parse_line, line)
+        self.common_log_parser.stats = Stats()
+        linedatas = self.common_log_parser.parse_lines(lines)
+        self.assertEqual([linedata.section for linedata in linedatas], ['host/a'])
+        self.assertEqual(self.common_log_parser.stats.snapshot()['counters']['parse_errors'], 2)
+
+
+class W3CLogParserTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.logfilepath = os.path.join(self.tempdir, 'access-log')
+        self.cachepath = os.path.join(self.tempdir, 'directives')
+        self.write('#Version: 1.0\n'
+                   '#Fields: date time cs-uri-stem\n'
+                   '2000-10-10 13:55:36 /a/b.gif\n'
+                   '#Fields: date time c-ip cs-uri-stem sc-status\n'
+                   '2000-10-10 13:55:37 1.2.3.4 /a/b.gif 200\n'
+                   'x #Fields: not a directive\n', 'w')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, text, mode='a'):
+        with open(self.logfilepath, mode) as logfile:
+            logfile.write(text)
+
+    def find_last_field_directive(self, end=None):
+        w3c_log_parser = W3CLogParser(self.logfilepath, directive_cache=DirectiveCache(self.cachepath))
+        w3c_log_parser.logfile = w3c_log_parser.open_logfile()
+        with w3c_log_parser.logfile:
+            return w3c_log_parser.find_last_field_directive(end)
+
+    def test_find_last_field_directive(self):
+        self.assertEqual(self.find_last_field_directive(),
+                         ['date', 'time', 'c-ip', 'cs-uri-stem', 'sc-status'])
+        self.assertEqual(self.find_last_field_directive(40),
+                         ['date', 'time', 'cs-uri-stem'])
+        self.assertEqual(self.find_last_field_directive(10), None)
+
+    def test_time_taken(self):
+        w3c_log_parser = W3CLogParser(self.logfilepath)
+        w3c_log_parser.fieldnames = ['date', 'time', 'cs-uri-stem', 'sc-status', 'sc-bytes', 'time-taken']
+        self.assertEqual(w3c_log_parser.parse_line('2000-10-10 13:55:36 /a/b.gif 200 10 15').latency, 15)
+        self.assertEqual(w3c_log_parser.parse_line('2000-10-10 13:55:36 /a/b.gif 200 10 0.25').latency, 250)
+        self.assertEqual(w3c_log_parser.parse_line('2000-10-10 13:55:36 /a/b.gif 200 10 -').latency, None)
+
+    def test_invalid_line(self):
+        w3c_log_parser = W3CLogParser(self.logfilepath)
+        w3c_log_parser.fieldnames = ['date', 'time', 'cs-uri-stem', 'sc-status']
+        lines = ['2000-10-10 /a/b.gif',
+                 '2000-10-10 13:55:36 /a/b.gif x',
+                 '2000-99-10 13:55:36 /a/b.gif 200',
+                 '2000-10-10 13:55 /a/b.gif 200']
+        for line in lines[:3]:
+            self.assertRaises(LogParseError, w3c_log_parser.parse_line, line)
+        w3c_log_parser.stats = Stats()
+        linedatas = w3c_log_parser.parse_lines(lines)
+        self.assertEqual([linedata.datetime for linedata in linedatas],
+                         [datetime.datetime(2000, 10, 10, 13, 55)])
+        self.assertEqual(w3c_log_parser.stats.snapshot()['counters']['parse_errors'], 3)
+
+    def test_cached_field_directive(self):
+        fieldnames = self.find_last_field_directive()
+        self.assertTrue(os.path.exists(self.cachepath))
+        self.assertEqual(self.find_last_field_directive(), fieldnames)
+        # directives written after the scan are found
+        self.write('#Fields: date time\n')
+        self.assertEqual(self.find_last_field_directive(), ['date', 'time'])
+
+    def test_cached_field_directive_kept(self):
+        """finding a directive before the cached one keeps the cache entry"""
+        self.find_last_field_directive()
+        file_stat = os.stat(self.logfilepath)
+        cached = DirectiveCache(self.cachepath).get(file_stat)
+        self.assertEqual(cached[2], file_stat.st_size)
+        self.assertEqual(self.find_last_field_directive(40), ['date', 'time', 'cs-uri-stem'])
+        self.assertEqual(DirectiveCache(self.cachepath).get(file_stat), cached)
+
+
+class FollowTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.logfilepath = os.path.join(self.tempdir, 'access-log')
+        self.write('first\nsecond\nthi', 'w')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, text, mode='a'):
+        with open(self.logfilepath, mode) as logfile:
+            logfile.write(text)
+
+    def follow(self, watcher):
+        parser = CommonLogParser(self.logfilepath, watcher)
+        parser.logfile = parser.open_logfile()
+        batches = parser.follow()
+        self.assertEqual(next(batches), ['first', 'second'])
+        # incomplete line is carried over
+        self.write('rd\n')
+        self.assertEqual(next(batches), ['third'])
+        # truncated
+        self.write('new\n', 'w')
+        self.assertEqual(next(batches), ['new'])
+        # rotated, old file is read to the end before switching
+        self.write('old\n')
+        os.rename(self.logfilepath, self.logfilepath + '.1')
+        self.write('rotated\n', 'w')
+        self.assertEqual(next(batches), ['old'])
+        self.assertEqual(next(batches), ['rotated'])
+        parser.logfile.close()
+        watcher.close()
+
+    def test_line_endings(self):
+        self.write('first\r\nsecond\rthird\r', 'w')
+        parser = CommonLogParser(self.logfilepath)
+        parser.logfile = parser.open_logfile()
+        self.assertEqual(parser.read_lines(), ['first', 'second'])
+        # a trailing '\r' may be followed by '\n'
+        self.write('\nfourth\n')
+        self.assertEqual(parser.read_lines(), ['third', 'fourth'])
+        parser.logfile.close()
+        self.assertEqual(list(parser.lines_of_blocks(['a\r', '\nb\rc\r'])), [['a', 'b'], ['c']])
+
+    def test_follow_polling(self):
+        self.follow(PollingWatcher())
+
+    def test_follow_inotify(self):
+        try:
+            watcher = InotifyWatcher()
+        except (OSError, AttributeError):
+            self.skipTest('inotify not available')
+        self.follow(watcher)
+
+
+class MultiLogFollowerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.logfilepaths = [os.path.join(self.tempdir, name) for name in ['a-log', 'b-log']]
+        for logfilepath in self.logfilepaths:
+            open(logfilepath, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_follow_multiple_files(self):
+        logline_template = 'host - - [10/Oct/2000:13:55:36 -0700] "GET /%s/b.gif HTTP/1.0" 200 10\n'
+        logparsers = [CommonLogParser(logfilepath) for logfilepath in self.logfilepaths]
+        for logparser in logparsers:
+            logparser.logfile = logparser.open_logfile()
+        parsedlines = MultiLogFollower(logparsers, PollingWatcher()).parsedlines()
+        for logfilepath, section in zip(self.logfilepaths, ['a', 'b']):
+            with open(logfilepath, 'a') as logfile:
+                logfile.write(logline_template % section)
+            logparser, linedata = next(parsedlines)
+            self.assertEqual(logparser.filepath, logfilepath)
+            self.assertEqual(linedata.section, 'host/' + section)
+        parsedlines.close()
+
+
+class StatsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.stats = Stats()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_lines_read_and_parsed(self):
+        logfilepath = os.path.join(self.tempdir, 'access-log')
+        with open(logfilepath, 'w') as logfile:
+            logfile.write('host - - [10/Oct/2000:13:55:36 -0700] "GET /a/b HTTP/1.0" 200 10\n'
+                          'invalid\n'
+                          'host - - [10/Oct/2000:13:55:36 -0700] "GET /a/b HTTP/1.0" 200 10\n'
+                          'host - - [10/Oct/2000:13:55:36')
+        logparser = CommonLogParser(logfilepath)
+        logparser.stats = self.stats
+        logparser.logfile = logparser.open_logfile()
+        linedatas = logparser.parse_lines(logparser.read_lines())
+        logparser.logfile.close()
+        self.assertEqual(len(linedatas), 2)
+        counters = self.stats.snapshot()['counters']
+        self.assertEqual(counters['lines_read'], 3)
+        self.assertEqual(counters['lines_parsed'], 2)
+        self.assertEqual(counters['parse_errors'], 1)
+        self.assertEqual(counters['bytes_read'], os.path.getsize(logfilepath))
+
+    def test_snapshot_and_dump(self):
+        self.stats.gauge('lag', lambda: 5)
+        for value in range(1, 101):
+            self.stats.observe('notify_ms', value)
+        statsfilepath = os.path.join(self.tempdir, 'stats.json')
+        self.stats.dump(statsfilepath)
+        with open(statsfilepath) as statsfile:
+            snapshot = json.load(statsfile)
+        self.assertEqual(snapshot['gauges'], {'lag': 5})
+        histogram = snapshot['histograms']['notify_ms']
+        self.assertEqual(histogram['count'], 100)
+        self.assertAlmostEqual(histogram['p50'], 50, delta=1)
+        self.assertAlmostEqual(histogram['max'], 100, delta=1)
+
+    def test_notify_duration_and_stats_message(self):
+        stats_notifier = StatsNotifier(None, 1, self.stats)
+        self.stats.incr('lines_read', 10)
+        stats_notifier.notify()
+        message = stats_notifier.message()
+        self.assertEqual(message.type, MESSAGE_TYPES.stats)
+        self.assertIn("Lines Read: 10 (0/s)", message.lines)
+        self.assertEqual(self.stats.snapshot()['histograms']['stats_notify_ms']['count'], 1)
+
+    def test_missed_ticks(self):
+        thread = RepeatFunctionThread(0.01, time.sleep, 0.035)
+        thread.stats = self.stats
+        thread.start()
+        time.sleep(0.1)
+        thread.stop()
+        thread.join()
+        self.assertTrue(self.stats.snapshot()['counters']['missed_ticks'] >= 3)
+
+
+class CheckpointTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.logfilepath = os.path.join(self.tempdir, 'access-log')
+        self.checkpointpath = os.path.join(self.tempdir, 'checkpoint')
+        self.logline = 'host - - [10/Oct/2000:13:55:36 -0700] "GET /a/b HTTP/1.0" 200 10\n'
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def monitor(self):
+        logparser = CommonLogParser(self.logfilepath)
+        summary_notifier = SummaryNotifier(None, 10)
+        alert_notifier = AlertNotifier(None, 1, 120, 20)
+        checkpoint = Checkpoint(self.checkpointpath, [logparser], 
+                                summary_notifier, alert_notifier)
+        return logparser, summary_notifier, alert_notifier, checkpoint
+
+    def test_resume(self):
+        with open(self.logfilepath, 'w') as logfile:
+            logfile.write(self.logline * 3 + 'host - - [10/Oct/2000:13')
+        logparser, summary_notifier, alert_notifier, checkpoint = self.monitor()
+        self.assertFalse(checkpoint.restore())
+        logparser.logfile = logparser.open_logfile()
+        for linedata in logparser.parse_lines(logparser.read_lines()):
+            summary_notifier.insert_data(linedata)
+            alert_notifier.insert_data(linedata)
+        checkpoint.save()
+        logparser.logfile.close()
+
+        # lines written while the monitor is not running
+        with open(self.logfilepath, 'a') as logfile:
+            logfile.write(':55:36 -0700] "GET /a/b HTTP/1.0" 200 10\n')
+        logparser, summary_notifier, alert_notifier, checkpoint = self.monitor()
+        self.assertTrue(checkpoint.restore())
+        lines = logparser.read_lines()
+        logparser.logfile.close()
+        self.assertEqual(lines, [self.logline.strip()])
+        summary_data = summary_notifier.purge_data()
+        self.assertEqual(summary_data.section_hits.count(SECTION_TABLE.key('host/a')), 3)
+        second = datetime_to_seconds(datetime.datetime(2000, 10, 10, 13, 55, 36))
+        self.assertEqual(alert_notifier.state(), {second: 3})
+
+    def test_summary_state(self):
+        """counters and sketches are restored, including sections that are not UTF-8"""
+        _, summary_notifier, _, checkpoint = self.monitor()
+        start = datetime.datetime(2000, 10, 10, 13, 55, 36)
+        for i in range(40):
+            summary_notifier.insert_data(LineData('host/\xff', i, start, 200, float(i)))
+            summary_notifier.insert_data(LineData('host/a', 10, start, 500, None), 'access-log')
+        checkpoint.save()
+        lines = summary_notifier.summary_message(summary_notifier.purge_data()).lines
+        _, summary_notifier, _, checkpoint = self.monitor()
+        self.assertTrue(checkpoint.restore())
+        self.assertEqual(summary_notifier.summary_message(summary_notifier.purge_data()).lines,
+                         lines)
+        self.assertIn("host/\xff : 40 hits", lines)
+        self.assertIn("  time p50/p95/p99: 19/37/38 ms", lines)
+
+    def test_other_versions_ignored(self):
+        """monitoring starts afresh from checkpoints of other versions"""
+        _, summary_notifier, alert_notifier, checkpoint = self.monitor()
+        with open(self.checkpointpath, 'wb') as checkpointfile:
+            pickle.dump({'logfiles': {}}, checkpointfile, pickle.HIGHEST_PROTOCOL)
+        self.assertEqual(checkpoint.load(), None)
+        self.assertFalse(checkpoint.restore())
+        with open(self.checkpointpath, 'w') as checkpointfile:
+            json.dump({'version': Checkpoint.VERSION + 1, 'logfiles': {}}, checkpointfile)
+        self.assertFalse(checkpoint.restore())
+        # malformed states of the current version
+        with open(self.checkpointpath, 'w') as checkpointfile:
+            json.dump({'version': Checkpoint.VERSION, 'logfiles': {},
+                       'alert': [[1, 2]], 'summary': {'top_k': 10}}, checkpointfile)
+        self.assertFalse(checkpoint.restore())
+        self.assertEqual(alert_notifier.state(), {})
+        self.assertEqual(summary_notifier.purge_data().section_hits.total, 0)
+
+    def test_rotated_file_read_from_start(self):
+        with open(self.logfilepath, 'w') as logfile:
+            logfile.write(self.logline)
+        logparser, _, _, checkpoint = self.monitor()
+        logparser.logfile = logparser.open_logfile()
+        logparser.read_lines()
+        checkpoint.save()
+        logparser.logfile.close()
+        os.rename(self.logfilepath, self.logfilepath + '.1')
+        with open(self.logfilepath, 'w') as logfile:
+            logfile.write(self.logline)
+        logparser, _, _, checkpoint = self.monitor()
+        checkpoint.restore()
+        self.assertEqual(logparser.logfile.tell(), 0)
+        logparser.logfile.close()
+
+
+class ArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.logfilepath = os.path.join(self.tempdir, 'access-log')
+        self.logline_template = 'host - - [10/Oct/2000:13:55:36 -0700] "GET /%s/b HTTP/1.0" 200 10\n'
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write_gzip(self, filepath, data):
+        gzipfile = gzip.open(filepath, 'wb')
+        gzipfile.write(data)
+        gzipfile.close()
+
+    def test_multiple_gzip_members(self):
+        archivepath = self.logfilepath + '.1.gz'
+        self.write_gzip(archivepath, 'first\n')
+        with open(archivepath, 'rb') as archive:
+            member = archive.read()
+        with open(archivepath, 'ab') as archive:
+            archive.write(member)
+        self.assertEqual(''.join(decompressed_blocks(archivepath, read_size=7)), 'first\n' * 2)
+
+    def test_bounded_blocks(self):
+        """blocks of highly compressed archives stay within block_size"""
+        archivepath = self.logfilepath + '.1.gz'
+        data = ''.join(self.logline_template % i for i in range(10000))
+        self.write_gzip(archivepath, data)
+        with open(archivepath, 'rb') as archive:
+            member = archive.read()
+        with open(archivepath, 'ab') as archive:
+            archive.write(member)
+        blocks = list(decompressed_blocks(archivepath, block_size=4096))
+        self.assertEqual(''.join(blocks), data * 2)
+        self.assertTrue(len(member) < 4096 * 32)
+        self.assertEqual(max(len(block) for block in blocks), 4096)
+
+    def test_read_rotated_oldest_first(self):
+        self.write_gzip(self.logfilepath + '.2.gz', self.logline_template % 'two')
+        with open(self.logfilepath + '.1', 'w') as logfile:
+            logfile.write(self.logline_template % 'one')
+        with open(self.logfilepath, 'w') as logfile:
+            logfile.write(self.logline_template % 'live')
+        open(self.logfilepath + '.old', 'w').close()
+        self.assertEqual(rotated_filepaths(self.logfilepath), 
+                         [self.logfilepath + '.2.gz', self.logfilepath + '.1'])
+        logparser = CommonLogParser(self.logfilepath)
+        sections = [linedata.section for lines in logparser.read_rotated()
+                    for linedata in logparser.parse_lines(lines)]
+        sections.extend(linedata.section for linedata in logparser.parse_lines(logparser.read_lines()))
+        logparser.logfile.close()
+        self.assertEqual(sections, ['host/two', 'host/one', 'host/live'])
+
+    def test_backfill_compressed(self):
+        archivepath = self.logfilepath + '.gz'
+        self.write_gzip(archivepath, self.logline_template % 'a' * 3)
+        aggregate = backfill.parse_chunk(('common', archivepath, 0, None, 10, 10, False, False))
+        self.assertEqual(sum(aggregate.second_2_hits.values()), 3)
+
+
+@unittest.skipIf(numpy is None, 'numpy not installed')
+class ColumnarAggregateTestCase(unittest.TestCase):
+    def assertSketchesEqual(self, sketch, other):
+        self.assertEqual((sketch.count, sketch.zero_count, sketch._buckets),
+                         (other.count, other.zero_count, other._buckets))
+
+    def test_matches_scalar_aggregate(self):
+        rand = random.Random(7)
+        start = datetime.datetime(2000, 10, 10, 13, 55, 0)
+        linedatas = [LineData('host/%d' % rand.randint(0, 7),
+                              rand.choice([0, 10, 2326, rand.randint(0, 10 ** 6)]),
+                              start + datetime.timedelta(seconds=rand.randint(0, 60)),
+                              rand.choice([200, 304, 404, 500]),
+                              rand.choice([None, 0.0, 1.5, rand.random() * 100]))
+                     for _ in range(5000)]
+        scalar = backfill.ChunkAggregate(10, 10)
+        scalar.insert_lines(linedatas[:3000], 'a-log')
+        scalar.insert_lines(linedatas[3000:])
+        scalar.flush()
+        columnar = ColumnarAggregate(10, 10)
+        columnar.FLUSH_SIZE = 2000
+        columnar.insert_lines(linedatas[:3000], 'a-log')
+        columnar.insert_lines(linedatas[3000:])
+        columnar.flush()
+        self.assertEqual(columnar.second_2_hits, scalar.second_2_hits)
+        self.assertEqual(sorted(columnar.interval_2_summary), sorted(scalar.interval_2_summary))
+        for interval, summary_data in scalar.interval_2_summary.items():
+            columnar_summary_data = columnar.interval_2_summary[interval]
+            self.assertEqual(columnar_summary_data.section_hits.top(), summary_data.section_hits.top())
+            self.assertEqual(columnar_summary_data.section_hits.total, summary_data.section_hits.total)
+            self.assertEqual(columnar_summary_data.bytes, summary_data.bytes)
+            self.assertEqual(columnar_summary_data.error_code_count, summary_data.error_code_count)
+            self.assertEqual(columnar_summary_data.filepath_2_hits, summary_data.filepath_2_hits)
+            self.assertSketchesEqual(columnar_summary_data.latency, summary_data.latency)
+            self.assertSketchesEqual(columnar_summary_data.response_bytes, summary_data.response_bytes)
+            for section, sketches in summary_data.section_2_sketches.items():
+                columnar_sketches = columnar_summary_data.section_2_sketches[section]
+                self.assertSketchesEqual(columnar_sketches[0], sketches[0])
+                self.assertSketchesEqual(columnar_sketches[1], sketches[1])
+
+    def test_more_sections_than_counted(self):
+        """popular sections are estimated within error bounds"""
+        rand = random.Random(3)
+        start = datetime.datetime(2000, 10, 10, 13, 55, 0)
+        linedatas = [LineData('host/%d' % int(rand.paretovariate(1)), 10, start, 200, 1.0)
+                     for _ in range(20000)]
+        section_2_hits = {}
+        for linedata in linedatas:
+            section_2_hits[linedata.section] = section_2_hits.get(linedata.section, 0) + 1
+        self.assertTrue(len(section_2_hits) > SummaryData.SECTIONS_FACTOR * 3)
+        summary_data = SummaryData(3)
+        for linedata in linedatas:
+            summary_data.insert_data(linedata)
+        summary_data.flush()
+        columnar = ColumnarAggregate(None, 3)
+        columnar.insert_lines(linedatas)
+        columnar.flush()
+        columnar_summary_data = columnar.interval_2_summary[0]
+        self.assertEqual(columnar_summary_data.section_hits.total, 20000)
+        tops = [data.section_hits.top(3) for data in [summary_data, columnar_summary_data]]
+        self.assertEqual([columnar_summary_data.section_names[key] for key, _, _ in tops[1]],
+                         [summary_data.section_names[key] for key, _, _ in tops[0]])
+        for data, top in zip([summary_data, columnar_summary_data], tops):
+            for key, hits, error in top:
+                section = data.section_names[key]
+                self.assertTrue(hits - error <= section_2_hits[section] <= hits)
+                latency = data.section_2_sketches[key][0]
+                self.assertTrue(latency.count <= section_2_hits[section])
+                if data is columnar_summary_data:
+                    self.assertEqual(latency.count, section_2_hits[section])
+
+
+class BackfillTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.logfilepath = os.path.join(self.tempdir, 'access-log')
+        logline_template = 'host - - [10/Oct/2000:13:55:%02d -0700] "GET /%s/b.gif HTTP/1.0" %d 10\n'
+        with open(self.logfilepath, 'w') as logfile:
+            for second in range(60):
+                for section in ['a', 'b', 'c'][:second % 4]:
+                    logfile.write(logline_template % (second, section, 200 + second))
+        self.min_chunk_size = backfill.MIN_CHUNK_SIZE
+
+    def tearDown(self):
+        backfill.MIN_CHUNK_SIZE = self.min_chunk_size
+        shutil.rmtree(self.tempdir)
+
+    def parse(self, num_chunks, logtype='common', logfilepath=None):
+        logfilepath = logfilepath or self.logfilepath
+        aggregate = backfill.ChunkAggregate(10, 10)
+        for start, end in backfill.chunk_ranges(logfilepath, num_chunks):
+            aggregate.merge(backfill.parse_chunk((logtype, logfilepath, start, end, 10, 10, False, False)))
+        return aggregate
+
+    def write_w3c(self):
+        """W3C log file whose fields change halfway through"""
+        logfilepath = os.path.join(self.tempdir, 'w3c-log')
+        with open(logfilepath, 'w') as logfile:
+            logfile.write('#Version: 1.0\n')
+            logfile.write('#Fields: date time cs-host cs-uri-stem sc-status sc-bytes time-taken\n')
+            for second in range(30):
+                for section in ['a', 'b', 'c'][:second % 4]:
+                    logfile.write('2000-10-10 13:55:%02d host /%s/b.gif %d 10 %d\n'
+                                  % (second, section, 200 + second, second))
+            logfile.write('#Fields: date time sc-bytes sc-status cs-uri-stem cs-host\n')
+            for second in range(30, 60):
+                for section in ['a', 'b', 'c'][:second % 4]:
+                    logfile.write('2000-10-10 13:55:%02d 20 %d /%s/b.gif other\n'
+                                  % (second, 200 + second, section))
+        return logfilepath
+
+    def test_chunks_match_whole_file(self):
+        backfill.MIN_CHUNK_SIZE = 100
+        whole = self.parse(1)
+        chunked = self.parse(7)
+        self.assertEqual(chunked.second_2_hits, whole.second_2_hits)
+        self.assertEqual(sorted(chunked.interval_2_summary), sorted(whole.interval_2_summary))
+        for interval, summary_data in whole.interval_2_summary.items():
+            chunked_summary_data = chunked.interval_2_summary[interval]
+            self.assertEqual(chunked_summary_data.section_hits.top(), summary_data.section_hits.top())
+            self.assertEqual(chunked_summary_data.bytes, summary_data.bytes)
+            self.assertEqual(chunked_summary_data.error_code_count, summary_data.error_code_count)
+        self.assertEqual(sum(whole.second_2_hits.values()), 90)
+
+    def test_w3c_chunks_match_single_process(self):
+        """chunks are parsed with the field directive in effect at their start"""
+        logfilepath = self.write_w3c()
+        logparser = W3CLogParser(logfilepath)
+        # read from the start, no field directive is in effect yet
+        logparser.fieldnames = []
+        with open(logfilepath) as logfile:
+            linedatas = logparser.parse_lines(logfile.read().splitlines())
+        whole = backfill.ChunkAggregate(10, 10)
+        whole.insert_lines(linedatas)
+        whole.flush()
+        self.assertEqual(sum(whole.second_2_hits.values()), 90)
+        intervals = sorted(whole.interval_2_summary)
+        first, last = whole.interval_2_summary[intervals[0]], whole.interval_2_summary[intervals[-1]]
+        self.assertEqual(first.section_hits.count(SECTION_TABLE.key('host/a')), 7)
+        self.assertEqual(last.section_hits.count(SECTION_TABLE.key('other/a')), 8)
+
+        backfill.MIN_CHUNK_SIZE = 100
+        chunks = backfill.chunk_ranges(logfilepath, 20)
+        self.assertTrue(len(chunks) > 10)
+        chunked = self.parse(20, 'w3c', logfilepath)
+        self.assertEqual(chunked.second_2_hits, whole.second_2_hits)
+        self.assertEqual(sorted(chunked.interval_2_summary), sorted(whole.interval_2_summary))
+        for interval, summary_data in whole.interval_2_summary.items():
+            chunked_summary_data = chunked.interval_2_summary[interval]
+            self.assertEqual(chunked_summary_data.section_hits.top(), summary_data.section_hits.top())
+            self.assertEqual(chunked_summary_data.bytes, summary_data.bytes)
+            self.assertEqual(chunked_summary_data.error_code_count, summary_data.error_code_count)
+            self.assertEqual(chunked_summary_data.latency.count, summary_data.latency.count)
+
+        # summaries of chunks parsed by worker processes
+        messages = []
+        class RecordingDisplay(object):
+            def show(self, message):
+                messages.append(message)
+        args = {'logtype': 'w3c', 'logfilepaths': [logfilepath], 'processes': 3,
+                'summaryinterval': 10, 'topsections': 10, 'perfile': False,
+                'columnar': False, 'rotated': False, 'hitsinterval': 120,
+                'hitsthreshold': 1000}
+        backfill.backfill(args, RecordingDisplay())
+        summary_notifier = SummaryNotifier(None, 10, 10)
+        expected = [summary_notifier.summary_message(whole.interval_2_summary[interval],
+                                                     seconds_to_datetime(interval * 10)).lines
+                    for interval in intervals]
+        self.assertEqual([message.lines for message in messages
+                          if message.type == MESSAGE_TYPES.summary], expected)
+
+    def test_alert_messages(self):
+        second_2_hits = {100: 3, 101: 3, 110: 1}
+        messages = list(backfill.alert_messages(second_2_hits, 5, 5))
+        # alert at 101, recovery when hits at 100 fall out of the window
+        self.assertEqual([second for second, _ in messages], [101, 106])
+
+
 if __name__ == '__main__':
     unittest.main()
 